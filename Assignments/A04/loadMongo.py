@@ -1,15 +1,57 @@
 """
 This file opens up the folder categoryJson and processes each json file
 adding the category name to each candy document and posting it to mongodb
+
+The files are parsed in parallel by a pool of worker processes, which feed a
+bounded queue. A writer stage drains the queue and inserts the candies in
+batches, so parsing and network I/O overlap.
 """
 
 from mongoManager import MongoManager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from queue import Queue
+import argparse
 import json
 import glob
+import time
 from rich import print
 from dotenv import load_dotenv
 import os
 
+DEFAULT_WORKERS: int = os.cpu_count() or 1
+DEFAULT_BATCH_SIZE: int = 500
+
+
+def parse_category_file(task: tuple[int, str]) -> tuple[dict, list[dict]]:
+    """Parses and normalizes one category file.
+
+    Runs in a worker process.
+
+    Args:
+        task (tuple[int, str]): The category id and the path of the file.
+    Returns:
+        The category summary and its candies.
+    """
+    i, file = task
+    parts = file.split("/")
+    category = parts[-1][:-5].replace("-", " ").title()
+
+    summary: dict = {"name": category, "id": int(i)}
+    candies: list[dict] = []
+
+    with open(file) as f:
+        data: dict = json.load(f)
+
+        for id, item in data.items():
+            item["id"] = int(id)
+            item["price"] = float(item["price"])
+            item["category"] = category
+            item["category_id"] = int(i)
+            candies.append(item)
+
+    return summary, candies
+
+
 def load_database(
     folder_path: str = "./",
     username: str = None,
@@ -19,13 +61,20 @@ def load_database(
     database: str = None,
     candy_collection: str = None,
     categories_collection: str = None,
-) -> None:
+    workers: int = DEFAULT_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """Loads the category files into the database.
+
+    Returns:
+        The time spent in each stage, in seconds.
+    """
 
     # Get absolute path
     folder_path = os.path.abspath(folder_path)
 
-    # Get list of paths to all json files
-    json_files = glob.glob(f"{folder_path}/*.json")
+    # Get list of paths to all json files, sorted so category ids are stable
+    json_files = sorted(glob.glob(f"{folder_path}/*.json"))
 
     db = MongoManager(
         username=username, password=password, host=host, port=port, database=database
@@ -39,41 +88,106 @@ def load_database(
 
     db.dropCollection(categories_collection)
 
-    i = 0
-
-    for file in json_files:
-        parts = file.split("/")
-        category = parts[-1][:-5].replace("-", " ").title()
-
-        summary:dict = {}
+    timings: dict = {"parse": 0.0, "write": 0.0, "wait": 0.0, "total": 0.0}
+    parsed: Queue = Queue(maxsize=workers * 2)
+    start: float = time.perf_counter()
+
+    def parse_files() -> None:
+        """Parses the files in parallel, in order, into the queue."""
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(parse_category_file, enumerate(json_files)):
+                    parsed.put(result)
+        finally:
+            timings["parse"] = time.perf_counter() - start
+            parsed.put(None)
+
+    def write(candies: list[dict]) -> None:
+        """Inserts a batch of candies."""
+        write_start: float = time.perf_counter()
+        db.setCollection(candy_collection)
+        db.post(candies)
+        timings["write"] += time.perf_counter() - write_start
+
+    with ThreadPoolExecutor(max_workers=1) as parser:
+        producer: Future = parser.submit(parse_files)
+
+        summaries: list[dict] = []
+        seen: set[int] = set()
+        batch: list[dict] = []
+        count: int = 0
+
+        try:
+            while True:
+                wait_start: float = time.perf_counter()
+                result: tuple[dict, list[dict]] | None = parsed.get()
+                timings["wait"] += time.perf_counter() - wait_start
+
+                if result is None:
+                    break
+
+                summary, candies = result
+                summaries.append(summary)
+
+                for item in candies:
+                    # Avoid inserting duplicates
+                    if item["id"] not in seen:
+                        seen.add(item["id"])
+                        batch.append(item)
+
+                while len(batch) >= batch_size:
+                    write(batch[:batch_size])
+                    count += batch_size
+                    batch = batch[batch_size:]
+        except BaseException:
+            # Unblock the parser before bailing out
+            while parsed.get() is not None:
+                pass
+            raise
+
+        # Surface any error raised while parsing
+        producer.result()
+
+    if batch:
+        write(batch)
+        count += len(batch)
 
-        with open(file) as f:
-            data:dict = json.load(f)
-
-            summary["name"] = category
-            summary["id"] = int(i)
+    db.setCollection(categories_collection)
+    db.post(summaries)
 
-            for id, item in data.items():
-                item["id"] = int(id)
-                item["category"] = category
-                item["category_id"] = int(i)
-                db.setCollection("candies")
+    timings["total"] = time.perf_counter() - start
 
-                if not db.get({"id": item["id"]}):
-                    db.post(item)
-        db.setCollection("categories")
-        db.post(summary)
-        i += 1
+    print(
+        f"{len(json_files)} files, {count} candies with {workers} workers: "
+        f"parse {timings['parse']:.2f}s, write {timings['write']:.2f}s, "
+        f"writer idle {timings['wait']:.2f}s, total {timings['total']:.2f}s"
+    )
+    return timings
 
 
 if __name__ == "__main__":
-    
-    ENV_PATH:str = "./.env"
+
+    ENV_PATH: str = "./.env"
 
     load_dotenv(ENV_PATH)
 
-    username:str = os.environ.get("CANDY_STORE_USER")
-    password:str = os.environ.get("CANDY_STORE_PASSWORD")
+    parser = argparse.ArgumentParser(description="Load the candy store database.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of processes parsing files.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of candies per insert.",
+    )
+    args = parser.parse_args()
+
+    username: str = os.environ.get("CANDY_STORE_USER")
+    password: str = os.environ.get("CANDY_STORE_PASSWORD")
 
     kwargs = {
         "folder_path": "./categoryJson",
@@ -84,6 +198,8 @@ if __name__ == "__main__":
         "categories_collection": "categories",
         "port": 27017,
         "host": "localhost",
+        "workers": args.workers,
+        "batch_size": args.batch_size,
     }
 
     load_database(**kwargs)
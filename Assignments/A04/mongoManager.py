@@ -108,10 +108,9 @@ class MongoManager:
         elif isinstance(document, list):
             results: InsertManyResult = self.collection.insert_many(document)
 
-            results.inserted_ids = [str(objId) for objId in results.inserted_ids]
             return {
                 "acknowledged": results.acknowledged,
-                "inserted_ids": str(results.inserted_ids),
+                "inserted_ids": [str(objId) for objId in results.inserted_ids],
             }
         else:
             raise PyMongoError(message="Invalid document")
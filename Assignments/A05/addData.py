@@ -2,7 +2,7 @@ from store_database import StoreDatabase
 import json
 from rich import print
 
-db = StoreDatabase("angel", "aB_1618401m", database="awesome_store", collection="items")
+db = StoreDatabase("angel", "aB_1618401m", database="awesome_store")
 
 with open("movies.json", "r") as file:
     data = json.load(file)
@@ -14,4 +14,4 @@ with open("movies.json", "r") as file:
     with open("movies.json", "w") as file:
         json.dump(data, file)
     
-    db.insert_many(data)
\ No newline at end of file
+    db.items.insert_many(data)
\ No newline at end of file
@@ -3,12 +3,19 @@
 Awesome Store API built with FastAPI.
 """
 
-from fastapi import FastAPI, Query, Path, Body
+from fastapi import FastAPI, Query, Path, Body, Request, WebSocket, WebSocketDisconnect
 from fastapi.exceptions import HTTPException
-from fastapi.responses import RedirectResponse, FileResponse, Response, JSONResponse
+from fastapi.responses import (
+    RedirectResponse,
+    FileResponse,
+    Response,
+    JSONResponse,
+    StreamingResponse,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from store_database import StoreDatabase
+from store_database import StoreDatabase, load_index_specs
+from async_store_database import AsyncStoreDatabase, AsyncStoreCollection
 from pymongo.errors import PyMongoError, ProtocolError, DuplicateKeyError
 from contextlib import asynccontextmanager
 import uvicorn
@@ -18,13 +25,49 @@ from rich import print
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 import requests
-from models import Item, User, Location, FileBody
-from hashlib import sha256
+from models import Item, User, Location, Viewport, FileBody
+from prefix_index import PrefixIndex
+from image_cache import ImageCache, CachedImage, VARIANT_FORMATS
+from PIL import Image
+from upload_store import (
+    UploadStore,
+    StoredUpload,
+    UploadTooLarge,
+    RASTER_CONTENT_TYPES,
+)
+from result_cache import ResultCache
+from serialization import FastJSONResponse, dumps, encode_chunks
+from catalog_mirror import CatalogMirror
+from location_buffer import LocationBuffer, BufferFull
+from location_history import ensure_history_collection, track_pipeline
+from location_hub import LocationHub, Subscription
+from passwords import PasswordHasher, HasherBusy
+from user_data_view import (
+    COMPLETE_FILTER,
+    apply_writes,
+    profile_update,
+    location_update,
+    profile_rebuild_pipeline,
+    location_rebuild_pipeline,
+)
+from geo import (
+    POSITION_FIELD,
+    POSITION_EXPRESSION,
+    geo_point,
+    near_pipeline,
+    viewport_filter,
+)
+from compression import CompressionMiddleware
+from conditional import ConditionalGetMiddleware, weak_etag, etag_matches
+from typing import AsyncIterator, BinaryIO, Callable, Literal
+from datetime import datetime, timedelta, timezone
 from email_validator import ValidatedEmail, validate_email, EmailNotValidError
 import re
 import base64
+import binascii
+from bson import json_util
 import os
-
+import asyncio
 
 # ██████   █████  ███████ ███████     ███    ███  ██████  ██████  ███████ ██      ███████
 # ██   ██ ██   ██ ██      ██          ████  ████ ██    ██ ██   ██ ██      ██      ██
@@ -46,6 +89,10 @@ TAGS_METADATA: list[dict[str, str]] = [
         "name": "Categories",
         "description": "Operations with categories.",
     },
+    {
+        "name": "Cache",
+        "description": "Statistics of the item result cache.",
+    },
     {
         "name": "Images",
         "description": "Retreiving images of items.",
@@ -75,7 +122,64 @@ This API returns awesome items. **Enough said**.
 <br>
 ![item](./static/assets/store.gif)
 """
-awesome_store_db: StoreDatabase = None
+NDJSON_MEDIA_TYPE: str = "application/x-ndjson"
+DEFAULT_PAGE_SIZE: int = 50
+MAX_PAGE_SIZE: int = 500
+# Fields clients may ask for with ?fields=, and named sets of them
+ITEM_FIELDS: set[str] = {"_id", *Item.model_fields}
+ITEM_FIELD_PRESETS: dict[str, list[str]] = {"card": ["_id", "name", "price", "img_url"]}
+USER_FIELDS: set[str] = set(User.model_fields) - {"password"}
+USER_FIELD_PRESETS: dict[str, list[str]] = {
+    "card": ["username", "first_name", "last_name"]
+}
+# Larger results are streamed from the database instead of being cached
+RESULT_CACHE_MAX_DOCUMENTS: int = 1000
+# Listings may change at any time, so clients revalidate them with their ETag
+LISTING_CACHE_CONTROL: str = "no-cache"
+# Categories only change with a new release
+CATEGORIES_CACHE_CONTROL: str = "public, max-age=86400, stale-while-revalidate=604800"
+COMPRESSION_MINIMUM_SIZE: int = 1024
+# Positions are only used for queries, responses keep the flat fields
+LOCATION_PROJECTION: dict = {"_id": 0, POSITION_FIELD: 0}
+USER_DATA_PROJECTION: dict = {"_id": 0, POSITION_FIELD: 0}
+# Seconds clients are asked to wait when password hashing is saturated
+PASSWORD_RETRY_AFTER: str = "1"
+DEFAULT_NEAR_RADIUS: float = 5000.0
+MAX_NEAR_RADIUS: float = 20_000_000.0
+DEFAULT_LOCATIONS_LIMIT: int = 100
+LOCATION_BATCH_MAX: int = 1000
+DEFAULT_HISTORY_WINDOW_MS: int = 24 * 60 * 60 * 1000
+DEFAULT_HISTORY_LIMIT: int = 1000
+MAX_HISTORY_LIMIT: int = 10000
+BASE_DIR: str = os.path.dirname(os.path.abspath(__file__))
+IMAGE_CACHE_DIR: str = os.path.join(BASE_DIR, "static", "image-cache")
+IMAGE_CACHE_CONTROL: str = "public, max-age=86400"
+IMAGE_TIMEOUT: float = 10.0
+IMAGE_MAX_SIZE: int = 2048
+# Size of the reads when sending a file from an open handle
+FILE_CHUNK_SIZE: int = 64 * 1024
+UPLOADED_IMAGES_DIR: str = os.path.join(BASE_DIR, "static", "uploaded-images")
+# Index and blobs of the upload store, outside of the statically served tree
+UPLOAD_STORE_DIR: str = os.path.join(BASE_DIR, "uploads")
+UPLOAD_MAX_BYTES: int = 20 * 1024**2
+# Uploads are never overwritten, but clients still revalidate with the ETag
+UPLOADED_IMAGES_CACHE_CONTROL: str = "public, max-age=3600"
+# Variants rendered ahead of time for the app's grids and detail screens
+COMMON_IMAGE_SIZES: list[tuple[int, int, str]] = [
+    (200, 200, "webp"),
+    (200, 200, "jpeg"),
+    (600, 600, "webp"),
+]
+awesome_store_db: AsyncStoreDatabase = None
+item_suggestions: PrefixIndex = PrefixIndex()
+image_cache: ImageCache = None
+upload_store: UploadStore = None
+result_cache: ResultCache = None
+catalog_mirror: CatalogMirror = None
+location_buffer: LocationBuffer = None
+location_history: AsyncStoreCollection = None
+location_hub: LocationHub = LocationHub()
+password_hasher: PasswordHasher = None
 
 
 # ██      ██ ███████ ███████ ███████ ██████   █████  ███    ██     ███████ ██    ██ ███████ ███    ██ ████████
@@ -93,12 +197,473 @@ async def lifespan(app: FastAPI):
     item_user: str = os.environ.get("STORE_USER")
     item_store_password = os.environ.get("STORE_PASSWORD")
 
+    # Connection pool and concurrency settings, per worker
+    max_pool_size: int = int(os.environ.get("STORE_MAX_POOL_SIZE", 100))
+    min_pool_size: int = int(os.environ.get("STORE_MIN_POOL_SIZE", 0))
+    timeout_ms: int = int(os.environ.get("STORE_TIMEOUT_MS", 5000))
+    wait_queue_timeout_ms: int = int(os.environ.get("STORE_WAIT_QUEUE_TIMEOUT_MS", 0))
+    max_concurrency: int = int(os.environ.get("STORE_MAX_CONCURRENCY", 0))
+
     global awesome_store_db
-    awesome_store_db = StoreDatabase(
-        item_user, item_store_password, database="awesome_store", collection="items"
+    awesome_store_db = AsyncStoreDatabase(
+        item_user,
+        item_store_password,
+        database="awesome_store",
+        max_pool_size=max_pool_size,
+        min_pool_size=min_pool_size,
+        timeout_ms=timeout_ms,
+        wait_queue_timeout_ms=wait_queue_timeout_ms or None,
+        max_concurrency=max_concurrency or None,
+    )
+    await awesome_store_db.connect()
+    for collection, indexes in load_index_specs().items():
+        created: list[str] = await awesome_store_db.get_collection(
+            collection
+        ).ensure_indexes(indexes)
+        if created:
+            print(f"Created indexes on {collection}: {', '.join(created)}")
+
+    # Locations stored before positions were added get one
+    await awesome_store_db.locations.update_many(
+        {POSITION_FIELD: {"$exists": False}},
+        [{"$set": {POSITION_FIELD: POSITION_EXPRESSION}}],
+    )
+
+    # GET /user-data reads the materialized join of users and locations,
+    # which is built on first start and kept current by the write routes
+    if (
+        os.environ.get("USER_DATA_REBUILD", "0") == "1"
+        or await awesome_store_db.user_data.find_one({}) is None
+    ):
+        await awesome_store_db.users.aggregate(profile_rebuild_pipeline())
+        await awesome_store_db.locations.aggregate(location_rebuild_pipeline())
+
+    global image_cache
+    image_cache = ImageCache(
+        IMAGE_CACHE_DIR,
+        max_disk_bytes=int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 512 * 1024**2)),
+        max_memory_bytes=int(os.environ.get("IMAGE_CACHE_MEMORY_BYTES", 32 * 1024**2)),
+        timeout=IMAGE_TIMEOUT,
+        # Resizing is CPU bound, so variants are rendered in worker processes
+        workers=int(os.environ.get("IMAGE_WORKERS", 2)),
+    )
+
+    global upload_store
+    upload_store = UploadStore(UPLOAD_STORE_DIR, UPLOADED_IMAGES_DIR)
+
+    # Password hashing is slow by design, so it gets its own bounded pool
+    # and sheds load instead of queueing behind a burst of logins
+    global password_hasher
+    password_hasher = PasswordHasher(
+        workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 2)),
+        max_queue=int(os.environ.get("PASSWORD_HASH_QUEUE", 32)),
+        n=int(os.environ.get("PASSWORD_SCRYPT_N", 2**14)),
+        r=int(os.environ.get("PASSWORD_SCRYPT_R", 8)),
+        p=int(os.environ.get("PASSWORD_SCRYPT_P", 1)),
+    )
+
+    # In memory per worker, or shared by every worker through Redis
+    global result_cache
+    result_cache = ResultCache.from_url(
+        os.environ.get("RESULT_CACHE_URL"),
+        ttl=float(os.environ.get("RESULT_CACHE_TTL", 30)),
+        max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 1024)),
+    )
+
+    # Build the autocomplete index over item names and tags
+    item_suggestions.build(
+        await awesome_store_db.items.find({}, {"name": 1, "tags": 1})
+    )
+
+    background_tasks: list[asyncio.Task] = []
+    # Opt in: every worker fetches every item image and renders the common
+    # variants, on each start and reload
+    if os.environ.get("IMAGE_PREGENERATE", "0") == "1":
+        background_tasks.append(asyncio.create_task(pregenerate_image_variants()))
+
+    # Location updates are coalesced in memory and written in bulk, and
+    # optionally appended to the location history
+    global location_buffer, location_history
+    if os.environ.get("LOCATION_HISTORY", "0") == "1":
+        retention_days: float = float(
+            os.environ.get("LOCATION_HISTORY_RETENTION_DAYS", 30)
+        )
+        location_history = await ensure_history_collection(
+            awesome_store_db, int(retention_days * 24 * 60 * 60) or None
+        )
+    location_buffer = LocationBuffer(
+        awesome_store_db.locations,
+        int(os.environ.get("LOCATION_BUFFER_MAX", 10000)),
+        float(os.environ.get("LOCATION_FLUSH_INTERVAL", 1.0)),
+        location_history,
+        awesome_store_db.user_data,
     )
+    background_tasks.append(asyncio.create_task(location_buffer.run()))
+
+    # Follows the items change stream, needs MongoDB to run as a replica set
+    if os.environ.get("CATALOG_MIRROR", "0") == "1":
+        global catalog_mirror
+        catalog_mirror = CatalogMirror(
+            os.environ.get(
+                "CATALOG_MIRROR_SNAPSHOT", os.path.join(BASE_DIR, "catalog_mirror.json")
+            )
+        )
+        catalog_mirror.on_change(on_item_change)
+        background_tasks.append(
+            asyncio.create_task(catalog_mirror.run(awesome_store_db.items))
+        )
+
     yield
-    awesome_store_db.close()
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await location_buffer.flush()
+    image_cache.close()
+    password_hasher.close()
+    upload_store.close()
+    await result_cache.close()
+    await awesome_store_db.close()
+
+
+async def on_item_change(id: str, before: dict | None, after: dict | None) -> None:
+    """
+    Keeps the caches built from items current with writes from any source.
+    """
+    if after is None:
+        item_suggestions.remove(id)
+    else:
+        item_suggestions.add(after)
+
+    await invalidate_items(
+        id, before and before.get("category"), after and after.get("category")
+    )
+
+
+async def pregenerate_image_variants(concurrency: int = 4) -> None:
+    """
+    Renders the common image sizes for every item image that isn't cached yet.
+    """
+    image_urls: list[str] = await awesome_store_db.items.distinct("img_url")
+    limiter: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+
+    async def pregenerate(img_url: str) -> None:
+        async with limiter:
+            for width, height, format in COMMON_IMAGE_SIZES:
+                try:
+                    await image_cache.get_variant(img_url, width, height, format)
+                except Exception as e:
+                    print(f"Failed to pregenerate image {img_url}: {e}")
+                    return
+
+    await asyncio.gather(*(pregenerate(img_url) for img_url in image_urls))
+
+
+# ███████ ████████ ██████  ███████  █████  ███    ███ ██ ███    ██  ██████
+# ██         ██    ██   ██ ██      ██   ██ ████  ████ ██ ████   ██ ██
+# ███████    ██    ██████  █████   ███████ ██ ████ ██ ██ ██ ██  ██ ██   ███
+#      ██    ██    ██   ██ ██      ██   ██ ██  ██  ██ ██ ██  ██ ██ ██    ██
+# ███████    ██    ██   ██ ███████ ██   ██ ██      ██ ██ ██   ████  ██████
+async def stream_documents(
+    request: Request,
+    key: str,
+    documents: AsyncIterator[dict],
+    extra: dict = None,
+    headers: dict[str, str] = None,
+    etag: str = None,
+) -> StreamingResponse | Response:
+    """
+    Streams documents straight from a database cursor.
+
+    Responds with {key: [...]} as JSON, or one document per line if the client
+    accepts NDJSON. The first document is fetched eagerly so that query errors
+    are raised before the response has started. Fields in extra are added to
+    the JSON object after the documents. Documents are encoded with orjson and
+    sent in large chunks rather than one send per document.
+
+    If etag is given, the response is tagged with it and a client that
+    already has it gets a 304 before any document is encoded.
+    """
+    ndjson: bool = NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+    if etag is not None:
+        etag = weak_etag(etag, NDJSON_MEDIA_TYPE if ndjson else "application/json")
+        headers = {
+            **(headers or {}),
+            "ETag": etag,
+            "Cache-Control": LISTING_CACHE_CONTROL,
+            "Vary": "Accept",
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+    try:
+        first: dict | None = await anext(documents)
+    except StopAsyncIteration:
+        first = None
+
+    async def all_documents() -> AsyncIterator[dict]:
+        if first is None:
+            return
+        yield first
+        async for doc in documents:
+            yield doc
+
+    if ndjson:
+        return StreamingResponse(
+            encode_chunks(all_documents(), terminator=b"\n"),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=headers,
+        )
+
+    end: bytes = b"]" + b"".join(
+        b"," + dumps(name) + b":" + dumps(value)
+        for name, value in (extra or {}).items()
+    )
+    return StreamingResponse(
+        encode_chunks(
+            all_documents(), b'{"' + key.encode() + b'":[', b",", end=end + b"}"
+        ),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def encode_cursor(sort: list[tuple], after: list) -> str:
+    """
+    Encodes the key of the next page as an opaque continuation token.
+    """
+    fields: list[str] = [field for field, _ in sort]
+    token: str = json_util.dumps({"sort": fields, "after": after})
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: list[tuple]) -> list:
+    """
+    Decodes a continuation token, checking it was issued for the same sort.
+    """
+    try:
+        token: bytes = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        decoded: dict = json_util.loads(token)
+        after: list = decoded["after"]
+        fields: list[str] = decoded["sort"]
+        if not isinstance(after, list):
+            raise TypeError(f"Cursor key is not a list: {after}")
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(400, "Invalid cursor.")
+
+    if fields != [field for field, _ in sort] or len(after) != len(sort):
+        raise HTTPException(400, "Cursor does not match this query.")
+    return after
+
+
+async def stream_page(
+    request: Request,
+    key: str,
+    collection: AsyncStoreCollection,
+    query: dict,
+    projection: dict,
+    sort: list[tuple],
+    page_size: int | None,
+    cursor: str | None,
+    scopes: list[str] = None,
+) -> StreamingResponse:
+    """
+    Responds with one page of documents, using keyset pagination.
+
+    The token for the following page is returned as next_cursor, and in the
+    X-Next-Cursor header for NDJSON. next_cursor is null on the last page.
+    Pages are cached if the result cache scopes are given, and tagged with
+    an ETag hashed from the page.
+    """
+    after: list | None = decode_cursor(cursor, sort) if cursor else None
+    page_size = page_size or DEFAULT_PAGE_SIZE
+
+    async def load_page() -> dict:
+        page, next_after = await collection.find_page(
+            query, projection, sort, page_size, after
+        )
+        return {
+            "documents": page,
+            "next_after": next_after,
+            "etag": weak_etag(dumps([page, next_after])),
+        }
+
+    if scopes is None:
+        result: dict = await load_page()
+    else:
+        result = await result_cache.get_or_load(
+            scopes,
+            {
+                "collection": collection.name,
+                "filter": query,
+                "projection": projection,
+                "sort": sort,
+                "page_size": page_size,
+                "after": after,
+            },
+            load_page,
+        )
+    next_cursor: str | None = (
+        encode_cursor(sort, result["next_after"])
+        if result["next_after"] is not None
+        else None
+    )
+
+    return await stream_documents(
+        request,
+        key,
+        iterate(result["documents"]),
+        extra={"next_cursor": next_cursor},
+        headers={"X-Next-Cursor": next_cursor} if next_cursor else None,
+        etag=result["etag"],
+    )
+
+
+async def read_file(
+    file: BinaryIO, chunk_size: int = FILE_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Yields the contents of an open file, closing it at the end.
+    """
+    try:
+        while chunk := await asyncio.to_thread(file.read, chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+async def iterate(
+    documents: list[dict], rest: AsyncIterator[dict] = None
+) -> AsyncIterator[dict]:
+    """
+    Yields documents already in memory, followed by the rest from a cursor.
+    """
+    for doc in documents:
+        yield doc
+    if rest is not None:
+        async for doc in rest:
+            yield doc
+
+
+def mirror_ready() -> bool:
+    """
+    Returns whether reads can be served from the catalog mirror.
+    """
+    return catalog_mirror is not None and catalog_mirror.ready
+
+
+def mirror_etag(request: Request) -> str:
+    """
+    Returns the ETag of a read served from the catalog mirror.
+
+    The mirror's version changes with every item, so a client's copy is
+    current as long as the version and the request are the same.
+    """
+    return weak_etag(catalog_mirror.version, request.url.path, request.url.query)
+
+
+def parse_fields(
+    fields: str | None, allowed: set[str], presets: dict[str, list[str]]
+) -> list[str] | None:
+    """
+    Parses a ?fields= parameter into a list of field names, None if not given.
+    """
+    if not fields:
+        return None
+
+    names: list[str] = []
+    for name in fields.split(","):
+        name = name.strip()
+        if name in presets:
+            names.extend(presets[name])
+        elif name in allowed:
+            names.append(name)
+        else:
+            raise HTTPException(
+                400,
+                f"Unknown field: {name}. Choose from {', '.join(sorted(allowed))} "
+                f"or a preset: {', '.join(presets)}.",
+            )
+    return list(dict.fromkeys(names))
+
+
+def fields_projection(fields: list[str] | None, projection: dict = {}) -> dict:
+    """
+    Returns the projection for a list of fields, or the default projection.
+    """
+    if fields is None:
+        return dict(projection)
+    return {
+        "_id": int("_id" in fields),
+        **{field: 1 for field in fields if field != "_id"},
+    }
+
+
+def select_fields(documents: list[dict], fields: list[str] | None) -> list[dict]:
+    """
+    Applies a list of fields to documents already in memory.
+    """
+    if fields is None:
+        return documents
+    return [
+        {field: doc[field] for field in fields if field in doc} for doc in documents
+    ]
+
+
+async def cached_documents(
+    scopes: list[str], query: dict, documents: Callable[[], AsyncIterator[dict]]
+) -> tuple[AsyncIterator[dict], str | None]:
+    """
+    Returns documents from the result cache, or from the database on a miss,
+    along with the ETag of the result.
+
+    Results of up to RESULT_CACHE_MAX_DOCUMENTS documents are cached, and
+    their ETag is a hash of the result, kept with it. Larger results are
+    streamed from the database as usual, without an ETag.
+    """
+    key: str = await result_cache.key(scopes, query)
+    cached: dict | None = await result_cache.get(key)
+
+    if cached is not None:
+        return iterate(cached["documents"]), cached["etag"]
+
+    cursor: AsyncIterator[dict] = documents()
+    buffer: list[dict] = []
+    async for doc in cursor:
+        buffer.append(doc)
+        if len(buffer) > RESULT_CACHE_MAX_DOCUMENTS:
+            return iterate(buffer, cursor), None
+
+    etag: str = weak_etag(dumps(buffer))
+    await result_cache.set(key, {"documents": buffer, "etag": etag}, scopes)
+    return iterate(buffer), etag
+
+
+def item_scopes(category: str = None, id: str = None) -> list[str]:
+    """
+    Returns the result cache scopes of an item read, or of an item write.
+
+    Reads pinned to a category or an id only depend on that category or id.
+    A write to an item touches its category, its id and every unpinned read.
+    """
+    if id is not None:
+        return [f"items:id:{id}"]
+    if category is not None:
+        return [f"items:category:{category}"]
+    return ["items"]
+
+
+async def invalidate_items(id: str = None, *categories: str) -> None:
+    """
+    Invalidates the cached item reads affected by a write to an item.
+    """
+    scopes: list[str] = ["items"]
+    if id is not None:
+        scopes += item_scopes(id=id)
+    for category in categories:
+        if category is not None:
+            scopes += item_scopes(category=category)
+    await result_cache.invalidate(scopes)
 
 
 # ███████  █████  ███████ ████████  █████  ██████  ██
@@ -108,6 +673,7 @@ async def lifespan(app: FastAPI):
 # ██      ██   ██ ███████    ██    ██   ██ ██      ██
 app: FastAPI = FastAPI(
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     openapi_tags=TAGS_METADATA,
     title=TITLE,
     root_path=ROOT_PATH,
@@ -125,8 +691,9 @@ app: FastAPI = FastAPI(
         "url": "https://www.apache.org/licenses/LICENSE-2.0.html",
     },
 )
-# Specifying directory for static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Tags whole responses with ETags, then compresses what is sent
+app.add_middleware(ConditionalGetMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
 
 
 # ██████   ██████  ██    ██ ████████ ███████ ███████
@@ -141,8 +708,13 @@ async def docs_redirect():
 
 
 @app.get("/items", tags=["Items"])
-def search_items(
+async def search_items(
+    request: Request,
     id: str = Query(None, description="ID of a item"),
+    search: str = Query(
+        None,
+        description="Words to search for in the name, tags and description of items. Results are ranked by relevance.",
+    ),
     name: str = Query(None, description="Keyword in name of a item"),
     desc: str = Query(None, description="Keyword in description of item"),
     min_price: float = Query(
@@ -156,15 +728,36 @@ def search_items(
     ),
     category: str = Query(None, description="Category of item"),
     tags: list[str] = Query(None, description="Tags associated with the item"),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, or a preset: card. Returns whole items if not given.",
+    ),
     skip: int = Query(0, description="Number of items to skip", ge=0),
     limit: int = Query(0, description="Limits the number of items to return", ge=0),
+    cursor: str = Query(
+        None, description="next_cursor returned with the previous page"
+    ),
+    page_size: int = Query(
+        None,
+        description=f"Number of items per page, {DEFAULT_PAGE_SIZE} if only cursor is given",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
 ) -> dict:
     """
     Search for items based on a query string (e.g., name, category, tags).
-    """
-    awesome_store_db.set_collection(StoreDatabase.Collections.ItemsCollection)
 
+    Pass page_size to page through the results: each page returns a
+    next_cursor to pass back for the following page, and the cost of a page
+    does not depend on how deep it is. Text searches are ranked by score and
+    still page with skip and limit.
+
+    Pass fields to only return some fields, e.g. fields=card for grid views.
+    """
+    selected: list[str] | None = parse_fields(fields, ITEM_FIELDS, ITEM_FIELD_PRESETS)
     query: dict = {}
+    projection: dict = fields_projection(selected)
+    sort: list[tuple] = [("_id", 1)]
 
     try:
         if id != None:
@@ -172,47 +765,163 @@ def search_items(
                 query["_id"] = StoreDatabase.str_to_object_id(id)
             else:
                 query["_id"] = id
+        if search:
+            # Uses the text index, best matches first
+            query["$text"] = {"$search": search}
+            projection["score"] = {"$meta": "textScore"}
+            sort = [("score", {"$meta": "textScore"}), ("_id", 1)]
         if name:
-            query["name"] = {"$regex": f"{name}", "$options": "i"}
+            query["name"] = {"$regex": re.escape(name), "$options": "i"}
         if desc:
-            query["desc"] = {"$regex": f"{desc}", "$options": "i"}
+            query["desc"] = {"$regex": re.escape(desc), "$options": "i"}
         if category:
             query["category"] = category
         if tags:
-            query["tags"] = {"$in": tags}
+            query["tags"] = {"$in": sorted(tags)}
 
         if max_price == None or min_price <= max_price:
             query["price"] = {"$gte": min_price, "$lte": max_price}
 
-        item_list: list[dict] = awesome_store_db.find(query, skip=skip, limit=limit)
-        return {"items": item_list}
+        if cursor is not None or page_size is not None:
+            if search:
+                raise HTTPException(
+                    422,
+                    "Text searches can't be paged with a cursor, use skip and limit.",
+                )
+            return await stream_page(
+                request,
+                "items",
+                awesome_store_db.items,
+                query,
+                projection,
+                sort,
+                page_size,
+                cursor,
+                scopes=item_scopes(category=category),
+            )
+
+        if mirror_ready() and not (id or search or name or desc):
+            # Same filters as the query, which skips the price range if inverted
+            in_range: bool = "price" in query
+            matches: list[dict] = catalog_mirror.select(
+                category,
+                tags,
+                min_price if in_range else None,
+                max_price if in_range else None,
+            )
+            end: int | None = skip + limit if limit else None
+            return await stream_documents(
+                request,
+                "items",
+                iterate(select_fields(matches[skip:end], selected)),
+                etag=mirror_etag(request),
+            )
+
+        items, etag = await cached_documents(
+            item_scopes(category=category),
+            {
+                "filter": query,
+                "projection": projection,
+                "sort": sort,
+                "skip": skip,
+                "limit": limit,
+            },
+            lambda: awesome_store_db.items.find_iter(
+                query, projection, skip=skip, limit=limit, sort=sort
+            ),
+        )
+        return await stream_documents(request, "items", items, etag=etag)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(422, f"{e}")
 
 
+@app.get("/items/suggest", tags=["Items"])
+async def suggest_items(
+    q: str = Query(..., description="Start of an item name or tag", min_length=1),
+    limit: int = Query(
+        10, description="Limits the number of suggestions to return", ge=1, le=50
+    ),
+):
+    """
+    Suggest items whose name or tags start with the given text, for search-as-you-type.
+    """
+    return {"suggestions": item_suggestions.suggest(q, limit)}
+
+
 @app.get("/items/category/{category}", tags=["Items"])
-def item_by_category(
+async def item_by_category(
+    request: Request,
     category: str = Path(description="Category name of item"),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, or a preset: card. Returns whole items if not given.",
+    ),
     skip: int = Query(0, description="Number of items to skip", ge=0),
     limit: int = Query(0, description="Limits the number of items to return", ge=0),
+    cursor: str = Query(
+        None, description="next_cursor returned with the previous page"
+    ),
+    page_size: int = Query(
+        None,
+        description=f"Number of items per page, {DEFAULT_PAGE_SIZE} if only cursor is given",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
 ) -> dict:
     """
     Get detailed information about items in a category by category name.
-    """
-    awesome_store_db.set_collection(StoreDatabase.Collections.ItemsCollection)
 
+    Pass page_size to page through the category with next_cursor tokens, and
+    fields to only return some fields.
+    """
+    selected: list[str] | None = parse_fields(fields, ITEM_FIELDS, ITEM_FIELD_PRESETS)
     query: dict = {"category": category}
+    projection: dict = fields_projection(selected)
 
     try:
-        item_list: list[dict] = awesome_store_db.find(query, skip=skip, limit=limit)
+        if cursor is not None or page_size is not None:
+            return await stream_page(
+                request,
+                "items",
+                awesome_store_db.items,
+                query,
+                projection,
+                [("_id", 1)],
+                page_size,
+                cursor,
+                scopes=item_scopes(category=category),
+            )
+
+        if mirror_ready():
+            end: int | None = skip + limit if limit else None
+            return await stream_documents(
+                request,
+                "items",
+                iterate(
+                    select_fields(catalog_mirror.category(category)[skip:end], selected)
+                ),
+                etag=mirror_etag(request),
+            )
+
+        items, etag = await cached_documents(
+            item_scopes(category=category),
+            {"filter": query, "projection": projection, "skip": skip, "limit": limit},
+            lambda: awesome_store_db.items.find_iter(
+                query, projection, skip=skip, limit=limit
+            ),
+        )
 
-        return {"items": item_list}
+        return await stream_documents(request, "items", items, etag=etag)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(422, f"{e}")
 
 
 @app.get("/items/id/{id}", tags=["Items"])
-def item_by_id(id: str = Path(..., description="The ID of the item to retrieve")):
+async def item_by_id(id: str = Path(..., description="The ID of the item to retrieve")):
     """
     Get detailed information about a specific item.
     """
@@ -220,9 +929,15 @@ def item_by_id(id: str = Path(..., description="The ID of the item to retrieve")
         raise HTTPException(404, detail="Not Found")
 
     try:
-        awesome_store_db.set_collection("items")
-        item: dict | None = awesome_store_db.find_one(
-            {"_id": StoreDatabase.str_to_object_id(id)}
+        if mirror_ready():
+            return {"item": catalog_mirror.get(id)}
+
+        item: dict | None = await result_cache.get_or_load(
+            item_scopes(id=id),
+            {"_id": id},
+            lambda: awesome_store_db.items.find_one(
+                {"_id": StoreDatabase.str_to_object_id(id)}
+            ),
         )
 
         return {"item": item}
@@ -231,65 +946,130 @@ def item_by_id(id: str = Path(..., description="The ID of the item to retrieve")
 
 
 @app.get("/image/id/{id}", tags=["Images"])
-async def item_image(id: str = Path(..., description="The ID of the item to retrieve")):
-    """
-    Get an item's image, given the ID.
+async def item_image(
+    request: Request,
+    id: str = Path(..., description="The ID of the item to retrieve"),
+    w: int = Query(
+        None, description="Maximum width of the image", ge=1, le=IMAGE_MAX_SIZE
+    ),
+    h: int = Query(
+        None, description="Maximum height of the image", ge=1, le=IMAGE_MAX_SIZE
+    ),
+    format: Literal[tuple(VARIANT_FORMATS)] = Query(
+        None, description="Format to re-encode the image in"
+    ),
+):
     """
-    awesome_store_db.set_collection("items")
+    Get an item's image, given the ID. Images are cached after the first request.
 
+    Passing w, h or format returns a resized and re-encoded variant instead of the
+    original. The image is scaled to fit within w x h, keeping its aspect ratio.
+    Responds with 502 if the image can't be fetched or decoded, and with 504
+    if its server doesn't answer in time.
+    """
     if not StoreDatabase.is_valid_object_id(id):
         raise HTTPException(404, detail="Not Found")
 
-    item: dict = awesome_store_db.find_one({"_id": StoreDatabase.str_to_object_id(id)})
+    item: dict = await awesome_store_db.items.find_one(
+        {"_id": StoreDatabase.str_to_object_id(id)}, {"img_url": 1}
+    )
 
     if not item:
         raise HTTPException(404, detail="Not Found")
 
+    async def load() -> tuple[CachedImage, BinaryIO | None]:
+        if w or h or format:
+            image: CachedImage = await image_cache.get_variant(
+                item["img_url"], w or 0, h or 0, format or "jpeg"
+            )
+        else:
+            image = await image_cache.get(item["img_url"])
+        if image.content is not None:
+            return image, None
+        # Opened now, so the file can be evicted while it is being sent
+        return image, await image_cache.open_file(image)
+
     try:
-        img_url: str = item["img_url"]
-        file_name: str = item["_id"]
-        image_response: requests.Response = requests.get(img_url)
-        headers = {"Content-Language": "English", "Content-Type": "image/jpg"}
-        headers["Content-Disposition"] = f"attachment;filename={file_name}.jpg"
-        return Response(image_response.content, media_type="image/jpg", headers=headers)
-    except Exception as e:
-        raise HTTPException(400, f"{e}")
+        try:
+            image, file = await load()
+        except FileNotFoundError:
+            # Evicted between the lookup and opening it, the lookup now misses
+            # and downloads or renders it again
+            image, file = await load()
+    except FileNotFoundError:
+        raise HTTPException(404, detail="Not Found")
+    # The upstream server is at fault, not the request
+    except requests.Timeout:
+        raise HTTPException(504, "Timed out fetching the image.")
+    except requests.RequestException:
+        raise HTTPException(502, "Failed to fetch the image.")
+    except (OSError, Image.DecompressionBombError):
+        raise HTTPException(502, "Failed to decode the image.")
+    except ValueError:
+        raise HTTPException(400, "Can't resize the image to this size.")
+
+    etag: str = f'"{image.etag}"'
+    headers: dict = {
+        "Content-Language": "English",
+        "ETag": etag,
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        if file is not None:
+            file.close()
+        return Response(status_code=304, headers=headers)
+
+    extension: str = os.path.splitext(image.path)[1]
+    headers["Content-Disposition"] = f"attachment;filename={item['_id']}{extension}"
+
+    if file is None:
+        return Response(image.content, media_type=image.content_type, headers=headers)
+    headers["Content-Length"] = str(os.fstat(file.fileno()).st_size)
+    return StreamingResponse(
+        read_file(file), media_type=image.content_type, headers=headers
+    )
 
 
 @app.post("/items", tags=["Items"])
-def add_new_item(
+async def add_new_item(
     item: Item = Body(description="For inserting a item record into the database"),
 ):
     """
     Add a new item to the store's inventory.
     """
-    awesome_store_db.set_collection(StoreDatabase.Collections.ItemsCollection)
-
     try:
-        result: dict = awesome_store_db.insert_one(dict(item))
+        result: dict = await awesome_store_db.items.insert_one(dict(item))
+        item_suggestions.add({"_id": result["inserted_id"], **dict(item)})
+        await invalidate_items(result["inserted_id"], item.category)
         return result
     except Exception as e:
         raise HTTPException(400, f"{e}")
 
 
 @app.put("/items/id/{id}", tags=["Items"])
-def update_item_info(
+async def update_item_info(
     id: str = Path(..., description="The ID of the item to update."),
     item_info: Item = Body(description="For updating the information of a item."),
 ):
     """
     Update information about an existing item. If item does not exist, insert new one.
     """
-    awesome_store_db.set_collection(StoreDatabase.Collections.ItemsCollection)
-
     if not StoreDatabase.is_valid_object_id(id):
         raise HTTPException(404, detail="Not Found")
     try:
-        result: dict = awesome_store_db.update_one(
+        previous: dict | None = await awesome_store_db.items.find_one(
+            {"_id": StoreDatabase.str_to_object_id(id)}, {"category": 1}
+        )
+        result: dict = await awesome_store_db.items.update_one(
             {"_id": StoreDatabase.str_to_object_id(id)},
             {"$set": dict(item_info)},
             upsert=True,
         )
+        item_suggestions.add({"_id": id, **dict(item_info)})
+        await invalidate_items(
+            id, item_info.category, previous and previous.get("category")
+        )
 
         return result
     except Exception as e:
@@ -297,78 +1077,121 @@ def update_item_info(
 
 
 @app.delete("/items/id/{id}", tags=["Items"])
-def delete_item(id: str = Path(..., description="The ID of the item to retrieve")):
+async def delete_item(
+    id: str = Path(..., description="The ID of the item to retrieve")
+):
     """
     Remove a item from the store's inventory.
     """
-    awesome_store_db.set_collection(StoreDatabase.Collections.ItemsCollection)
-
     if not StoreDatabase.is_valid_object_id(id):
         raise HTTPException(404, detail="Not Found")
 
     try:
-        result: dict = awesome_store_db.delete_one(
+        previous: dict | None = await awesome_store_db.items.find_one(
+            {"_id": StoreDatabase.str_to_object_id(id)}, {"category": 1}
+        )
+        result: dict = await awesome_store_db.items.delete_one(
             {"_id": StoreDatabase.str_to_object_id(id)}
         )
+        item_suggestions.remove(id)
+        await invalidate_items(id, previous and previous.get("category"))
         return result
     except Exception as e:
         raise HTTPException(400, f"{e}")
 
 
+@app.get("/cache/stats", tags=["Cache"])
+async def cache_stats():
+    """
+    Get the hit and miss counters of the item result cache.
+    """
+    return {
+        **result_cache.stats(),
+        "catalog_mirror": catalog_mirror.stats() if catalog_mirror else None,
+    }
+
+
 @app.get("/categories", tags=["Categories"])
-def all_categories():
+async def all_categories(response: Response):
     """
     Get a list of all item category information.
+
+    Categories only change with a release, so clients may cache them for a day.
     """
     try:
         category_list: list[dict] = [
             str(category) for category in StoreDatabase.Categories
         ]
+        response.headers["Cache-Control"] = CATEGORIES_CACHE_CONTROL
         return {"categories": category_list}
     except Exception as e:
         raise HTTPException(400, f"{e}")
 
 
+def hasher_busy(error: HasherBusy) -> HTTPException:
+    """
+    Returns the 503 response for a password hash refused by the hasher.
+    """
+    return HTTPException(
+        503, detail=f"{error}", headers={"Retry-After": PASSWORD_RETRY_AFTER}
+    )
+
+
+@app.get("/login/hasher/stats", tags=["Login and Registration"])
+async def password_hasher_stats():
+    """
+    Get the settings and counters of the password hashing pool.
+    """
+    return password_hasher.stats()
+
+
 @app.post("/login", tags=["Login and Registration"])
-def login(
+async def login(
     username: str = Body(description="Username of user."),
     password: str = Body(description="Password of user."),
 ):
     """
     Logging into the app.
-    """
-    awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
 
+    Passwords stored as unsalted SHA-256 or with outdated scrypt parameters
+    are rehashed on a successful login. Responds 503 if too many passwords
+    are being hashed.
+    """
     try:
-        # Hashing password
-        encoded_str: bytes = password.encode()
-        hashed_password: str = sha256(encoded_str).hexdigest()
-
-        result: dict = awesome_store_db.find_one({"username": username})
+        result: dict = await awesome_store_db.users.find_one({"username": username})
 
         if not result:
             return {"success": False, "detail": "Username does not exist"}
 
         result = dict(result)
 
-        success: bool = result.get("password") == hashed_password
+        success, rehashed = await password_hasher.verify(
+            password, result.get("password")
+        )
+
+        if rehashed is not None:
+            # Skipped if the password was changed since it was read
+            await awesome_store_db.users.update_one(
+                {"username": username, "password": result["password"]},
+                {"$set": {"password": rehashed}},
+            )
 
         if success:
             return {"success": success, "detail": "Login successful"}
         else:
             return {"success": False, "detail": "Incorrect password"}
 
+    except HasherBusy as e:
+        raise hasher_busy(e)
     except Exception as e:
         raise HTTPException(400, f"{e}")
 
 
 @app.post("/register", tags=["Login and Registration"])
-def register(user: User = Body(description="User information")):
+async def register(user: User = Body(description="User information")):
     """
     Registering as a new user for the app.
     """
-    awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
-
     try:
         name_pattern = re.compile(r"^[A-Z]([a-zA-z]*)(([ -])?[A-Z]([a-zA-z]*))*$")
 
@@ -389,9 +1212,11 @@ def register(user: User = Body(description="User information")):
         # Validate email
         emailinfo: ValidatedEmail = validate_email(user.email)
 
-        encoded_str: bytes = user.password.encode()
-        user.password = sha256(encoded_str).hexdigest()
-        result: dict = awesome_store_db.insert_one(dict(user))
+        user.password = await password_hasher.hash(user.password)
+        result: dict = await awesome_store_db.users.insert_one(dict(user))
+        await apply_writes(
+            awesome_store_db.user_data, [profile_update(user.username, dict(user))]
+        )
 
         return {"success": True, "detail": "Registration successful"}
     except EmailNotValidError as e:
@@ -404,34 +1229,68 @@ def register(user: User = Body(description="User information")):
             "success": False,
             "detail": "Username or email is already in use. Use a different username or email address",
         }
+    except HasherBusy as e:
+        raise hasher_busy(e)
     except Exception as e:
         return {"success": False, "detail": f"{e}"}
 
 
 @app.get("/users", tags=["Users"])
-def get_all_user_profiles():
+async def get_all_user_profiles(
+    request: Request,
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, or a preset: card. Returns whole profiles if not given.",
+    ),
+    cursor: str = Query(
+        None, description="next_cursor returned with the previous page"
+    ),
+    page_size: int = Query(
+        None,
+        description=f"Number of users per page, {DEFAULT_PAGE_SIZE} if only cursor is given",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+):
+    """
+    Returns the profiles of all users, or one page of them if page_size or
+    cursor is given. Pass fields to only return some fields.
+    """
+    selected: list[str] | None = parse_fields(fields, USER_FIELDS, USER_FIELD_PRESETS)
+    projection: dict = fields_projection(selected, {"_id": 0, "password": 0})
+
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
+        if cursor is not None or page_size is not None:
+            return await stream_page(
+                request,
+                "users",
+                awesome_store_db.users,
+                {},
+                projection,
+                [("username", 1)],
+                page_size,
+                cursor,
+            )
 
-        users: list[dict] = awesome_store_db.find({}, {"_id": 0, "password": 0})
+        users: AsyncIterator[dict] = awesome_store_db.users.find_iter({}, projection)
 
         # If user is found, return user profile data
-        return {"users": users}
+        return await stream_documents(request, "users", users)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(422, f"{e}")
 
 
 @app.get("/users/username/{username}", tags=["Users"])
-def get_user_profile(
+async def get_user_profile(
     username: str = Path(..., description="The username of the user.")
 ):
     """
     Returns user profile data for a given user.
     """
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
-
-        user: dict | None = awesome_store_db.find_one(
+        user: dict | None = await awesome_store_db.users.find_one(
             {"username": username}, {"_id": 0, "password": 0}
         )
 
@@ -448,7 +1307,7 @@ def get_user_profile(
 
 
 @app.put("/users/username/{username}", tags=["Users"])
-def update_user_data(
+async def update_user_data(
     username: str = Path(..., description="The username of the user."),
     first_name: str = Body(description="The first name of a user."),
     last_name: str = Body(description="The last name of a user."),
@@ -459,8 +1318,6 @@ def update_user_data(
     Update the user profile data of a given user.
     """
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
-
         name_pattern = re.compile(r"^[A-Z]([a-zA-z]*)(([ -])?[A-Z]([a-zA-z]*))*$")
 
         # Data validation
@@ -480,62 +1337,232 @@ def update_user_data(
         # Validate email
         emailinfo: ValidatedEmail = validate_email(email)
 
-        encoded_str: bytes = password.encode()
-        password = sha256(encoded_str).hexdigest()
+        password = await password_hasher.hash(password)
 
-        result: dict = awesome_store_db.update_one(
+        result: dict = await awesome_store_db.users.update_one(
             {"username": username},
             {"$set": {"email": email, "password": password}},
             upsert=False,
         )
+        if result["matched_count"]:
+            await apply_writes(
+                awesome_store_db.user_data,
+                [profile_update(username, {"email": email})],
+            )
 
         return result
+    except HasherBusy as e:
+        raise hasher_busy(e)
     except Exception as e:
         raise HTTPException(400, detail=f"{e}")
 
 
 # @app.delete("/users/username/{username}", tags=["Users"])
-# def remove_user_data(
+# async def remove_user_data(
 #     username: str = Path(..., description="The username of the user.")
 # ):
 #     """
 #     Remove a user's data from the user collection.
 #     """
 #     try:
-#         awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
-
-#         result: dict = awesome_store_db.delete_one({"username": username})
+#         result: dict = await awesome_store_db.users.delete_one({"username": username})
 #         return result
 #     except Exception as e:
 #         raise HTTPException(400, f"{e}")
 
 
 @app.get("/locations", tags=["Locations"])
-def get_all_location_data():
+async def get_all_location_data(
+    request: Request,
+    cursor: str = Query(
+        None, description="next_cursor returned with the previous page"
+    ),
+    page_size: int = Query(
+        None,
+        description=f"Number of locations per page, {DEFAULT_PAGE_SIZE} if only cursor is given",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+):
+    """
+    Returns the locations of all users, or one page of them if page_size or
+    cursor is given.
+    """
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.LocationsCollection)
+        if cursor is not None or page_size is not None:
+            return await stream_page(
+                request,
+                "locations",
+                awesome_store_db.locations,
+                {},
+                LOCATION_PROJECTION,
+                [("username", 1)],
+                page_size,
+                cursor,
+            )
 
-        locations: list[dict] = awesome_store_db.find({}, {"_id": 0})
+        locations: AsyncIterator[dict] = awesome_store_db.locations.find_iter(
+            {}, LOCATION_PROJECTION
+        )
 
         # If user is found, return user data
-        return {"locations": locations}
+        return await stream_documents(request, "locations", locations)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(422, f"{e}")
 
 
+@app.get("/locations/near", tags=["Locations"])
+async def get_nearby_location_data(
+    request: Request,
+    lat: float = Query(description="Latitude of the point.", ge=-90, le=90),
+    lon: float = Query(description="Longitude of the point.", ge=-180, le=180),
+    radius: float = Query(
+        DEFAULT_NEAR_RADIUS,
+        description="Largest distance from the point, in meters.",
+        gt=0,
+        le=MAX_NEAR_RADIUS,
+    ),
+    limit: int = Query(
+        DEFAULT_LOCATIONS_LIMIT,
+        description="Largest number of locations to return.",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+):
+    """
+    Returns the locations of the users nearest to a point, nearest first,
+    with their distance in meters.
+    """
+    try:
+        locations: AsyncIterator[dict] = awesome_store_db.locations.aggregate_iter(
+            near_pipeline(lat, lon, radius, limit, LOCATION_PROJECTION),
+            batch_size=limit,
+        )
+
+        return await stream_documents(request, "locations", locations)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(422, f"{e}")
+
+
+@app.get("/locations/within", tags=["Locations"])
+async def get_viewport_location_data(
+    request: Request,
+    south: float = Query(description="Latitude of the bottom edge.", ge=-90, le=90),
+    west: float = Query(description="Longitude of the left edge.", ge=-180, le=180),
+    north: float = Query(description="Latitude of the top edge.", ge=-90, le=90),
+    east: float = Query(
+        description="Longitude of the right edge, less than west to cross the antimeridian.",
+        ge=-180,
+        le=180,
+    ),
+    limit: int = Query(
+        DEFAULT_LOCATIONS_LIMIT,
+        description="Largest number of locations to return.",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+):
+    """
+    Returns the locations of the users inside a map viewport.
+    """
+    if south >= north or west == east:
+        raise HTTPException(400, "The viewport must have a height and a width.")
+
+    try:
+        locations: AsyncIterator[dict] = awesome_store_db.locations.find_iter(
+            viewport_filter(south, west, north, east),
+            LOCATION_PROJECTION,
+            limit=limit,
+            # Unsorted, so the 2dsphere index answers the query on its own
+            sort=None,
+            batch_size=limit,
+        )
+
+        return await stream_documents(request, "locations", locations)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(422, f"{e}")
+
+
+@app.get("/locations/live/stats", tags=["Locations"])
+async def live_location_stats():
+    """
+    Get the number of live location subscribers and the update counters.
+    """
+    return location_hub.stats()
+
+
+@app.websocket("/locations/live")
+async def live_locations(websocket: WebSocket):
+    """
+    Pushes location updates as they are written.
+
+    Each message sent is {"locations": [...]} with the username, latitude,
+    longitude and timestamp of the users that moved since the last one.
+    Clients receive every update until they send {"viewport": {"south",
+    "west", "north", "east"}}, and {"viewport": null} to receive every
+    update again. A slow client gets the latest location of each user
+    rather than every update.
+    """
+    await websocket.accept()
+    subscription: Subscription = location_hub.subscribe()
+
+    async def send_updates() -> None:
+        while True:
+            batch: list[dict] = await subscription.next_batch()
+            await websocket.send_text(dumps({"locations": batch}).decode())
+
+    sender: asyncio.Task = asyncio.create_task(send_updates())
+    try:
+        while True:
+            text: str = await websocket.receive_text()
+            try:
+                message: dict = json.loads(text)
+                viewport: Viewport | None = (
+                    Viewport.model_validate(message["viewport"])
+                    if message.get("viewport") is not None
+                    else None
+                )
+            except (KeyError, AttributeError, ValueError) as e:
+                await websocket.send_json({"error": f"Invalid message: {e}"})
+                continue
+            location_hub.set_viewport(
+                subscription,
+                (
+                    (viewport.south, viewport.west, viewport.north, viewport.east)
+                    if viewport is not None
+                    else None
+                ),
+            )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        location_hub.unsubscribe(subscription)
+
+
 @app.get("/locations/username/{username}", tags=["Locations"])
-def get_location_data(
+async def get_location_data(
     username: str = Path(..., description="The username of the user.")
 ):
     """
-    Returns location data for a given user.
+    Returns location data for a given user, including an update that is
+    still waiting to be written.
     """
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.LocationsCollection)
-
-        location: dict | None = awesome_store_db.find_one(
-            {"username": username}, {"_id": 0}
+        location: dict | None = await awesome_store_db.locations.find_one(
+            {"username": username}, LOCATION_PROJECTION
         )
+        pending: dict | None = location_buffer.get(username)
+        if pending is not None and (
+            location is None or pending["timestamp"] > location["timestamp"]
+        ):
+            location = pending
 
         # If user is not found, report 404
         if location is None:
@@ -549,8 +1576,67 @@ def get_location_data(
         raise HTTPException(422, f"{e}")
 
 
+@app.get("/locations/username/{username}/history", tags=["Locations"])
+async def get_location_history(
+    request: Request,
+    username: str = Path(..., description="The username of the user."),
+    start: int = Query(
+        None,
+        description="UNIX timestamp in milliseconds of the start of the window. A day before end if not given.",
+    ),
+    end: int = Query(
+        None,
+        description="UNIX timestamp in milliseconds of the end of the window. Now if not given.",
+    ),
+    interval: int = Query(
+        None,
+        description="Seconds per point, to downsample long tracks. Every point if not given.",
+        ge=1,
+    ),
+    limit: int = Query(
+        DEFAULT_HISTORY_LIMIT,
+        description="Largest number of points to return.",
+        ge=1,
+        le=MAX_HISTORY_LIMIT,
+    ),
+):
+    """
+    Returns the track of a user over a time window, oldest point first.
+
+    With interval, only the last point of each interval is returned, along
+    with the number of points it stands for. Needs LOCATION_HISTORY=1.
+    """
+    if location_history is None:
+        raise HTTPException(404, "Location history is not enabled.")
+
+    end_time: datetime = (
+        datetime.fromtimestamp(end / 1000, tz=timezone.utc)
+        if end is not None
+        else datetime.now(timezone.utc)
+    )
+    start_time: datetime = (
+        datetime.fromtimestamp(start / 1000, tz=timezone.utc)
+        if start is not None
+        else end_time - timedelta(milliseconds=DEFAULT_HISTORY_WINDOW_MS)
+    )
+    if start_time >= end_time:
+        raise HTTPException(400, "start must be before end.")
+
+    try:
+        points: AsyncIterator[dict] = location_history.aggregate_iter(
+            track_pipeline(username, start_time, end_time, interval, limit),
+            batch_size=min(limit, MAX_PAGE_SIZE),
+        )
+
+        return await stream_documents(request, "history", points)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(422, f"{e}")
+
+
 @app.put("/locations/username/{username}", tags=["Locations"])
-def update_location_data(
+async def update_location_data(
     username: str = Path(..., description="The username of the user."),
     latitude: float = Body(description="The latitude of the user."),
     longitude: float = Body(description="The longitude of the user."),
@@ -560,45 +1646,83 @@ def update_location_data(
 ):
     """
     Update the location data of a given user.
+
+    The update is buffered and written with the next flush, within
+    LOCATION_FLUSH_INTERVAL seconds. Updates older than the stored location
+    are dropped.
+
+    Responds with {"acknowledged": true, "buffered": true} as soon as the
+    update is buffered, instead of the result of the write as it used to.
+    Reads from this worker see the update right away, but an acknowledged
+    update is lost if the process dies before the next flush. Responds with
+    503 if updates can't be buffered because flushes are failing.
     """
+    location: dict = {
+        "username": username,
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": timestamp,
+    }
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.LocationsCollection)
+        await location_buffer.add(location)
+    except BufferFull as e:
+        raise HTTPException(503, detail=f"{e}")
 
-        result: dict = awesome_store_db.update_one(
-            {"username": username},
-            {
-                "$set": {
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "timestamp": timestamp,
-                }
-            },
-            upsert=True,
+    location_hub.publish(location)
+    return {"acknowledged": True, "buffered": True}
+
+
+@app.post("/locations/batch", tags=["Locations"])
+async def post_location_batch(
+    locations: list[Location] = Body(
+        description=f"Location updates, at most {LOCATION_BATCH_MAX}, of one or more users."
+    ),
+):
+    """
+    Update the locations of many users, or many fixes of one user, at once.
+
+    Updates are buffered like PUT /locations/username/{username}, and only
+    the latest update of each user is written.
+    """
+    if len(locations) > LOCATION_BATCH_MAX:
+        raise HTTPException(
+            413, f"A batch can have at most {LOCATION_BATCH_MAX} locations."
         )
 
-        return result
-    except Exception as e:
-        raise HTTPException(400, detail=f"{e}")
+    try:
+        for location in locations:
+            await location_buffer.add(dict(location))
+            location_hub.publish(dict(location))
+    except BufferFull as e:
+        raise HTTPException(503, detail=f"{e}")
+
+    return {"acknowledged": True, "buffered": len(locations)}
+
+
+@app.get("/locations/buffer/stats", tags=["Locations"])
+async def location_buffer_stats():
+    """
+    Get the counters of the location write buffer and the latency of its flushes.
+    """
+    return location_buffer.stats()
 
 
 # @app.delete("/locations/username/{username}", tags=["Locations"])
-# def remove_location_data(
+# async def remove_location_data(
 #     username: str = Path(..., description="The username of the user.")
 # ):
 #     """
 #     Remove a user's location data from the locations collection.
 #     """
 #     try:
-#         awesome_store_db.set_collection(StoreDatabase.Collections.LocationsCollection)
-
-#         result: dict = awesome_store_db.delete_one({"username": username})
+#         result: dict = await awesome_store_db.locations.delete_one({"username": username})
 #         return result
 #     except Exception as e:
 #         raise HTTPException(400, f"{e}")
 
 
 @app.post("/locations", tags=["Locations"])
-def post_location_data(
+async def post_location_data(
     location: Location = Body(
         description="For inserting a item record into the database"
     ),
@@ -606,89 +1730,233 @@ def post_location_data(
     """
     Add a new user's location to the location collection.
     """
-    awesome_store_db.set_collection(StoreDatabase.Collections.LocationsCollection)
-
     try:
-        result: dict = awesome_store_db.insert_one(dict(location))
+        result: dict = await awesome_store_db.locations.insert_one(
+            {
+                **dict(location),
+                POSITION_FIELD: geo_point(location.latitude, location.longitude),
+            }
+        )
+        await apply_writes(
+            awesome_store_db.user_data, [location_update(dict(location))]
+        )
+        location_hub.publish(dict(location))
         return result
     except Exception as e:
         raise HTTPException(400, f"{e}")
 
 
 @app.get("/user-data", tags=["Users"])
-def get_all_user_data():
-    """
-    Get complete user data, profile data and location data.
-    """
-    pipeline: list[dict] = [
-        {
-            "$lookup": {
-                "from": str(
-                    StoreDatabase.Collections.LocationsCollection
-                ),  # The collection to join with
-                "localField": "username",  # Field from the local collection
-                "foreignField": "username",  # Field from the foreign collection
-                "as": "user_data",  # Name for the new array field
-            }
-        },
-        {
-            "$unwind": "$user_data"  # Deconstruct the product array field created by $lookup
-        },
-        {
-            "$project": {
-                "_id": 0,  # Exclude _id field from output
-                "username": 1,
-                "first_name": 1,
-                "last_name": 1,
-                "email": 1,
-                "latitude": "$user_data.latitude",  # Include latitude from the joined data
-                "longitude": "$user_data.longitude",  # Include longitude from the joined data
-                "timestamp": "$user_data.timestamp",
-            }
-        },
-    ]
+async def get_all_user_data(
+    request: Request,
+    south: float = Query(
+        None, description="Latitude of the bottom edge of a viewport.", ge=-90, le=90
+    ),
+    west: float = Query(
+        None, description="Longitude of the left edge of a viewport.", ge=-180, le=180
+    ),
+    north: float = Query(
+        None, description="Latitude of the top edge of a viewport.", ge=-90, le=90
+    ),
+    east: float = Query(
+        None,
+        description="Longitude of the right edge of a viewport, less than west to cross the antimeridian.",
+        ge=-180,
+        le=180,
+    ),
+    cursor: str = Query(
+        None, description="next_cursor returned with the previous page"
+    ),
+    page_size: int = Query(
+        None,
+        description=f"Number of users per page, {DEFAULT_PAGE_SIZE} if only cursor is given",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+):
+    """
+    Get complete user data, profile data and location data, of the users
+    that have both. Pass page_size or cursor for one page of users, and
+    south, west, north and east for only the users inside a map viewport.
+    """
+    viewport: list[float | None] = [south, west, north, east]
+    query: dict = COMPLETE_FILTER
+    if any(edge is not None for edge in viewport):
+        if any(edge is None for edge in viewport):
+            raise HTTPException(400, "A viewport needs south, west, north and east.")
+        if south >= north or west == east:
+            raise HTTPException(400, "The viewport must have a height and a width.")
+        query = {**COMPLETE_FILTER, **viewport_filter(south, west, north, east)}
 
     try:
-        awesome_store_db.set_collection(StoreDatabase.Collections.UsersCollection)
+        if cursor is not None or page_size is not None:
+            return await stream_page(
+                request,
+                "user_data",
+                awesome_store_db.user_data,
+                query,
+                USER_DATA_PROJECTION,
+                [("username", 1)],
+                page_size,
+                cursor,
+            )
 
-        user_data: list[dict] = awesome_store_db.aggregate(pipeline)
+        user_data: AsyncIterator[dict] = awesome_store_db.user_data.find_iter(
+            query, USER_DATA_PROJECTION, sort=[("username", 1)]
+        )
 
-        return {"user_data": user_data}
+        return await stream_documents(request, "user_data", user_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(400, f"{e}")
 
 
-@app.get("/uploaded-images/{file_path}", tags=["Images"])
-def get_uploaded_image(
-    file_path: str = Path(..., description="File path of the image.")
+@app.get("/uploaded-images/{file_path:path}", tags=["Images"])
+async def get_uploaded_image(
+    request: Request,
+    file_path: str = Path(..., description="File path of the image."),
 ):
+    """
+    Get an image uploaded by a user.
+
+    The file is sent without being read into memory, and Range requests are
+    supported for partial and resumed downloads. The ETag is the SHA-256 of
+    the file. Files that aren't PNG, JPEG, GIF or WebP images are sent as
+    attachments.
+
+    This is the URL of an upload, they are no longer served from
+    /static/uploaded-images, which redirects here.
+    """
+    try:
+        upload: StoredUpload | None = await upload_store.lookup(file_path)
+        if upload is None:
+            raise HTTPException(404, f"Image not found: {file_path}")
+        stat_result: os.stat_result = await asyncio.to_thread(os.stat, upload.path)
+    except FileNotFoundError:
+        raise HTTPException(404, f"Image not found: {file_path}")
+    except OSError as e:
+        raise HTTPException(500, f"Failed to read image. {file_path}")
+
+    etag: str = f'"{upload.sha256}"'
+    headers: dict[str, str] = {
+        "ETag": etag,
+        "Cache-Control": UPLOADED_IMAGES_CACHE_CONTROL,
+        "X-Content-Type-Options": "nosniff",
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        upload.path,
+        headers=headers,
+        media_type=upload.content_type,
+        filename=upload.file_name,
+        # Only images the browser can't run scripts from are shown inline
+        content_disposition_type=(
+            "inline" if upload.content_type in RASTER_CONTENT_TYPES else "attachment"
+        ),
+        stat_result=stat_result,
+    )
 
-    pass
+
+@app.get(
+    "/static/uploaded-images/{file_path:path}",
+    tags=["Images"],
+    include_in_schema=False,
+)
+async def get_static_uploaded_image(request: Request, file_path: str):
+    """
+    Redirect the old URL of an uploaded image to GET /uploaded-images.
+
+    Uploads used to be served from the static directory, but are now kept
+    outside it, so clients that still build this URL are sent to the new
+    one.
+    """
+    return RedirectResponse(
+        request.url_for("get_uploaded_image", file_path=file_path), status_code=301
+    )
 
 
 @app.post("/uploaded-images", tags=["Images"])
 async def upload_image(
     file: FileBody = Body(description="Request body for a file sent as base64."),
 ):
+    """
+    Upload an image sent as base64 in a JSON body.
 
+    Kept for older clients, prefer PUT /uploaded-images/{file_name}, which
+    streams the raw bytes instead of decoding the whole file in memory.
+    """
     file_bytes: bytes = base64.decodebytes(file.base64_content.encode(encoding="ascii"))
 
-    BASE_DIR: str = os.path.dirname(os.path.abspath(__file__))
-
-    save_path: str = os.path.join(BASE_DIR, "static", "uploaded-images", file.file_name)
-
-    if os.path.exists(save_path):
-        return {"detail": "Image already exists."}
+    async def chunks() -> AsyncIterator[bytes]:
+        yield file_bytes
 
     try:
-        with open(save_path, "wb") as output_file:
-            output_file.write(file_bytes)
+        await upload_store.save(chunks(), file.file_name, max_bytes=UPLOAD_MAX_BYTES)
+    except FileExistsError:
+        return {"detail": "Image already exists."}
     except Exception as e:
         return {"detail": f"Failed to upload image. {file.file_name}"}
 
     return {"detail": f"Successfully uploaded {file.file_name}"}
 
 
+@app.put("/uploaded-images/{file_name}", tags=["Images"])
+async def stream_upload_image(
+    request: Request,
+    file_name: str = Path(..., description="Name to store the image under."),
+):
+    """
+    Upload an image as the raw request body.
+
+    The body is streamed to disk as it arrives and only becomes visible once
+    it is complete. Its content type is sniffed from its bytes, only PNG,
+    JPEG, GIF and WebP images are stored as images. Images already stored under another name are not stored
+    again. Responds with the size and SHA-256 of the image.
+    """
+    content_type: str = request.headers.get("content-type", "application/octet-stream")
+    if not content_type.startswith(("image/", "application/octet-stream")):
+        raise HTTPException(415, f"Unsupported content type: {content_type}")
+
+    content_length: str | None = request.headers.get("content-length")
+    if (
+        content_length
+        and content_length.isdigit()
+        and int(content_length) > UPLOAD_MAX_BYTES
+    ):
+        raise HTTPException(413, f"Image is larger than {UPLOAD_MAX_BYTES} bytes.")
+
+    try:
+        upload: StoredUpload = await upload_store.save(
+            request.stream(),
+            file_name,
+            UPLOAD_MAX_BYTES,
+        )
+    except FileExistsError:
+        raise HTTPException(409, "Image already exists.")
+    except UploadTooLarge:
+        raise HTTPException(413, f"Image is larger than {UPLOAD_MAX_BYTES} bytes.")
+    except ValueError as e:
+        raise HTTPException(400, f"{e}")
+    except OSError as e:
+        raise HTTPException(500, f"Failed to upload image. {file_name}")
+
+    return {
+        "detail": f"Successfully uploaded {file_name}",
+        "size": upload.size,
+        "sha256": upload.sha256,
+        "deduplicated": upload.deduplicated,
+    }
+
+
+# Specifying directory for static files, mounted after the routes so the
+# redirect from /static/uploaded-images comes first
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+
 if __name__ == "__main__":
     load_dotenv(ENV_PATH)
 
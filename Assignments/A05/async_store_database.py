@@ -0,0 +1,642 @@
+"""Provides easy-to-use asyncio class for database operations.
+
+Provides the classes AsyncStoreDatabase and AsyncStoreCollection, the asyncio
+counterparts of StoreDatabase and StoreCollection, built on PyMongo's native
+asyncio client so the API can await database operations without tying up a
+thread per request.
+"""
+
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.cursor import AsyncCursor
+from pymongo.asynchronous.command_cursor import AsyncCommandCursor
+from pymongo.asynchronous.change_stream import AsyncChangeStream
+from pymongo.results import (
+    InsertOneResult,
+    InsertManyResult,
+    DeleteResult,
+    UpdateResult,
+    BulkWriteResult,
+)
+from pymongo.errors import ConnectionFailure, OperationFailure
+from rich import print
+from bson.objectid import ObjectId
+from contextlib import nullcontext
+from typing import AsyncIterator
+import asyncio
+from store_database import (
+    StoreDatabase,
+    DEFAULT_BATCH_SIZE,
+    convert_object_ids,
+    plain_raw_result,
+    keyset_filter,
+    keyset_after,
+    keyset_projection,
+    keyset_hidden,
+)
+
+
+class AsyncStoreCollection:
+    """Performs operations on a collection, asynchronously.
+
+    Handle for one collection of the database. Handles hold no mutable state,
+    so one handle can be shared by every task.
+    """
+
+    __slots__ = ("_collection", "_limiter")
+
+    def __init__(
+        self,
+        collection: AsyncCollection,
+        limiter: asyncio.Semaphore | nullcontext = nullcontext(),
+    ) -> None:
+        """Wraps a collection.
+
+        Args:
+            collection (AsyncCollection): The pymongo collection to operate on.
+            limiter (asyncio.Semaphore, optional): Limits in-flight operations, shared with the database.
+        """
+        object.__setattr__(self, "_collection", collection)
+        object.__setattr__(self, "_limiter", limiter)
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    @property
+    def name(self) -> str:
+        """Name of the collection."""
+        return self._collection.name
+
+    @property
+    def collection(self) -> AsyncCollection:
+        """The underlying pymongo collection."""
+        return self._collection
+
+    async def create_index(self, keys: list[tuple] | dict, **kwargs) -> str:
+        """Creates an index.
+
+        Creates an index on the collection, does nothing if it already exists.
+
+        Args:
+            keys (list[tuple], dict): Fields of the index and their direction or type.
+            **kwargs: Index options, such as unique, name or weights.
+        Returns:
+            Name of the index.
+        """
+        async with self._limiter:
+            return await self._collection.create_index(keys, **kwargs)
+
+    async def ensure_indexes(self, indexes: list[dict]) -> list[str]:
+        """Creates the indexes of a spec that are missing.
+
+        Args:
+            indexes (list[dict]): create_index keyword arguments, each with a name.
+        Returns:
+            Names of the indexes that were created.
+        """
+        async with self._limiter:
+            existing: dict = await self._collection.index_information()
+        created: list[str] = []
+
+        for index in indexes:
+            if index["name"] in existing:
+                continue
+            try:
+                async with self._limiter:
+                    created.append(await self._collection.create_index(**index))
+            except OperationFailure as e:
+                print(
+                    f"[red]Could not create index {index['name']} on {self.name}: {e}"
+                )
+
+        return created
+
+    async def distinct(self, key: str, filter: dict = {}) -> list[str]:
+        """Returns distinct values in a collection.
+
+        Returns distinct values in a collecion.
+
+        Args:
+            key (str): The key / field name to inspect.
+            filter (dict, optional): Other filters to apply.
+        Returns:
+            A list of distinct values for a given key.
+        """
+        async with self._limiter:
+            return await self._collection.distinct(key, filter)
+
+    async def find_one(self, filter: dict = {}, projection: dict = {}) -> dict | None:
+        """Return one matching document.
+
+        Returns one matching document for a given query.
+
+        Args:
+            filter (dict): Filter for query.
+            projection (dict, optional): Specifies what fields to include, exclude, etc.
+        Returns:
+            A dict for the matching document.
+        """
+        async with self._limiter:
+            result: dict | None = await self._collection.find_one(filter, projection)
+
+        if result:
+            result = convert_object_ids(result)
+        return result
+
+    async def find(
+        self,
+        filter: dict = {},
+        projection: dict = {},
+        skip: int = 0,
+        limit: int = 0,
+        sort: list[tuple] = [("_id", 1)],
+    ) -> list[dict]:
+        """Returns matching documents.
+
+        Retrieves documents from the collection based on the provided criteria.
+
+        Args:
+            filter (dict, optional): Filter for the query.
+            projection (dict, optional): Project for the results.
+            skip (int, optional): Number of documents to skip.
+            limit (int, optional): Number of documents to return. Limit of 0 returns all matches.
+            sort (list[tuple], optional): Criteria for sorting documents.
+        Returns:
+            List of matching documents.
+        """
+        return [
+            doc async for doc in self.find_iter(filter, projection, skip, limit, sort)
+        ]
+
+    async def find_iter(
+        self,
+        filter: dict = {},
+        projection: dict = {},
+        skip: int = 0,
+        limit: int = 0,
+        sort: list[tuple] = [("_id", 1)],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> AsyncIterator[dict]:
+        """Yields matching documents.
+
+        Streams documents from the collection batch by batch. The concurrency
+        limit is held per batch rather than for the life of the cursor.
+
+        Args:
+            filter (dict, optional): Filter for the query.
+            projection (dict, optional): Project for the results.
+            skip (int, optional): Number of documents to skip.
+            limit (int, optional): Number of documents to return. Limit of 0 returns all matches.
+            sort (list[tuple], optional): Criteria for sorting documents. None to leave them unsorted.
+            batch_size (int, optional): Number of documents fetched per round trip.
+        Yields:
+            Matching documents, with ObjectIds converted to str.
+        """
+        results: AsyncCursor = (
+            self._collection.find(filter, projection, sort=sort)
+            .skip(skip)
+            .limit(limit)
+            .batch_size(batch_size)
+        )
+
+        async with results:
+            async for doc in self._iter_batches(results, batch_size):
+                yield doc
+
+    async def find_page(
+        self,
+        filter: dict = {},
+        projection: dict = {},
+        sort: list[tuple] = [("_id", 1)],
+        page_size: int = DEFAULT_BATCH_SIZE,
+        after: list = None,
+    ) -> tuple[list[dict], list | None]:
+        """Returns one page of matching documents, using keyset pagination.
+
+        Args:
+            filter (dict, optional): Filter for the query.
+            projection (dict, optional): Project for the results.
+            sort (list[tuple], optional): Criteria for sorting documents. Together the fields must be unique.
+            page_size (int, optional): Number of documents per page.
+            after (list, optional): Key returned with the previous page, None for the first page.
+        Returns:
+            The page, and the key of the next page, or None if this is the last page.
+        """
+        documents: list[dict] = [
+            doc
+            async for doc in self.find_iter(
+                keyset_filter(filter, sort, after),
+                keyset_projection(projection, sort),
+                limit=page_size + 1,
+                sort=sort,
+                batch_size=page_size + 1,
+            )
+        ]
+
+        next_after: list | None = None
+        if len(documents) > page_size:
+            documents.pop()
+            next_after = keyset_after(documents[-1], sort)
+
+        for field in keyset_hidden(projection, sort):
+            for doc in documents:
+                doc.pop(field, None)
+        return documents, next_after
+
+    async def aggregate(self, pipeline: list[dict]) -> list[dict]:
+        """Perform an aggregation on the collection.
+
+        Args:
+            pipeline (list[dict]): The pipeline for the aggregation query.
+
+        Returns:
+            list[dict]: A list of dictionaries resulting from the aggregation.
+        """
+        return [doc async for doc in self.aggregate_iter(pipeline)]
+
+    async def aggregate_iter(
+        self, pipeline: list[dict], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """Perform an aggregation on the collection, streaming the results.
+
+        Args:
+            pipeline (list[dict]): The pipeline for the aggregation query.
+            batch_size (int, optional): Number of documents fetched per round trip.
+
+        Yields:
+            dict: Documents resulting from the aggregation, with ObjectIds converted to str.
+        """
+        async with self._limiter:
+            results: AsyncCommandCursor = await self._collection.aggregate(
+                pipeline, batchSize=batch_size
+            )
+
+        async with results:
+            async for doc in self._iter_batches(results, batch_size):
+                yield doc
+
+    async def _iter_batches(
+        self, cursor: AsyncCursor | AsyncCommandCursor, batch_size: int
+    ) -> AsyncIterator[dict]:
+        """Yields documents from a cursor, fetching one batch at a time."""
+        while True:
+            async with self._limiter:
+                batch: list[dict] = await cursor.to_list(batch_size)
+            if not batch:
+                return
+            for doc in batch:
+                yield convert_object_ids(doc)
+
+    async def watch(
+        self,
+        pipeline: list[dict] = None,
+        resume_after: dict = None,
+        full_document: str = "updateLookup",
+        max_await_time_ms: int = 1000,
+    ) -> AsyncChangeStream:
+        """Opens a change stream on the collection.
+
+        Change streams need a replica set. The stream is long-lived, so it is
+        not counted against the concurrency limit.
+
+        Args:
+            pipeline (list[dict], optional): Stages filtering the events.
+            resume_after (dict, optional): Resume token to continue after.
+            full_document (str, optional): Set to "updateLookup" to get the whole document with updates.
+            max_await_time_ms (int, optional): How long the server waits for new events per round trip.
+        Returns:
+            The change stream, to be closed by the caller.
+        """
+        return await self._collection.watch(
+            pipeline,
+            full_document=full_document,
+            resume_after=resume_after,
+            max_await_time_ms=max_await_time_ms,
+        )
+
+    async def insert_one(self, document: dict) -> dict:
+        """Inserts a document.
+
+        Inserts a document into the collection.
+
+        Args:
+            document (dict): Document to be inserted.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: InsertOneResult = await self._collection.insert_one(document)
+        return {
+            "acknowledged": result.acknowledged,
+            "inserted_id": str(result.inserted_id),
+        }
+
+    async def insert_many(self, documents: list[dict]) -> dict:
+        """Insert multiple documents.
+
+        Inserts a list or tuple of documents into the collection.
+
+        Args:
+            documents (list[dict]): Documents to be inserted.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: InsertManyResult = await self._collection.insert_many(
+                documents=documents, ordered=False
+            )
+        return {
+            "acknowledged": result.acknowledged,
+            "inserted_ids": [str(objId) for objId in result.inserted_ids],
+        }
+
+    async def bulk_write(self, requests: list, ordered: bool = False) -> dict:
+        """Performs multiple write operations.
+
+        Sends a batch of write operations (InsertOne, UpdateOne, ReplaceOne,
+        DeleteOne, etc.) to the server in as few round trips as possible.
+
+        Args:
+            requests (list): The write operations to perform.
+            ordered (bool, optional): If False, operations may run in any order and one failure does not stop the rest.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: BulkWriteResult = await self._collection.bulk_write(
+                requests, ordered=ordered
+            )
+        return {
+            "acknowledged": result.acknowledged,
+            "inserted_count": result.inserted_count,
+            "matched_count": result.matched_count,
+            "modified_count": result.modified_count,
+            "upserted_count": result.upserted_count,
+            "deleted_count": result.deleted_count,
+        }
+
+    async def update_one(
+        self, filter: dict, update: dict, upsert: bool = False
+    ) -> dict:
+        """Updates one matching documents.
+
+        Updates one matching document based of filter and update dict.
+
+        Args:
+            filter (dict): Filter for the query.
+            update (dict): New values for the document.
+            upsert (bool, optional): If True, inserts new document, if not existing. Default is False.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: UpdateResult = await self._collection.update_one(
+                filter, update, upsert=upsert
+            )
+
+        return {
+            "acknowledged": result.acknowledged,
+            "matched_count": result.matched_count,
+            "modified_count": result.modified_count,
+            "raw_result": plain_raw_result(result.raw_result),
+            "upserted_id": (
+                str(result.upserted_id) if result.upserted_id is not None else None
+            ),
+        }
+
+    async def update_many(
+        self, filter: dict, update: dict | list[dict], upsert: bool = False
+    ) -> dict:
+        """Updates all matching documents.
+
+        Updates all matching document based of filter and update dict.
+
+        Args:
+            filter (dict): Filter for the query.
+            update (dict | list[dict]): New values for the document, or an update pipeline.
+            upsert (bool, optional): If True, inserts new document, if not existing. Default is False.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: UpdateResult = await self._collection.update_many(
+                filter, update, upsert=upsert
+            )
+
+        return {
+            "acknowledged": result.acknowledged,
+            "matched_count": result.matched_count,
+            "modified_count": result.modified_count,
+            "raw_result": plain_raw_result(result.raw_result),
+            "upserted_id": (
+                str(result.upserted_id) if result.upserted_id is not None else None
+            ),
+        }
+
+    async def delete_one(self, filter: dict) -> dict:
+        """Deletes one matching document.
+
+        Deletes one matching document based on filter.
+
+        Args:
+            filter (dict): Filter for the query.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: DeleteResult = await self._collection.delete_one(filter)
+        return {
+            "acknowledged": result.acknowledged,
+            "deleted_count": result.deleted_count,
+            "raw_result": plain_raw_result(result.raw_result),
+        }
+
+    async def delete_many(self, filter: dict) -> dict:
+        """Deletes all matching documents.
+
+        Deletes all matching documents based on filter.
+
+        Args:
+            filter (dict): Filter for the query.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        async with self._limiter:
+            result: DeleteResult = await self._collection.delete_many(filter)
+        return {
+            "acknowledged": result.acknowledged,
+            "deleted_count": result.deleted_count,
+            "raw_result": plain_raw_result(result.raw_result),
+        }
+
+
+class AsyncStoreDatabase:
+    """Performs operations on database, asynchronously.
+
+    Performs operations on MongoDB database with an asyncio connection pool.
+    """
+
+    Categories = StoreDatabase.Categories
+    Collections = StoreDatabase.Collections
+
+    def __init__(
+        self,
+        username: str = None,
+        password: str = None,
+        host: str = "localhost",
+        port: int = 27017,
+        database: str = None,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        timeout_ms: int = 5000,
+        wait_queue_timeout_ms: int = None,
+        max_concurrency: int = None,
+    ) -> None:
+        """Creates the connection pool.
+
+        Creates the client and its connection pool. Connections are opened
+        lazily, call connect() to check that the server is reachable.
+
+        Args:
+            max_pool_size (int, optional): Maximum number of pooled connections.
+            min_pool_size (int, optional): Number of connections kept open while idle.
+            timeout_ms (int, optional): Timeout for connecting and selecting a server.
+            wait_queue_timeout_ms (int, optional): How long an operation waits for a free connection.
+            max_concurrency (int, optional): Maximum number of in-flight operations. None for no limit.
+        """
+        self.host: str = host
+        self.port: int = port
+        self.database: AsyncDatabase = None
+        self.client: AsyncMongoClient = None
+        self._collections: dict[str, AsyncStoreCollection] = {}
+        connection_url: str = None
+
+        if username is None or password is None:
+            connection_url = f"mongodb://{self.host}:{self.port}/"
+        else:
+            connection_url = f"mongodb://{username}:{password}@{self.host}:{self.port}/?authSource=admin"
+
+        self.client = AsyncMongoClient(
+            connection_url,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            connectTimeoutMS=timeout_ms,
+            serverSelectionTimeoutMS=timeout_ms,
+            waitQueueTimeoutMS=wait_queue_timeout_ms,
+        )
+        self._limiter: asyncio.Semaphore | nullcontext = (
+            asyncio.Semaphore(max_concurrency) if max_concurrency else nullcontext()
+        )
+
+        # if a db is specified then make connection
+        if database is not None:
+            self.set_database(database)
+
+    async def connect(self) -> None:
+        """Checks the connection to the database.
+
+        Pings the server so that a bad connection is reported on startup.
+        """
+        try:
+            # The ping command is cheap and does not require auth.
+            await self.client["admin"].command("ping")
+        except ConnectionFailure as e:
+            print(f"Error: {e}")
+
+    def set_database(self, database: str) -> None:
+        """Sets the current database."""
+        self.database = self.client[database]
+        self._collections = {}
+
+    def get_collection(self, collection: str | Collections) -> AsyncStoreCollection:
+        """Returns a handle for a collection.
+
+        Handles are created once per collection and are safe to share.
+
+        Args:
+            collection (str, AsyncStoreDatabase.Collections): Name of the collection.
+        Returns:
+            AsyncStoreCollection for the collection.
+        """
+        name: str = str(collection)
+        handle: AsyncStoreCollection | None = self._collections.get(name)
+        if handle is None:
+            handle = self._collections.setdefault(
+                name, AsyncStoreCollection(self.database[name], self._limiter)
+            )
+        return handle
+
+    @property
+    def items(self) -> AsyncStoreCollection:
+        """Handle for the items collection."""
+        return self.get_collection(AsyncStoreDatabase.Collections.ItemsCollection)
+
+    @property
+    def users(self) -> AsyncStoreCollection:
+        """Handle for the users collection."""
+        return self.get_collection(AsyncStoreDatabase.Collections.UsersCollection)
+
+    @property
+    def locations(self) -> AsyncStoreCollection:
+        """Handle for the locations collection."""
+        return self.get_collection(AsyncStoreDatabase.Collections.LocationsCollection)
+
+    @property
+    def user_data(self) -> AsyncStoreCollection:
+        """Handle for the materialized user_data collection."""
+        return self.get_collection(AsyncStoreDatabase.Collections.UserDataCollection)
+
+    async def create_collection(
+        self, collection: str | Collections, validator: dict = None, **options
+    ):
+        """Creates a new collection.
+
+        Creates a new collection
+
+        Args:
+            collection (str, AsyncStoreDatabase.Collections): Name of the collection.
+            validator (dict, optional): Validator for jsonSchema of the documents in the collection.
+            options: Other create options, e.g. timeseries and expireAfterSeconds.
+        """
+        # The server wants a document if validator is sent at all
+        if validator is not None:
+            options["validator"] = validator
+        await self.database.create_collection(str(collection), **options)
+
+    async def drop_collection(self, collection: str | Collections):
+        """Drops a collection.
+
+        Drops a collection from the database.
+
+        Args:
+            collection (str, AsyncStoreDatabase.Collections): Name of the collection.
+        """
+        await self.database.drop_collection(str(collection))
+
+    async def close(self) -> None:
+        """Close connection to database.
+
+        Closes the connection pool.
+        """
+        await self.client.close()
+
+    def is_valid_object_id(id_str: str) -> bool:
+        """Checks if str is valid ObjectID.
+
+        Checks if str is valid ObjectID.
+
+        Returns:
+            True if str is valid ObjectID, false otherwise.
+        """
+        return ObjectId.is_valid(id_str)
+
+    def str_to_object_id(id_str: str) -> ObjectId:
+        """Returns ObjectID for str.
+
+        Converts a str into an ObjectID.
+
+        Returns:
+            ObjectID for the given str.
+        """
+        return ObjectId(id_str)
@@ -0,0 +1,131 @@
+"""Benchmarks the encoding of GET /items without a limit.
+
+Encodes the seeded catalog (movies.json and categoryJson) the way each
+version of the API does, starting from documents as the driver returns
+them, and reports the CPU time per request. No database is needed.
+"""
+
+from load_database import parse_items_file
+from store_database import convert_object_ids
+from serialization import encode_chunks, orjson
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from rich import print
+from rich.table import Table
+from typing import AsyncIterator, Callable
+import argparse
+import asyncio
+import copy
+import glob
+import json
+import time
+
+
+def load_catalog(movies_file: str, folder_path: str) -> list[dict]:
+    """Returns the seeded items, with ObjectIds like documents from the driver."""
+    items: list[dict] = []
+    for file in [movies_file, *sorted(glob.glob(f"{folder_path}/*.json"))]:
+        items.extend(parse_items_file(file))
+    for item in items:
+        item["_id"] = ObjectId()
+    return items
+
+
+async def cursor(documents: list[dict]) -> AsyncIterator[dict]:
+    """Yields documents like a cursor, copied so conversions don't carry over."""
+    for doc in documents:
+        yield dict(doc)
+
+
+async def list_response(documents: list[dict]) -> int:
+    """The original routes: a list of converted documents, encoded by FastAPI."""
+    items: list[dict] = [convert_object_ids(dict(doc)) for doc in documents]
+    body: bytes = json.dumps(
+        jsonable_encoder({"items": items}),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode()
+    return len(body)
+
+
+async def json_stream(documents: list[dict]) -> int:
+    """Streaming with json.dumps, one small chunk per document."""
+    size: int = len('{"items": [')
+    separator: str = ""
+    async for doc in cursor(documents):
+        size += len(f"{separator}{json.dumps(convert_object_ids(doc))}".encode())
+        separator = ","
+    return size + len("]}")
+
+
+async def fast_stream(documents: list[dict]) -> int:
+    """Streaming with serialization.encode_chunks.
+
+    AsyncStoreCollection still converts ObjectIds to str as it yields each
+    document, so the conversion is timed here too.
+    """
+    converted: AsyncIterator[dict] = (
+        convert_object_ids(doc) async for doc in cursor(documents)
+    )
+    size: int = 0
+    async for chunk in encode_chunks(converted, b'{"items":[', b",", end=b"]}"):
+        size += len(chunk)
+    return size
+
+
+def measure(
+    encode: Callable[[list[dict]], int], documents: list[dict], requests: int
+) -> tuple[float, int]:
+    """Returns the CPU seconds per request, and the size of the response."""
+    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    try:
+        size: int = loop.run_until_complete(encode(documents))
+        start: float = time.process_time()
+        for _ in range(requests):
+            loop.run_until_complete(encode(documents))
+        return (time.process_time() - start) / requests, size
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--requests", type=int, default=50, help="Requests timed per encoder."
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=1,
+        help="Repeat the catalog to simulate a larger one.",
+    )
+    args = parser.parse_args()
+
+    documents: list[dict] = load_catalog("./movies.json", "./categoryJson")
+    documents = [
+        {**copy.deepcopy(doc), "_id": ObjectId()}
+        for _ in range(args.scale)
+        for doc in documents
+    ]
+
+    table = Table(
+        title=f"GET /items, {len(documents)} items, "
+        f"{'orjson' if orjson else 'json (orjson not installed)'}"
+    )
+    for column in ("Encoder", "CPU ms / request", "Response bytes", "Speedup"):
+        table.add_column(column)
+
+    baseline: float | None = None
+    for name, encode in (
+        ("list + jsonable_encoder", list_response),
+        ("stream + json.dumps", json_stream),
+        ("stream + encode_chunks", fast_stream),
+    ):
+        seconds, size = measure(encode, documents, args.requests)
+        baseline = baseline or seconds
+        table.add_row(
+            name, f"{seconds * 1000:.2f}", str(size), f"{baseline / seconds:.1f}x"
+        )
+    print(table)
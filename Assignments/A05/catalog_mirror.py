@@ -0,0 +1,357 @@
+"""Provides an in-memory mirror of the items collection.
+
+Provides the class CatalogMirror, which loads every item once and then
+follows the collection's change stream, so it sees writes from any source:
+the API, load_database.py, addData.py or manual edits. Items are indexed by
+id, category and tag, and read routes can be served from memory.
+
+The mirror is saved to a snapshot file along with the change stream's
+resume token, so a restart picks up where it left off instead of reloading
+the whole catalog. Change streams need MongoDB to run as a replica set; a
+single-node replica set is enough.
+"""
+
+from async_store_database import AsyncStoreCollection
+from store_database import convert_object_ids
+from pymongo.asynchronous.change_stream import AsyncChangeStream
+from pymongo.errors import PyMongoError, OperationFailure
+from bson import json_util
+from rich import print
+from typing import Awaitable, Callable
+import asyncio
+import os
+import tempfile
+import time
+
+DEFAULT_SNAPSHOT_INTERVAL: float = 30.0
+RETRY_DELAY: float = 1.0
+# Errors meaning the resume token is too old or the stream can't continue
+NON_RESUMABLE_CODES: set[int] = {136, 260, 280, 286}
+NOT_A_REPLICA_SET: int = 40573
+INVALIDATING_OPERATIONS: set[str] = {"drop", "rename", "dropDatabase", "invalidate"}
+
+
+class ReloadNeeded(Exception):
+    """Raised when the change stream can no longer be followed."""
+
+
+class CatalogMirror:
+    """In-memory copy of the items collection, kept current by a change stream.
+
+    Documents handed out by the mirror are shared, so callers must not
+    mutate them. Listeners registered with on_change are awaited for each
+    change, with the item before and after it.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str = None,
+        snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL,
+    ) -> None:
+        """Creates an empty mirror.
+
+        Args:
+            snapshot_path (str, optional): File to save the mirror to. None to never save it.
+            snapshot_interval (float, optional): Least number of seconds between snapshots.
+        """
+        self.snapshot_path: str | None = snapshot_path
+        self.snapshot_interval: float = snapshot_interval
+        self.ready: bool = False
+        self.resume_token: dict | None = None
+
+        self._items: dict[str, dict] = {}
+        self._categories: dict[str, dict[str, dict]] = {}
+        self._tags: dict[str, set[str]] = {}
+        self._sorted: dict[str, list[dict]] = {}
+        self._all_sorted: list[dict] | None = None
+        self._listeners: list[Callable[[str, dict, dict], Awaitable]] = []
+
+        # Changes on every restart, so versions from different runs never match
+        self._epoch: str = os.urandom(6).hex()
+        self._changes: int = 0
+        self._reloads: int = 0
+        self._last_change: float | None = None
+        self._last_snapshot: float = time.monotonic()
+        self._dirty: bool = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def on_change(self, listener: Callable[[str, dict, dict], Awaitable]) -> None:
+        """Registers a coroutine function called as listener(id, before, after).
+
+        before is None for new items, and after is None for deleted items.
+        """
+        self._listeners.append(listener)
+
+    def get(self, id: str) -> dict | None:
+        """Returns an item by id, or None."""
+        return self._items.get(id)
+
+    def category(self, category: str) -> list[dict]:
+        """Returns the items in a category, sorted by _id."""
+        items: list[dict] | None = self._sorted.get(category)
+        if items is None:
+            items = sorted(
+                self._categories.get(category, {}).values(), key=lambda i: i["_id"]
+            )
+            self._sorted[category] = items
+        return items
+
+    def select(
+        self,
+        category: str = None,
+        tags: list[str] = None,
+        min_price: float = None,
+        max_price: float = None,
+    ) -> list[dict]:
+        """Returns the items matching the filters, sorted by _id.
+
+        Args:
+            category (str, optional): Category of the items.
+            tags (list[str], optional): Items with any of these tags.
+            min_price (float, optional): Lower bound for the price.
+            max_price (float, optional): Upper bound for the price. With either bound, items without a price are left out.
+        Returns:
+            The matching items.
+        """
+        if category is not None:
+            items: list[dict] = self.category(category)
+        else:
+            if self._all_sorted is None:
+                self._all_sorted = sorted(self._items.values(), key=lambda i: i["_id"])
+            items = self._all_sorted
+
+        if tags:
+            ids: set[str] = set()
+            for tag in tags:
+                ids |= self._tags.get(tag, set())
+            items = [item for item in items if item["_id"] in ids]
+
+        if min_price is None and max_price is None:
+            return list(items)
+
+        # Like a range query, which no missing or null price satisfies
+        return [
+            item
+            for item in items
+            if item.get("price") is not None
+            and (min_price is None or item["price"] >= min_price)
+            and (max_price is None or item["price"] <= max_price)
+        ]
+
+    @property
+    def version(self) -> str:
+        """Changes whenever an item changes, e.g. to build ETags from."""
+        return f"{self._epoch}.{self._reloads}.{self._changes}"
+
+    def stats(self) -> dict:
+        """Returns the size of the mirror and how current it is."""
+        return {
+            "ready": self.ready,
+            "items": len(self._items),
+            "categories": len(self._categories),
+            "tags": len(self._tags),
+            "changes": self._changes,
+            "reloads": self._reloads,
+            "seconds_since_last_change": (
+                time.monotonic() - self._last_change
+                if self._last_change is not None
+                else None
+            ),
+        }
+
+    async def run(self, collection: AsyncStoreCollection) -> None:
+        """Keeps the mirror current until cancelled.
+
+        Resumes from the snapshot if there is one, and falls back to a full
+        reload whenever the change stream can't be resumed.
+
+        Args:
+            collection (AsyncStoreCollection): The items collection.
+        """
+        await asyncio.to_thread(self._restore)
+
+        try:
+            while True:
+                try:
+                    stream: AsyncChangeStream = await collection.watch(
+                        resume_after=self.resume_token
+                    )
+                    async with stream:
+                        if not self.ready:
+                            if self.resume_token is not None:
+                                # Restored from the snapshot, which is only
+                                # current once the changes since it are in
+                                await self._catch_up(stream)
+                            else:
+                                # The stream is open before the scan, so writes
+                                # made during the scan are replayed after it
+                                await self._reload(collection)
+                                self.resume_token = stream.resume_token
+                            self.ready = True
+                        await self._follow(stream)
+                except ReloadNeeded as e:
+                    print(f"[yellow]Catalog mirror reloading: {e}")
+                    self.ready = False
+                    self.resume_token = None
+                except OperationFailure as e:
+                    if e.code == NOT_A_REPLICA_SET:
+                        print(
+                            "[red]Catalog mirror needs MongoDB to run as a replica set"
+                        )
+                        return
+                    if e.code in NON_RESUMABLE_CODES:
+                        print(f"[yellow]Catalog mirror reloading: {e}")
+                        self.ready = False
+                        self.resume_token = None
+                    else:
+                        print(f"[red]Catalog mirror lost its change stream: {e}")
+                        await asyncio.sleep(RETRY_DELAY)
+                except PyMongoError as e:
+                    print(f"[red]Catalog mirror lost its change stream: {e}")
+                    await asyncio.sleep(RETRY_DELAY)
+        finally:
+            if self._dirty:
+                self._save()
+
+    async def _reload(self, collection: AsyncStoreCollection) -> None:
+        """Replaces the mirror with a full scan of the collection."""
+        items: dict[str, dict] = {
+            doc["_id"]: doc async for doc in collection.find_iter({}, {})
+        }
+
+        self._items = {}
+        self._categories = {}
+        self._tags = {}
+        self._sorted = {}
+        self._all_sorted = None
+        for id, item in items.items():
+            self._index(id, item)
+
+        self._reloads += 1
+        self._dirty = True
+
+    async def _catch_up(self, stream: AsyncChangeStream) -> None:
+        """Applies the changes waiting in the stream, until there are none."""
+        while stream.alive:
+            change: dict | None = await stream.try_next()
+            if change is None:
+                break
+            await self._handle(change)
+            self.resume_token = stream.resume_token
+        self.resume_token = stream.resume_token
+
+    async def _follow(self, stream: AsyncChangeStream) -> None:
+        """Applies changes from the stream as they arrive."""
+        while stream.alive:
+            change: dict | None = await stream.try_next()
+            if change is not None:
+                await self._handle(change)
+            self.resume_token = stream.resume_token
+
+            now: float = time.monotonic()
+            if self._dirty and now - self._last_snapshot >= self.snapshot_interval:
+                self._last_snapshot = now
+                await asyncio.to_thread(self._save)
+
+    async def _handle(self, change: dict) -> None:
+        """Applies one change event."""
+        operation: str = change["operationType"]
+        if operation in INVALIDATING_OPERATIONS:
+            raise ReloadNeeded(f"items collection {operation}")
+        if "documentKey" not in change:
+            return
+
+        id: str = str(change["documentKey"]["_id"])
+        document: dict | None = change.get("fullDocument")
+        after: dict | None = (
+            convert_object_ids(document)
+            if operation != "delete" and document is not None
+            else None
+        )
+
+        before: dict | None = self._unindex(id)
+        if after is not None:
+            self._index(id, after)
+
+        self._changes += 1
+        self._last_change = time.monotonic()
+        self._dirty = True
+
+        for listener in self._listeners:
+            try:
+                await listener(id, before, after)
+            except Exception as e:
+                print(f"[red]Catalog mirror listener failed: {e}")
+
+    def _index(self, id: str, item: dict) -> None:
+        """Adds an item to the indexes."""
+        self._items[id] = item
+
+        category: str | None = item.get("category")
+        self._categories.setdefault(category, {})[id] = item
+        self._sorted.pop(category, None)
+        self._all_sorted = None
+
+        for tag in item.get("tags") or []:
+            self._tags.setdefault(tag, set()).add(id)
+
+    def _unindex(self, id: str) -> dict | None:
+        """Removes an item from the indexes, returning it."""
+        item: dict | None = self._items.pop(id, None)
+        if item is None:
+            return None
+
+        category: str | None = item.get("category")
+        self._categories.get(category, {}).pop(id, None)
+        if not self._categories.get(category, True):
+            del self._categories[category]
+        self._sorted.pop(category, None)
+        self._all_sorted = None
+
+        for tag in item.get("tags") or []:
+            ids: set[str] = self._tags.get(tag, set())
+            ids.discard(id)
+            if not ids:
+                self._tags.pop(tag, None)
+
+        return item
+
+    def _save(self) -> None:
+        """Writes the mirror and its resume token to the snapshot file."""
+        if self.snapshot_path is None or not self.ready:
+            return
+
+        snapshot: str = json_util.dumps(
+            {"resume_token": self.resume_token, "items": list(self._items.values())}
+        )
+        directory: str = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(snapshot)
+            os.replace(temp_path, self.snapshot_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._dirty = False
+
+    def _restore(self) -> None:
+        """Loads the snapshot file, if there is a usable one."""
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return
+
+        try:
+            with open(self.snapshot_path, "r") as file:
+                snapshot: dict = json_util.loads(file.read())
+        except (OSError, ValueError) as e:
+            print(f"[yellow]Ignoring catalog mirror snapshot: {e}")
+            return
+
+        if not snapshot.get("resume_token"):
+            return
+        for item in snapshot["items"]:
+            self._index(item["_id"], item)
+        # Not ready until run has caught up from the resume token
+        self.resume_token = snapshot["resume_token"]
@@ -0,0 +1,134 @@
+"""Provides response compression for the API.
+
+Provides the middleware CompressionMiddleware, which compresses responses
+above a size threshold with Brotli when the client accepts it and the
+brotli package is installed, and with gzip otherwise. Streaming responses
+are compressed chunk by chunk, so they still stream.
+
+The responders come from Starlette's GZip middleware, which are not part of
+its public API, so requirements.txt pins the Starlette release they were
+written against. Brotli needs the optional brotli package.
+"""
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import (
+    DEFAULT_EXCLUDED_CONTENT_TYPES,
+    GZipMiddleware,
+    GZipResponder,
+    IdentityResponder,
+)
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this gain too little to be worth the CPU
+DEFAULT_MINIMUM_SIZE: int = 1024
+# Levels meant for dynamic responses, the highest levels cost far more CPU
+DEFAULT_GZIP_LEVEL: int = 6
+DEFAULT_BROTLI_QUALITY: int = 5
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Returns the encodings in an Accept-Encoding header, except those with q=0.
+
+    Args:
+        accept_encoding (str): Value of the header, e.g. "gzip, br;q=0.9".
+    Returns:
+        The accepted encodings, in lower case.
+    """
+    encodings: set[str] = set()
+    for part in accept_encoding.split(","):
+        encoding, _, params = part.partition(";")
+        quality: str = params.strip().removeprefix("q=").strip()
+        try:
+            if quality and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        if encoding.strip():
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class BrotliResponder(IdentityResponder):
+    """Compresses a response with Brotli."""
+
+    content_encoding = "br"
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int,
+        quality: int,
+        *,
+        exclude_content_types: tuple[str, ...] = DEFAULT_EXCLUDED_CONTENT_TYPES,
+    ) -> None:
+        super().__init__(app, minimum_size, exclude_content_types=exclude_content_types)
+        self._compressor = brotli.Compressor(quality=quality)
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if more_body:
+            return self._compressor.process(body) + self._compressor.flush()
+        return self._compressor.process(body) + self._compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compresses responses with Brotli or gzip, whichever the client prefers.
+
+    Responses that already have a Content-Encoding, partial responses and
+    already compressed media such as images are left as they are.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        compresslevel: int = DEFAULT_GZIP_LEVEL,
+        brotli_quality: int = DEFAULT_BROTLI_QUALITY,
+    ) -> None:
+        """Wraps an app.
+
+        Args:
+            app (ASGIApp): The app to wrap.
+            minimum_size (int, optional): Smallest response, in bytes, that is compressed.
+            compresslevel (int, optional): gzip level, from 1 to 9.
+            brotli_quality (int, optional): Brotli quality, from 0 to 11.
+        """
+        super().__init__(app, minimum_size, compresslevel)
+        self.brotli_quality: int = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encodings: set[str] = accepted_encodings(
+            Headers(scope=scope).get("Accept-Encoding", "")
+        )
+        responder: ASGIApp
+        if brotli is not None and "br" in encodings:
+            responder = BrotliResponder(
+                self.app,
+                self.minimum_size,
+                self.brotli_quality,
+                exclude_content_types=self.exclude_content_types,
+            )
+        elif "gzip" in encodings:
+            responder = GZipResponder(
+                self.app,
+                self.minimum_size,
+                compresslevel=self.compresslevel,
+                thread_minimum_size=self.thread_minimum_size,
+                exclude_content_types=self.exclude_content_types,
+            )
+        else:
+            responder = IdentityResponder(
+                self.app,
+                self.minimum_size,
+                exclude_content_types=self.exclude_content_types,
+            )
+
+        await responder(scope, receive, send)
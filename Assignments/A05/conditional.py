@@ -0,0 +1,124 @@
+"""Provides conditional GET support for the API.
+
+Provides weak_etag and etag_matches, for routes that know a cheap version of
+their result and can answer If-None-Match before doing any work, and the
+middleware ConditionalGetMiddleware, which tags the remaining GET responses
+that are sent in one piece with an ETag hashed from their body and turns
+them into 304 Not Modified when the client already has them.
+"""
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from hashlib import sha256
+
+# Headers a 304 repeats from the response it stands for
+NOT_MODIFIED_HEADERS: tuple[str, ...] = (
+    "cache-control",
+    "content-location",
+    "date",
+    "etag",
+    "expires",
+    "vary",
+)
+
+
+def weak_etag(*parts: str | bytes) -> str:
+    """Returns a weak ETag built from a hash of the parts.
+
+    Args:
+        parts (str | bytes): Whatever identifies the response, e.g. a version and the query.
+    Returns:
+        The ETag, e.g. W/"1b4f0e9851971998e7320785".
+    """
+    digest = sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'W/"{digest.hexdigest()[:24]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Returns whether an If-None-Match header matches an ETag.
+
+    Uses the weak comparison, as If-None-Match does.
+
+    Args:
+        if_none_match (str | None): Value of the header.
+        etag (str): ETag of the current response.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque: str = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+class ConditionalGetMiddleware:
+    """Adds ETags to GET responses sent in one piece, and answers 304s.
+
+    Responses that already have an ETag are left to the route, and
+    streaming responses are passed through, since their ETag would only be
+    known after the body was sent. The route still runs, so this saves
+    bandwidth rather than work.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match: str | None = Headers(scope=scope).get("if-none-match")
+        start: Message | None = None
+        passthrough: bool = False
+
+        async def send_with_etag(message: Message) -> None:
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if message["status"] != 200 or "etag" in headers:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            if message["type"] != "http.response.body" or message.get("more_body"):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            etag: str = weak_etag(message.get("body", b""))
+            headers = MutableHeaders(raw=start["headers"])
+            headers["ETag"] = etag
+            if etag_matches(if_none_match, etag):
+                await send(not_modified(start))
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+def not_modified(start: Message) -> Message:
+    """Returns the start of a 304 response standing for a 200 response."""
+    return {
+        "type": "http.response.start",
+        "status": 304,
+        "headers": [
+            (name, value)
+            for name, value in start["headers"]
+            if name.lower().decode("latin-1") in NOT_MODIFIED_HEADERS
+        ],
+    }
@@ -0,0 +1,159 @@
+"""Provides geospatial queries over user locations.
+
+Locations keep their flat latitude and longitude fields, and are also
+stored with a GeoJSON point in the position field, which has a 2dsphere
+index. Provides the functions that build positions and the queries for
+nearby users and for the users inside a map viewport, and in_viewport,
+which checks a point against a viewport in memory.
+"""
+
+# Field holding the GeoJSON point of a location
+POSITION_FIELD: str = "position"
+# Builds the position of a location from its flat fields, in an update pipeline
+POSITION_EXPRESSION: dict = {
+    "type": "Point",
+    "coordinates": ["$longitude", "$latitude"],
+}
+# Widest polygon of a viewport query, polygons must stay within a hemisphere
+MAX_POLYGON_WIDTH: float = 90.0
+# Largest step between vertices along a viewport's top and bottom edges
+EDGE_STEP: float = 1.0
+# 2dsphere polygons can't have vertices on a pole
+MAX_LATITUDE: float = 89.999999
+
+
+def geo_point(latitude: float, longitude: float) -> dict:
+    """Returns a GeoJSON point.
+
+    Args:
+        latitude (float): Latitude, in degrees.
+        longitude (float): Longitude, in degrees.
+    Returns:
+        The point, with coordinates in GeoJSON's longitude, latitude order.
+    """
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def in_viewport(
+    latitude: float,
+    longitude: float,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+) -> bool:
+    """Returns whether a point is inside a latitude and longitude box.
+
+    Args:
+        latitude (float): Latitude of the point.
+        longitude (float): Longitude of the point.
+        south (float): Latitude of the bottom edge.
+        west (float): Longitude of the left edge.
+        north (float): Latitude of the top edge.
+        east (float): Longitude of the right edge, less than west to cross the antimeridian.
+    """
+    if not south <= latitude <= north:
+        return False
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
+
+
+def near_pipeline(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    limit: int,
+    projection: dict = {},
+) -> list[dict]:
+    """Returns an aggregation pipeline for the locations nearest to a point.
+
+    Args:
+        latitude (float): Latitude of the point.
+        longitude (float): Longitude of the point.
+        radius (float): Largest distance, in meters.
+        limit (int): Largest number of locations to return.
+        projection (dict, optional): Projection for the results.
+    Returns:
+        The pipeline, whose results are sorted nearest first and have the
+        distance in meters in their distance field.
+    """
+    pipeline: list[dict] = [
+        {
+            "$geoNear": {
+                "near": geo_point(latitude, longitude),
+                "key": POSITION_FIELD,
+                "distanceField": "distance",
+                "maxDistance": radius,
+                "spherical": True,
+            }
+        },
+        {"$limit": limit},
+    ]
+    if projection:
+        pipeline.append({"$project": projection})
+    return pipeline
+
+
+def viewport_polygons(
+    south: float, west: float, north: float, east: float
+) -> list[dict]:
+    """Returns GeoJSON polygons covering a latitude and longitude box.
+
+    Polygon edges on a sphere are great circles, so the top and bottom
+    edges get a vertex every EDGE_STEP degrees to follow their parallels.
+    Boxes crossing the antimeridian, where west is greater than east, are
+    split in two, and wide boxes are split so no polygon is wider than
+    MAX_POLYGON_WIDTH degrees.
+
+    Args:
+        south (float): Latitude of the bottom edge.
+        west (float): Longitude of the left edge.
+        north (float): Latitude of the top edge.
+        east (float): Longitude of the right edge.
+    Returns:
+        The polygons.
+    """
+    south = max(south, -MAX_LATITUDE)
+    north = min(north, MAX_LATITUDE)
+    spans: list[tuple[float, float]] = (
+        [(west, 180.0), (-180.0, east)] if west > east else [(west, east)]
+    )
+
+    polygons: list[dict] = []
+    for start, end in spans:
+        while start < end:
+            stop: float = min(start + MAX_POLYGON_WIDTH, end)
+            steps: int = max(1, int((stop - start) / EDGE_STEP + 0.999999))
+            edge: list[float] = [
+                start + (stop - start) * step / steps for step in range(steps + 1)
+            ]
+            ring: list[list[float]] = [
+                *([lon, south] for lon in edge),
+                *([lon, north] for lon in reversed(edge)),
+            ]
+            polygons.append({"type": "Polygon", "coordinates": [[*ring, ring[0]]]})
+            start = stop
+    return polygons
+
+
+def viewport_filter(south: float, west: float, north: float, east: float) -> dict:
+    """Returns a filter for the locations inside a latitude and longitude box.
+
+    Args:
+        south (float): Latitude of the bottom edge.
+        west (float): Longitude of the left edge.
+        north (float): Latitude of the top edge.
+        east (float): Longitude of the right edge, less than west to cross the antimeridian.
+    Returns:
+        The filter, which uses the 2dsphere index on position.
+    Raises:
+        ValueError: If the box has no width.
+    """
+    filters: list[dict] = [
+        {POSITION_FIELD: {"$geoWithin": {"$geometry": polygon}}}
+        for polygon in viewport_polygons(south, west, north, east)
+    ]
+    if not filters:
+        raise ValueError("The viewport must have a width.")
+    return filters[0] if len(filters) == 1 else {"$or": filters}
@@ -0,0 +1,339 @@
+"""Provides a two-tier cache for upstream item images.
+
+Provides the class ImageCache, which keeps images fetched from their
+img_url in a size-bounded LRU in memory and a size-bounded directory on disk,
+so each image is downloaded once and then served locally. Resized variants
+are rendered in a worker pool and cached next to the originals.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from typing import BinaryIO, NamedTuple
+from PIL import Image
+import asyncio
+import mimetypes
+import os
+import tempfile
+import requests
+
+DEFAULT_CONTENT_TYPE: str = "image/jpeg"
+VARIANT_FORMATS: dict[str, tuple[str, str]] = {
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+VARIANT_QUALITY: int = 80
+
+
+def render_variant(
+    source: str, destination: str, width: int, height: int, format: str
+) -> None:
+    """Resizes and re-encodes an image file.
+
+    The image is scaled down to fit within width x height, keeping its aspect
+    ratio. A width or height of 0 leaves that side unbounded. Runs in a worker
+    process.
+
+    Args:
+        source (str): Path of the original image.
+        destination (str): Path of the variant, written atomically.
+        width (int): Maximum width.
+        height (int): Maximum height.
+        format (str): One of VARIANT_FORMATS.
+    """
+    pil_format, extension = VARIANT_FORMATS[format]
+
+    with Image.open(source) as image:
+        image.thumbnail((width or image.width, height or image.height))
+        if pil_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(destination), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                image.save(file, pil_format, quality=VARIANT_QUALITY)
+            os.replace(temp_path, destination)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+class CachedImage(NamedTuple):
+    """An image in the cache.
+
+    content is only set for images held in the memory tier.
+    """
+
+    path: str
+    content_type: str
+    etag: str
+    size: int
+    content: bytes | None = None
+
+
+class ImageCache:
+    """Caches upstream images in memory and on disk.
+
+    Images are keyed by the hash of their URL. Files are named
+    <url hash>.<content hash>.<ext>, so the content hash doubles as the ETag
+    and survives restarts. Concurrent misses for the same URL share one
+    download.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_disk_bytes: int = 512 * 1024**2,
+        max_memory_bytes: int = 32 * 1024**2,
+        max_memory_item_bytes: int = 512 * 1024,
+        timeout: float = 10.0,
+        workers: int = 0,
+    ) -> None:
+        """Opens the cache directory.
+
+        Args:
+            directory (str): Directory for cached files, created if missing.
+            max_disk_bytes (int, optional): Size of the disk tier.
+            max_memory_bytes (int, optional): Size of the memory tier.
+            max_memory_item_bytes (int, optional): Largest image kept in memory.
+            timeout (float, optional): Timeout for upstream requests, in seconds.
+            workers (int, optional): Worker processes that render variants, started on the first variant. 0 for the default thread pool.
+        """
+        self.directory: str = directory
+        self.max_disk_bytes: int = max_disk_bytes
+        self.max_memory_bytes: int = max_memory_bytes
+        self.max_memory_item_bytes: int = max_memory_item_bytes
+        self.timeout: float = timeout
+        self.workers: int = workers
+
+        self._memory: OrderedDict[str, CachedImage] = OrderedDict()
+        self._memory_bytes: int = 0
+        self._disk: OrderedDict[str, CachedImage] = OrderedDict()
+        self._disk_bytes: int = 0
+        self._pending: dict[str, asyncio.Future] = {}
+        self._executor: ProcessPoolExecutor | None = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def key(url: str) -> str:
+        """Returns the cache key for a URL."""
+        return sha256(url.encode()).hexdigest()
+
+    async def get(self, url: str) -> CachedImage:
+        """Returns an image, downloading it on a miss.
+
+        Args:
+            url (str): URL of the image.
+        Returns:
+            The cached image.
+        """
+        key: str = self.key(url)
+
+        image: CachedImage | None = self._memory.get(key)
+        if image is not None:
+            self._memory.move_to_end(key)
+            return image
+
+        image = self._disk.get(key)
+        if image is not None:
+            self._disk.move_to_end(key)
+            return image
+
+        # Coalesce concurrent misses into one download
+        return await self._once(key, lambda: self._fetch(key, url))
+
+    async def get_variant(
+        self, url: str, width: int = 0, height: int = 0, format: str = "jpeg"
+    ) -> CachedImage:
+        """Returns a resized variant of an image, rendering it on a miss.
+
+        Args:
+            url (str): URL of the original image.
+            width (int, optional): Maximum width, 0 for unbounded.
+            height (int, optional): Maximum height, 0 for unbounded.
+            format (str, optional): One of VARIANT_FORMATS.
+        Returns:
+            The cached variant.
+        """
+        key: str = f"{self.key(url)}-{width}x{height}-{format}"
+
+        image: CachedImage | None = self._disk.get(key)
+        if image is not None:
+            self._disk.move_to_end(key)
+            return image
+
+        return await self._once(
+            key, lambda: self._render(key, url, width, height, format)
+        )
+
+    async def open_file(self, image: CachedImage) -> BinaryIO:
+        """Opens the file of an image for reading.
+
+        The open file can still be read after the image is evicted. If the
+        file is already gone, the image is dropped from the disk tier so the
+        next lookup downloads or renders it again.
+
+        Args:
+            image (CachedImage): Image returned by get or get_variant.
+        Returns:
+            The file, opened in binary mode.
+        Raises:
+            FileNotFoundError: If the file was evicted or deleted.
+        """
+        try:
+            return await asyncio.to_thread(open, image.path, "rb")
+        except FileNotFoundError:
+            key: str = os.path.basename(image.path).split(".")[0]
+            cached: CachedImage | None = self._disk.get(key)
+            if cached is not None and cached.path == image.path:
+                del self._disk[key]
+                self._disk_bytes -= cached.size
+            raise
+
+    def close(self) -> None:
+        """Stops the worker processes, if any were started."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _once(self, key: str, create) -> CachedImage:
+        """Runs create() once for concurrent callers with the same key."""
+        pending: asyncio.Future | None = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(create())
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _render(
+        self, key: str, url: str, width: int, height: int, format: str
+    ) -> CachedImage:
+        """Renders a variant from the original and stores it on disk."""
+        original: CachedImage = await self.get(url)
+        if original.content is not None and not os.path.exists(original.path):
+            # Evicted from disk but still in memory, the worker reads from disk
+            await asyncio.to_thread(self._write, original.path, original.content)
+            self._add_to_disk(self.key(url), original._replace(content=None))
+
+        _, extension = VARIANT_FORMATS[format]
+        # Variants are derived from the original, so its hash identifies them
+        etag: str = f"{original.etag}-{width}x{height}-{format}"
+        path: str = os.path.join(self.directory, f"{key}.{etag}{extension}")
+
+        if self._executor is None and self.workers > 0:
+            # Started on demand, most workers never render a variant
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor, render_variant, original.path, path, width, height, format
+        )
+
+        content_type: str = mimetypes.guess_type(path)[0] or DEFAULT_CONTENT_TYPE
+        image: CachedImage = CachedImage(
+            path, content_type, etag, os.path.getsize(path)
+        )
+        self._add_to_disk(key, image)
+        return image
+
+    async def _fetch(self, key: str, url: str) -> CachedImage:
+        """Downloads an image and stores it in both tiers."""
+        response: requests.Response = await asyncio.to_thread(
+            requests.get, url, timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        content: bytes = response.content
+        content_type: str = (
+            response.headers.get("Content-Type", DEFAULT_CONTENT_TYPE)
+            .split(";")[0]
+            .strip()
+        )
+        extension: str = mimetypes.guess_extension(content_type) or ".jpg"
+        etag: str = sha256(content).hexdigest()[:32]
+        path: str = os.path.join(self.directory, f"{key}.{etag}{extension}")
+
+        await asyncio.to_thread(self._write, path, content)
+
+        image: CachedImage = CachedImage(path, content_type, etag, len(content))
+        self._add_to_disk(key, image)
+
+        if image.size <= self.max_memory_item_bytes:
+            self._memory[key] = image._replace(content=content)
+            self._memory_bytes += image.size
+            self._evict_memory()
+
+        return image._replace(content=content)
+
+    def _write(self, path: str, content: bytes) -> None:
+        """Writes a file atomically."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _add_to_disk(self, key: str, image: CachedImage) -> None:
+        """Records a file in the disk tier, replacing the key's old file."""
+        old: CachedImage | None = self._disk.pop(key, None)
+        if old is not None:
+            self._disk_bytes -= old.size
+            if old.path != image.path:
+                self._unlink(old.path)
+        self._disk[key] = image
+        self._disk_bytes += image.size
+        self._evict_disk()
+
+    def _evict_memory(self) -> None:
+        """Drops least recently used images until the memory tier fits."""
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, image = self._memory.popitem(last=False)
+            self._memory_bytes -= image.size
+
+    def _evict_disk(self) -> None:
+        """Deletes least recently used files until the disk tier fits."""
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            _, image = self._disk.popitem(last=False)
+            self._disk_bytes -= image.size
+            self._unlink(image.path)
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        """Deletes a file, if it is still there.
+
+        Responses that already opened the file keep reading it.
+        """
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _scan(self) -> None:
+        """Indexes the files already in the directory, oldest first."""
+        entries: list[os.DirEntry] = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Left behind by an interrupted write
+                os.unlink(entry.path)
+            elif entry.name.count(".") == 2:
+                entries.append(entry)
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+
+        for entry in entries:
+            key, etag, extension = entry.name.split(".")
+            content_type: str = (
+                mimetypes.guess_type(entry.name)[0] or DEFAULT_CONTENT_TYPE
+            )
+            size: int = entry.stat().st_size
+            self._disk[key] = CachedImage(entry.path, content_type, etag, size)
+            self._disk_bytes += size
+
+        self._evict_disk()
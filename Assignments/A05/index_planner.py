@@ -0,0 +1,223 @@
+"""Checks that the API's queries are served by indexes.
+
+Runs explain() on the query shape behind each read route and reports the
+plan the server picked, flagging collection scans and in-memory sorts.
+With --apply, the index spec in collection_indexes.json is applied first.
+Exits with status 1 if any query scans a whole collection.
+"""
+
+from store_database import StoreDatabase, StoreCollection, load_index_specs
+from geo import viewport_filter
+from user_data_view import COMPLETE_FILTER
+from rich import print
+from rich.table import Table
+from dotenv import load_dotenv
+import argparse
+import os
+import sys
+
+MAX_PRICE: float = 1000000000000000
+
+
+def query_shapes(db: StoreDatabase) -> list[dict]:
+    """Returns the query shape of each read route.
+
+    Sample values are taken from the database, so the plans match real data.
+
+    Args:
+        db (StoreDatabase): Database to sample.
+    Returns:
+        List of dicts with the route, collection and find arguments.
+    """
+    item: dict = db.items.find_one({}) or {}
+    user: dict = db.users.find_one({}) or {}
+    location: dict = db.locations.find_one({}) or {}
+
+    category: str = item.get("category", "")
+    tag: str = (item.get("tags") or [""])[0]
+    word: str = (item.get("name") or "candy").split()[0]
+    username: str = user.get("username", "")
+    price: dict = {"$gte": 0, "$lte": MAX_PRICE}
+    latitude: float = location.get("latitude", 0.0)
+    longitude: float = location.get("longitude", 0.0)
+
+    return [
+        {
+            "route": "GET /items?category=",
+            "collection": db.items,
+            "filter": {"category": category, "price": price},
+        },
+        {
+            "route": "GET /items?tags=",
+            "collection": db.items,
+            "filter": {"tags": {"$in": [tag]}, "price": price},
+        },
+        {
+            "route": "GET /items?category=&min_price=&max_price=",
+            "collection": db.items,
+            "filter": {"category": category, "price": {"$gte": 1, "$lte": 5}},
+        },
+        {
+            "route": "GET /items?search=",
+            "collection": db.items,
+            "filter": {"$text": {"$search": word}, "price": price},
+            "projection": {"score": {"$meta": "textScore"}},
+            "sort": [("score", {"$meta": "textScore"}), ("_id", 1)],
+        },
+        {
+            "route": "GET /items/category/{category}?page_size=",
+            "collection": db.items,
+            "filter": {"category": category},
+            "limit": 51,
+        },
+        {
+            "route": "GET /items/id/{id}",
+            "collection": db.items,
+            "filter": {"_id": item.get("_id")},
+        },
+        {
+            "route": "GET /users/username/{username}",
+            "collection": db.users,
+            "filter": {"username": username},
+        },
+        {
+            "route": "GET /users?page_size=",
+            "collection": db.users,
+            "filter": {},
+            "sort": [("username", 1)],
+            "limit": 51,
+        },
+        {
+            "route": "GET /locations/username/{username}",
+            "collection": db.locations,
+            "filter": {"username": username},
+        },
+        {
+            "route": "GET /locations/within",
+            "collection": db.locations,
+            "filter": viewport_filter(
+                max(latitude - 5, -90),
+                max(longitude - 5, -180),
+                min(latitude + 5, 90),
+                min(longitude + 5, 180),
+            ),
+            "sort": [],
+            "limit": 100,
+        },
+        {
+            "route": "GET /user-data?page_size=",
+            "collection": db.user_data,
+            "filter": COMPLETE_FILTER,
+            "sort": [("username", 1)],
+            "limit": 51,
+        },
+        {
+            "route": "GET /user-data?south=&west=&north=&east=",
+            "collection": db.user_data,
+            "filter": {
+                **COMPLETE_FILTER,
+                **viewport_filter(
+                    max(latitude - 5, -90),
+                    max(longitude - 5, -180),
+                    min(latitude + 5, 90),
+                    min(longitude + 5, 180),
+                ),
+            },
+            "sort": [("username", 1)],
+            "limit": 51,
+        },
+    ]
+
+
+def plan_stages(plan: dict) -> list[dict]:
+    """Flattens a query plan into its stages, outermost first."""
+    stages: list[dict] = [plan]
+    for child in ("inputStage", "queryPlan"):
+        if child in plan:
+            stages.extend(plan_stages(plan[child]))
+    for input_stage in plan.get("inputStages", []):
+        stages.extend(plan_stages(input_stage))
+    return stages
+
+
+def check_query(shape: dict) -> dict:
+    """Explains one query shape.
+
+    Args:
+        shape (dict): Query shape from query_shapes.
+    Returns:
+        Dict with the stages, indexes used and documents examined and returned.
+    """
+    collection: StoreCollection = shape["collection"]
+    explained: dict = collection.explain(
+        shape["filter"],
+        shape.get("projection", {}),
+        shape.get("sort", [("_id", 1)]),
+        shape.get("limit", 0),
+    )
+
+    stages: list[dict] = plan_stages(explained["queryPlanner"]["winningPlan"])
+    stats: dict = explained.get("executionStats", {})
+    names: list[str] = [stage["stage"] for stage in stages]
+
+    return {
+        "route": shape["route"],
+        "stages": names,
+        "indexes": [stage["indexName"] for stage in stages if "indexName" in stage],
+        "examined": stats.get("totalDocsExamined", 0),
+        "returned": stats.get("nReturned", 0),
+        "collscan": "COLLSCAN" in names,
+        "sort": "SORT" in names,
+    }
+
+
+if __name__ == "__main__":
+
+    ENV_PATH: str = "./.env"
+
+    load_dotenv(ENV_PATH)
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Apply the index spec before checking.",
+    )
+    args = parser.parse_args()
+
+    db = StoreDatabase(
+        username=os.environ.get("STORE_USER"),
+        password=os.environ.get("STORE_PASSWORD"),
+        host="localhost",
+        port=27017,
+        database="awesome_store",
+    )
+
+    if args.apply:
+        for collection, indexes in load_index_specs().items():
+            created: list[str] = db.get_collection(collection).ensure_indexes(indexes)
+            print(f"{collection}: created {', '.join(created) or 'nothing'}")
+
+    table = Table(title="Query plans")
+    for column in ("Route", "Plan", "Indexes", "Examined", "Returned"):
+        table.add_column(column)
+
+    results: list[dict] = [check_query(shape) for shape in query_shapes(db)]
+    for result in results:
+        style: str = "red" if result["collscan"] else "yellow" if result["sort"] else ""
+        table.add_row(
+            result["route"],
+            " <- ".join(result["stages"]),
+            ", ".join(result["indexes"]) or "-",
+            str(result["examined"]),
+            str(result["returned"]),
+            style=style,
+        )
+    print(table)
+
+    db.close()
+
+    scans: list[str] = [result["route"] for result in results if result["collscan"]]
+    if scans:
+        print(f"[red]Collection scans: {', '.join(scans)}")
+        sys.exit(1)
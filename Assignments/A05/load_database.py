@@ -2,31 +2,285 @@
 
 Provides function for easily initializing and creating the store database.
 Provides the function load_database.
+
+Documents are de-duplicated in memory and written with unordered bulk
+upserts, so the loader can be rerun against a live database without
+dropping the collections first. The items files are parsed by a pool of
+worker processes while earlier batches are being written.
 """
 
-from store_database import StoreDatabase
+from store_database import StoreDatabase, StoreCollection, load_index_specs
+from geo import POSITION_FIELD, POSITION_EXPRESSION, geo_point
+from passwords import hash_password
+from user_data_view import profile_rebuild_pipeline, location_rebuild_pipeline
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from queue import Queue
+import argparse
 import json
 import glob
+import time
 from rich import print
 from dotenv import load_dotenv
 import os
-from hashlib import sha256
+
+DEFAULT_BATCH_SIZE: int = 1000
+DEFAULT_WORKERS: int = os.cpu_count() or 1
+
+
+def read_users(users_file: str) -> dict[str, dict]:
+    """Reads the users, keyed by username, with their plain passwords."""
+    users: dict[str, dict] = {}
+
+    with open(users_file, "r") as file:
+        for user in json.load(file):
+            users.setdefault(user["username"], user)
+
+    return users
+
+
+def new_users(collection: StoreCollection, users: dict[str, dict]) -> list[dict]:
+    """Returns the users not in the collection yet, with hashed passwords.
+
+    Users are only ever inserted, never overwritten, so hashing the ones
+    that already exist would be thrown away. Hashing is the slow part of a
+    rerun, so it is skipped for them.
+
+    Args:
+        collection (StoreCollection): The users collection.
+        users (dict[str, dict]): Users read by read_users, keyed by username.
+    Returns:
+        The users to insert.
+    """
+    existing: set[str] = set(
+        collection.distinct("username", {"username": {"$in": list(users)}})
+    )
+
+    inserted: list[dict] = []
+    for username, user in users.items():
+        if username not in existing:
+            inserted.append({**user, "password": hash_password(user["password"])})
+
+    return inserted
+
+
+def read_locations(locations_file: str) -> dict[str, dict]:
+    """Reads the locations, keyed by username, with their GeoJSON position."""
+    with open(locations_file, "r") as file:
+        return {
+            location["username"]: {
+                **location,
+                POSITION_FIELD: geo_point(location["latitude"], location["longitude"]),
+            }
+            for location in json.load(file)
+        }
+
+
+def parse_items_file(file: str) -> list[dict]:
+    """Parses and normalizes one items file.
+
+    Runs in a worker process. movies.json is already a list of items, while a
+    category file maps ids to candies and is tagged after its filename.
+
+    Args:
+        file (str): Path of the file.
+    Returns:
+        The items in the file.
+    """
+    with open(file) as f:
+        json_data: list[dict] | dict = json.load(f)
+
+    if isinstance(json_data, list):
+        items: list[dict] = json_data
+    else:
+        parts = file.split("/")
+        tag = parts[-1][:-5].replace("-", " ").title()
+
+        items = []
+        for id, item in json_data.items():
+            item.pop("id")
+            item["category"] = str(StoreDatabase.Categories.GroceryNGourmetFood)
+            item["tags"] = [tag, "Candy", "Sweets"]
+            items.append(item)
+
+    for item in items:
+        item["price"] = float(item["price"])
+
+    return items
+
+
+def bulk_upsert(
+    collection: StoreCollection,
+    documents: list[dict],
+    key: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    overwrite: bool = True,
+) -> dict:
+    """Upserts documents in batches of unordered bulk writes.
+
+    Args:
+        collection (StoreCollection): Collection to write to.
+        documents (list[dict]): Documents to upsert.
+        key (str): Field that identifies a document.
+        batch_size (int, optional): Number of operations per bulk write.
+        overwrite (bool, optional): If False, existing documents are left untouched.
+    Returns:
+        Dict with the write counts and throughput.
+    """
+    operator: str = "$set" if overwrite else "$setOnInsert"
+    summary: dict = {
+        "collection": collection.name,
+        "documents": len(documents),
+        "upserted_count": 0,
+        "modified_count": 0,
+        "errors": 0,
+    }
+
+    start: float = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        requests: list[UpdateOne] = [
+            UpdateOne({key: document[key]}, {operator: document}, upsert=True)
+            for document in documents[i : i + batch_size]
+        ]
+        try:
+            result: dict = collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # Unordered writes carry on past failures, count what succeeded
+            result = {
+                "upserted_count": e.details["nUpserted"],
+                "modified_count": e.details["nModified"],
+            }
+            summary["errors"] += len(e.details["writeErrors"])
+
+        summary["upserted_count"] += result["upserted_count"]
+        summary["modified_count"] += result["modified_count"]
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["docs_per_sec"] = len(documents) / max(summary["seconds"], 1e-9)
+    return summary
+
+
+def create_collection(db: StoreDatabase, collection: str, validator: dict) -> None:
+    """Creates a collection with its validator, if it does not exist yet."""
+    if str(collection) not in db.database.list_collection_names():
+        db.create_collection(collection, validator)
+
+
+def load_items(
+    collection: StoreCollection,
+    files: list[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+) -> dict:
+    """Parses the items files in parallel and upserts them as they arrive.
+
+    A pool of worker processes parses the files into a bounded queue, which a
+    writer stage drains into batched bulk upserts. An item listed in more
+    than one file keeps the first entry, in the order of files.
+
+    Args:
+        collection (StoreCollection): Collection to write to.
+        files (list[str]): Paths of the items files.
+        batch_size (int, optional): Number of operations per bulk write.
+        workers (int, optional): Number of processes parsing files.
+    Returns:
+        Dict with the write counts, throughput and time spent in each stage.
+    """
+    summary: dict = {
+        "collection": collection.name,
+        "documents": 0,
+        "upserted_count": 0,
+        "modified_count": 0,
+        "errors": 0,
+    }
+    timings: dict = {"parse": 0.0, "write": 0.0, "wait": 0.0}
+    parsed: Queue = Queue(maxsize=workers * 2)
+    start: float = time.perf_counter()
+
+    def parse_files() -> None:
+        """Parses the files in parallel, in order, into the queue."""
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for items in executor.map(parse_items_file, files):
+                    parsed.put(items)
+        finally:
+            timings["parse"] = time.perf_counter() - start
+            parsed.put(None)
+
+    def write(batch: list[dict]) -> None:
+        """Upserts a batch of items."""
+        result: dict = bulk_upsert(collection, batch, "name", batch_size)
+        for key in ("documents", "upserted_count", "modified_count", "errors"):
+            summary[key] += result[key]
+        timings["write"] += result["seconds"]
+
+    with ThreadPoolExecutor(max_workers=1) as parser:
+        producer: Future = parser.submit(parse_files)
+
+        seen: set[str] = set()
+        batch: list[dict] = []
+
+        try:
+            while True:
+                wait_start: float = time.perf_counter()
+                items: list[dict] | None = parsed.get()
+                timings["wait"] += time.perf_counter() - wait_start
+
+                if items is None:
+                    break
+
+                for item in items:
+                    # Avoid upserting duplicates
+                    if item["name"] not in seen:
+                        seen.add(item["name"])
+                        batch.append(item)
+
+                while len(batch) >= batch_size:
+                    write(batch[:batch_size])
+                    batch = batch[batch_size:]
+        except BaseException:
+            # Unblock the parser before bailing out
+            while parsed.get() is not None:
+                pass
+            raise
+
+        # Surface any error raised while parsing
+        producer.result()
+
+    if batch:
+        write(batch)
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["docs_per_sec"] = summary["documents"] / max(summary["seconds"], 1e-9)
+    summary["timings"] = timings
+    return summary
 
 
 def load_database(
     folder_path: str = "./",
     collection_validator_config: str = "./collection_validators.json",
+    collection_index_config: str = "./collection_indexes.json",
     users_file: str = "./users.json",
     locations_file: str = "./locations.json",
+    movies_file: str = "./movies.json",
     username: str = None,
     password: str = None,
     host: str = None,
     port: str = None,
     database: str = None,
-) -> None:
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    drop: bool = False,
+) -> list[dict]:
     """Configures the database and populates the collections.
 
     Configures the database for the store and populates the collections.
+    Safe to rerun: items are refreshed from the seed files, while seeded
+    users and locations are only inserted if missing.
+
+    Returns:
+        A summary of the writes to each collection.
     """
     # Get absolute path
     folder_path = os.path.abspath(folder_path)
@@ -35,81 +289,76 @@ def load_database(
     json_files = glob.glob(f"{folder_path}/*.json")
 
     validators: dict = None
-    users: list[dict] = None
 
     # Read in validator / jsonSchema for each collection
     with open(collection_validator_config, "r") as file:
         validators = json.load(file)
 
+    # Users and locations are small, parse and de-duplicate them up front
+    users: dict[str, dict] = read_users(users_file)
+    locations: dict[str, dict] = read_locations(locations_file)
+
     db = StoreDatabase(
         username=username, password=password, host=host, port=port, database=database
     )
 
-    db.drop_collection(StoreDatabase.Collections.ItemsCollection)
-    db.drop_collection(StoreDatabase.Collections.UsersCollection)
-    db.drop_collection(StoreDatabase.Collections.LocationsCollection)
+    if drop:
+        db.drop_collection(StoreDatabase.Collections.ItemsCollection)
+        db.drop_collection(StoreDatabase.Collections.UsersCollection)
+        db.drop_collection(StoreDatabase.Collections.LocationsCollection)
+        db.drop_collection(StoreDatabase.Collections.UserDataCollection)
 
-    # Create items collection with specified schema and unique index
-    db.create_collection(
-        StoreDatabase.Collections.ItemsCollection,
-        validators[StoreDatabase.Collections.ItemsCollection],
-    )
-    db.set_collection(StoreDatabase.Collections.ItemsCollection)
+    # Create each collection with specified schema and indices
+    for collection in StoreDatabase.Collections:
+        create_collection(db, collection, validators[collection])
 
-    # Create users collection with specified schema and unique indices
-    db.create_collection(
-        StoreDatabase.Collections.UsersCollection,
-        validators[StoreDatabase.Collections.UsersCollection],
-    )
-    db.set_collection(StoreDatabase.Collections.UsersCollection)
-    db.collection.create_index({"username": 1}, unique=True)
-    db.collection.create_index({"email": 1}, unique=True)
+    for collection, indexes in load_index_specs(collection_index_config).items():
+        db.get_collection(collection).ensure_indexes(indexes)
 
-    with open(users_file, "r") as file:
-        users: list[dict] = json.load(file)
-
-        # Hash each password, then insert each user
-        for user in users:
-            encoded_str: bytes = user["password"].encode()
-            hashed_password: str = sha256(encoded_str).hexdigest()
-            user["password"] = hashed_password
+    summaries: list[dict] = [
+        bulk_upsert(
+            db.users,
+            new_users(db.users, users),
+            "username",
+            batch_size,
+            overwrite=False,
+        ),
+        bulk_upsert(
+            db.locations,
+            list(locations.values()),
+            "username",
+            batch_size,
+            overwrite=False,
+        ),
+        load_items(db.items, [movies_file, *sorted(json_files)], batch_size, workers),
+    ]
 
-            db.insert_one(user)
-
-    # Create items collection with specified schema and unique index
-    db.create_collection(
-        StoreDatabase.Collections.LocationsCollection,
-        validators[StoreDatabase.Collections.LocationsCollection],
+    # Locations stored before positions were added get one
+    db.locations.update_many(
+        {POSITION_FIELD: {"$exists": False}},
+        [{"$set": {POSITION_FIELD: POSITION_EXPRESSION}}],
     )
-    db.set_collection(StoreDatabase.Collections.LocationsCollection)
-    db.collection.create_index({"username": 1}, unique=True)
-
-    with open(locations_file, "r") as file:
-        locations: list[dict] = json.load(file)
-
-        # Insert all locations
-        db.insert_many(locations)
-
-    with open("movies.json", "r") as file:
-        db.set_collection(StoreDatabase.Collections.ItemsCollection)
-        data = json.load(file)
-        db.insert_many(data)
 
-    for file in json_files:
-        parts = file.split("/")
-        tag = parts[-1][:-5].replace("-", " ").title()
+    # Materialize the join of users and locations served by GET /user-data
+    db.users.aggregate(profile_rebuild_pipeline())
+    db.locations.aggregate(location_rebuild_pipeline())
 
-        with open(file) as f:
-            json_data: dict = json.load(f)
+    for summary in summaries:
+        print(
+            f"{summary['collection']}: {summary['documents']} docs "
+            f"({summary['upserted_count']} new, {summary['modified_count']} updated, "
+            f"{summary['errors']} errors) in {summary['seconds']:.2f}s, "
+            f"{summary['docs_per_sec']:.0f} docs/sec"
+        )
+        if "timings" in summary:
+            timings: dict = summary["timings"]
+            print(
+                f"  parse {timings['parse']:.2f}s, write {timings['write']:.2f}s, "
+                f"writer idle {timings['wait']:.2f}s"
+            )
 
-            db.set_collection(StoreDatabase.Collections.ItemsCollection)
-            for id, item in json_data.items():
-                item.pop("id")
-                item["category"] = StoreDatabase.Categories.GroceryNGourmetFood
-                item["tags"] = [tag, "Candy", "Sweets"]
-                # Avoid inserting duplicates
-                if not db.find({"name": item["name"]}):
-                    db.insert_one(item)
+    db.close()
+    return summaries
 
 
 if __name__ == "__main__":
@@ -118,6 +367,26 @@ if __name__ == "__main__":
 
     load_dotenv(ENV_PATH)
 
+    parser = argparse.ArgumentParser(description="Load the store database.")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of operations per bulk write.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of processes parsing the items files.",
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Drop the collections before loading.",
+    )
+    args = parser.parse_args()
+
     username: str = os.environ.get("STORE_USER")
     password: str = os.environ.get("STORE_PASSWORD")
 
@@ -128,6 +397,9 @@ if __name__ == "__main__":
         "database": "awesome_store",
         "port": 27017,
         "host": "localhost",
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "drop": args.drop,
     }
 
     load_database(**kwargs)
@@ -0,0 +1,219 @@
+"""Load tests the live location WebSocket.
+
+Holds many concurrent sockets on /locations/live, each subscribed to a
+random viewport inside a region, while updates for random users in the
+region are posted to POST /locations/batch. Reports how many sockets
+connected and stayed connected, and how long updates took to arrive.
+
+Needs a running API and the websockets package. Run the API with one
+worker to measure what one worker holds, and raise its open file limit
+(ulimit -n) above the number of sockets.
+"""
+
+from rich import print
+from rich.table import Table
+import argparse
+import asyncio
+import json
+import random
+import resource
+import requests
+import time
+import websockets
+
+# Region the updates and viewports are in, as (south, west, north, east)
+DEFAULT_REGION: tuple[float, float, float, float] = (30.0, -104.0, 37.0, -94.0)
+
+
+def raise_file_limit() -> int:
+    """Raises the open file limit of this process as far as allowed."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """Returns a percentile of sorted values, None if there are none."""
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def client(
+    url: str,
+    viewport: dict,
+    connected: asyncio.Event,
+    stop: asyncio.Event,
+    results: dict,
+    connect_limit: asyncio.Semaphore,
+) -> None:
+    """Holds one socket until stop is set, recording delivery latencies."""
+    try:
+        async with connect_limit:
+            socket = await websockets.connect(url, open_timeout=30)
+    except Exception:
+        results["failed"] += 1
+        connected.set()
+        return
+
+    results["connected"] += 1
+    try:
+        await socket.send(json.dumps({"viewport": viewport}))
+        connected.set()
+        while not stop.is_set():
+            try:
+                message: str = await asyncio.wait_for(socket.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            now: float = time.time() * 1000
+            locations: list[dict] = json.loads(message)["locations"]
+            results["messages"] += 1
+            results["updates"] += len(locations)
+            results["latencies"].extend(now - loc["timestamp"] for loc in locations)
+    except websockets.ConnectionClosed:
+        results["dropped"] += 1
+    finally:
+        await socket.close()
+
+
+def random_viewport(region: tuple[float, float, float, float], size: float) -> dict:
+    """Returns a random viewport of size degrees inside the region."""
+    south, west, north, east = region
+    lat: float = random.uniform(south, north - size)
+    lon: float = random.uniform(west, east - size)
+    return {"south": lat, "west": lon, "north": lat + size, "east": lon + size}
+
+
+def post_updates(
+    session: requests.Session,
+    url: str,
+    region: tuple[float, float, float, float],
+    users: int,
+) -> None:
+    """Posts one update for every test user."""
+    south, west, north, east = region
+    timestamp: int = int(time.time() * 1000)
+    batch: list[dict] = [
+        {
+            "username": f"load_test_{user}",
+            "latitude": random.uniform(south, north),
+            "longitude": random.uniform(west, east),
+            "timestamp": timestamp,
+        }
+        for user in range(users)
+    ]
+    session.post(url, json=batch, timeout=30).raise_for_status()
+
+
+async def main(args: argparse.Namespace) -> None:
+    limit: int = raise_file_limit()
+    if limit < args.sockets + 100:
+        print(f"[yellow]Open file limit is {limit}, some sockets may fail")
+
+    ws_url: str = args.url.replace("http", "ws", 1) + "/locations/live"
+    results: dict = {
+        "connected": 0,
+        "failed": 0,
+        "dropped": 0,
+        "messages": 0,
+        "updates": 0,
+        "latencies": [],
+    }
+    stop: asyncio.Event = asyncio.Event()
+    connect_limit: asyncio.Semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    start: float = time.perf_counter()
+    clients: list[asyncio.Task] = []
+    ready: list[asyncio.Event] = []
+    for _ in range(args.sockets):
+        connected: asyncio.Event = asyncio.Event()
+        ready.append(connected)
+        clients.append(
+            asyncio.create_task(
+                client(
+                    ws_url,
+                    random_viewport(DEFAULT_REGION, args.viewport),
+                    connected,
+                    stop,
+                    results,
+                    connect_limit,
+                )
+            )
+        )
+    _, waiting = await asyncio.wait(
+        [asyncio.create_task(event.wait()) for event in ready], timeout=args.ramp
+    )
+    for task in waiting:
+        task.cancel()
+    connect_seconds: float = time.perf_counter() - start
+    print(f"{results['connected']} sockets connected in {connect_seconds:.1f}s")
+
+    session: requests.Session = requests.Session()
+    batch_url: str = args.url + "/locations/batch"
+    deadline: float = time.perf_counter() + args.duration
+    rounds: int = 0
+    while time.perf_counter() < deadline:
+        await asyncio.to_thread(
+            post_updates, session, batch_url, DEFAULT_REGION, args.users
+        )
+        rounds += 1
+        await asyncio.sleep(args.interval)
+
+    # Give the last updates time to arrive
+    await asyncio.sleep(1)
+    stop.set()
+    await asyncio.gather(*clients)
+
+    server: dict = session.get(args.url + "/locations/live/stats", timeout=30).json()
+    latencies: list[float] = sorted(results["latencies"])
+
+    table = Table(title=f"/locations/live, {args.sockets} sockets, {rounds} rounds")
+    table.add_column("Metric")
+    table.add_column("Value")
+    for name, value in (
+        ("Connected", results["connected"]),
+        ("Failed to connect", results["failed"]),
+        ("Dropped while running", results["dropped"]),
+        ("Messages received", results["messages"]),
+        ("Updates received", results["updates"]),
+        ("Latency p50 ms", percentile(latencies, 0.5)),
+        ("Latency p95 ms", percentile(latencies, 0.95)),
+        ("Latency p99 ms", percentile(latencies, 0.99)),
+        ("Latency max ms", latencies[-1] if latencies else None),
+        ("Server fanned out", server.get("fanned_out")),
+        ("Server dropped (coalesced)", server.get("dropped")),
+    ):
+        table.add_row(name, f"{value:.1f}" if isinstance(value, float) else str(value))
+    print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", default="http://localhost:8085", help="Base URL of the API."
+    )
+    parser.add_argument(
+        "--sockets", type=int, default=5000, help="Number of concurrent sockets."
+    )
+    parser.add_argument(
+        "--users", type=int, default=200, help="Number of users sending updates."
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="Seconds between update rounds."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="Seconds to send updates for."
+    )
+    parser.add_argument(
+        "--viewport", type=float, default=2.0, help="Size of the viewports, in degrees."
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=60.0, help="Seconds allowed to open the sockets."
+    )
+    parser.add_argument(
+        "--connect-concurrency",
+        type=int,
+        default=200,
+        help="Sockets opened at the same time.",
+    )
+    asyncio.run(main(parser.parse_args()))
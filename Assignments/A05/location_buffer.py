@@ -0,0 +1,253 @@
+"""Provides buffered ingest of user locations.
+
+Provides the class LocationBuffer, which collects location updates in
+memory and writes them with one unordered bulk write per flush. Updates for
+the same username within a flush window are coalesced, keeping the one with
+the latest timestamp, so a device sending a GPS fix every second costs one
+write per flush instead of one per fix.
+
+Each write only applies if it is newer than the stored location, so late or
+out of order updates never overwrite a newer one. If a history collection
+is given, every update is also appended to it in the same flushes, and if
+the user_data collection is given, the written updates are also applied
+to it. Updates are kept in memory until they are flushed, so up to one
+flush window of updates can be lost if the process dies.
+"""
+
+from async_store_database import AsyncStoreCollection
+from geo import POSITION_FIELD, geo_point
+from location_history import history_point
+from user_data_view import location_update
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from collections import deque
+from rich import print
+import asyncio
+import time
+
+DEFAULT_MAX_PENDING: int = 10000
+DEFAULT_FLUSH_INTERVAL: float = 1.0
+# Number of recent flushes the latency metrics are computed over
+LATENCY_SAMPLES: int = 256
+DUPLICATE_KEY: int = 11000
+
+
+class BufferFull(Exception):
+    """Raised when updates can't be buffered because flushes are failing."""
+
+
+class LocationBuffer:
+    """Coalesces location updates in memory and flushes them in bulk.
+
+    Flushes happen every flush_interval seconds while run is running, and
+    as soon as max_pending usernames are waiting.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncStoreCollection,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        history: AsyncStoreCollection = None,
+        user_data: AsyncStoreCollection = None,
+    ) -> None:
+        """Creates an empty buffer.
+
+        Args:
+            collection (AsyncStoreCollection): The locations collection.
+            max_pending (int, optional): Largest number of usernames, and of history points, waiting for a flush.
+            flush_interval (float, optional): Seconds between flushes.
+            history (AsyncStoreCollection, optional): Collection every update is appended to. None to keep no history.
+            user_data (AsyncStoreCollection, optional): The materialized user_data collection, None if it isn't kept.
+        """
+        self.collection: AsyncStoreCollection = collection
+        self.history: AsyncStoreCollection | None = history
+        self.user_data: AsyncStoreCollection | None = user_data
+        self.max_pending: int = max_pending
+        self.flush_interval: float = flush_interval
+
+        self._pending: dict[str, dict] = {}
+        self._points: list[dict] = []
+        self._flush_lock: asyncio.Lock = asyncio.Lock()
+
+        self._received: int = 0
+        self._coalesced: int = 0
+        self._stale: int = 0
+        self._flushes: int = 0
+        self._failed_flushes: int = 0
+        self._operations: int = 0
+        self._write_errors: int = 0
+        self._history_points: int = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._sizes: deque[int] = deque(maxlen=LATENCY_SAMPLES)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _full(self, username: str) -> bool:
+        """Returns whether an update for username must wait for a flush."""
+        return len(self._points) >= self.max_pending or (
+            username not in self._pending and len(self._pending) >= self.max_pending
+        )
+
+    def get(self, username: str) -> dict | None:
+        """Returns the update waiting to be flushed for a username, or None."""
+        return self._pending.get(username)
+
+    async def add(self, location: dict) -> None:
+        """Buffers a location update.
+
+        Args:
+            location (dict): Location with username, latitude, longitude and timestamp.
+        Raises:
+            BufferFull: If the buffer is full and can't be flushed.
+        """
+        username: str = location["username"]
+        if self._full(username):
+            await self.flush()
+            if self._full(username):
+                raise BufferFull(f"{len(self._pending)} location updates are waiting")
+
+        self._received += 1
+        if self.history is not None:
+            self._points.append(history_point(location))
+        current: dict | None = self._pending.get(username)
+        if current is not None:
+            self._coalesced += 1
+            if current["timestamp"] > location["timestamp"]:
+                return
+        self._pending[username] = location
+
+    async def flush(self) -> int:
+        """Writes the buffered updates with one unordered bulk write.
+
+        Updates are put back if the write fails, unless a newer one arrived
+        in the meantime.
+
+        Returns:
+            Number of updates written.
+        """
+        async with self._flush_lock:
+            await self._flush_history()
+            if not self._pending:
+                return 0
+            pending: dict[str, dict] = self._pending
+            self._pending = {}
+
+            requests: list[UpdateOne] = [
+                UpdateOne(
+                    # Only newer updates apply, older ones fail to upsert
+                    # with a duplicate username and are dropped
+                    {"username": username, "timestamp": {"$lt": location["timestamp"]}},
+                    {
+                        "$set": {
+                            "latitude": location["latitude"],
+                            "longitude": location["longitude"],
+                            "timestamp": location["timestamp"],
+                            POSITION_FIELD: geo_point(
+                                location["latitude"], location["longitude"]
+                            ),
+                        }
+                    },
+                    upsert=True,
+                )
+                for username, location in pending.items()
+            ]
+
+            start: float = time.perf_counter()
+            try:
+                await self.collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                errors: list[dict] = e.details["writeErrors"]
+                stale: int = sum(error["code"] == DUPLICATE_KEY for error in errors)
+                self._stale += stale
+                self._write_errors += len(errors) - stale
+            except PyMongoError as e:
+                print(f"[red]Failed to flush {len(pending)} location updates: {e}")
+                self._failed_flushes += 1
+                for username, location in pending.items():
+                    current: dict | None = self._pending.get(username)
+                    if current is None or current["timestamp"] < location["timestamp"]:
+                        self._pending[username] = location
+                return 0
+
+            self._latencies.append(time.perf_counter() - start)
+            self._sizes.append(len(requests))
+            self._flushes += 1
+            self._operations += len(requests)
+            await self._flush_user_data(pending)
+            return len(requests)
+
+    async def _flush_user_data(self, pending: dict[str, dict]) -> None:
+        """Applies the flushed updates to the user_data collection.
+
+        Failed writes are not retried, rebuilding user_data repairs them.
+        """
+        if self.user_data is None:
+            return
+        try:
+            await self.user_data.bulk_write(
+                [location_update(location) for location in pending.values()],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            errors: list[dict] = e.details["writeErrors"]
+            self._write_errors += sum(
+                error["code"] != DUPLICATE_KEY for error in errors
+            )
+        except PyMongoError as e:
+            print(f"[red]Failed to update user_data for {len(pending)} locations: {e}")
+            self._failed_flushes += 1
+
+    async def _flush_history(self) -> None:
+        """Appends the buffered points to the history collection."""
+        if not self._points:
+            return
+        points: list[dict] = self._points
+        self._points = []
+
+        try:
+            await self.history.insert_many(points)
+        except BulkWriteError as e:
+            self._write_errors += len(e.details["writeErrors"])
+        except PyMongoError as e:
+            print(f"[red]Failed to append {len(points)} history points: {e}")
+            self._failed_flushes += 1
+            self._points = points + self._points
+            return
+        self._history_points += len(points)
+
+    async def run(self) -> None:
+        """Flushes every flush_interval seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        """Returns the ingest counters and the latency of recent flushes."""
+        latencies: list[float] = sorted(self._latencies)
+        return {
+            "pending": len(self._pending),
+            "received": self._received,
+            "coalesced": self._coalesced,
+            "stale": self._stale,
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes,
+            "write_operations": self._operations,
+            "write_errors": self._write_errors,
+            "history_points": self._history_points,
+            "operations_per_update": (
+                self._operations / self._received if self._received else 0.0
+            ),
+            "flush_size_mean": (
+                sum(self._sizes) / len(self._sizes) if self._sizes else 0.0
+            ),
+            "flush_ms": {
+                "last": self._latencies[-1] * 1000 if latencies else None,
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else None,
+                "p95": (
+                    latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None
+                ),
+                "max": latencies[-1] * 1000 if latencies else None,
+            },
+        }
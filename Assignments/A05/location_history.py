@@ -0,0 +1,136 @@
+"""Provides the location history of users.
+
+Every location update can also be appended to the location_history
+collection, a MongoDB time-series collection with the username as its
+metaField, so the locations collection keeps only the latest point of each
+user while their tracks are kept here. Old points are removed by the
+collection's expireAfterSeconds.
+
+Provides the function that creates or updates the collection, and the
+query for a user's track over a time window, optionally downsampled to one
+point per interval.
+"""
+
+from async_store_database import AsyncStoreDatabase, AsyncStoreCollection
+from datetime import datetime, timezone
+
+HISTORY_COLLECTION: str = "location_history"
+TIME_FIELD: str = "recorded_at"
+META_FIELD: str = "username"
+
+
+def history_point(location: dict) -> dict:
+    """Returns the history document of a location update.
+
+    Args:
+        location (dict): Location with username, latitude, longitude and timestamp in milliseconds.
+    Returns:
+        The document, with the timestamp as a date in the time field.
+    """
+    return {
+        META_FIELD: location["username"],
+        TIME_FIELD: datetime.fromtimestamp(
+            location["timestamp"] / 1000, tz=timezone.utc
+        ),
+        "latitude": location["latitude"],
+        "longitude": location["longitude"],
+    }
+
+
+async def ensure_history_collection(
+    db: AsyncStoreDatabase, retention_seconds: int = None
+) -> AsyncStoreCollection:
+    """Creates the time-series collection if needed, and applies the retention.
+
+    Args:
+        db (AsyncStoreDatabase): The store database.
+        retention_seconds (int, optional): Seconds points are kept. None to keep them forever.
+    Returns:
+        The collection.
+    """
+    names: list[str] = await db.database.list_collection_names(
+        filter={"name": HISTORY_COLLECTION}
+    )
+    if not names:
+        options: dict = {
+            "timeseries": {
+                "timeField": TIME_FIELD,
+                "metaField": META_FIELD,
+                "granularity": "seconds",
+            }
+        }
+        if retention_seconds:
+            options["expireAfterSeconds"] = retention_seconds
+        await db.create_collection(HISTORY_COLLECTION, **options)
+    else:
+        # Retention may have changed since the collection was created
+        await db.database.command(
+            "collMod",
+            HISTORY_COLLECTION,
+            expireAfterSeconds=retention_seconds or "off",
+        )
+
+    return db.get_collection(HISTORY_COLLECTION)
+
+
+def track_pipeline(
+    username: str,
+    start: datetime,
+    end: datetime,
+    interval: int = None,
+    limit: int = 0,
+) -> list[dict]:
+    """Returns an aggregation pipeline for a user's track over a time window.
+
+    Args:
+        username (str): The username of the user.
+        start (datetime): Start of the window, inclusive.
+        end (datetime): End of the window, exclusive.
+        interval (int, optional): Seconds per point. Only the last point of each interval is kept, with the number of points it stands for. None to return every point.
+        limit (int, optional): Largest number of points to return, the newest ones, 0 for no limit.
+    Returns:
+        The pipeline, whose results are points sorted oldest first, with the
+        timestamp in milliseconds like the locations collection.
+    """
+    pipeline: list[dict] = [
+        {"$match": {META_FIELD: username, TIME_FIELD: {"$gte": start, "$lt": end}}},
+    ]
+    projection: dict = {
+        "_id": 0,
+        "latitude": 1,
+        "longitude": 1,
+        "timestamp": {"$toLong": f"${TIME_FIELD}"},
+    }
+
+    if interval:
+        pipeline += [
+            {"$sort": {TIME_FIELD: 1}},
+            {
+                "$group": {
+                    "_id": {
+                        "$dateTrunc": {
+                            "date": f"${TIME_FIELD}",
+                            "unit": "second",
+                            "binSize": interval,
+                        }
+                    },
+                    TIME_FIELD: {"$last": f"${TIME_FIELD}"},
+                    "latitude": {"$last": "$latitude"},
+                    "longitude": {"$last": "$longitude"},
+                    "points": {"$sum": 1},
+                }
+            },
+        ]
+        projection["points"] = 1
+
+    if limit:
+        # Keep the newest points, then put them back oldest first
+        pipeline += [
+            {"$sort": {TIME_FIELD: -1}},
+            {"$limit": limit},
+            {"$sort": {TIME_FIELD: 1}},
+        ]
+    else:
+        pipeline.append({"$sort": {TIME_FIELD: 1}})
+    pipeline.append({"$project": projection})
+    return pipeline
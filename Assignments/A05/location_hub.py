@@ -0,0 +1,247 @@
+"""Provides an in-process pub/sub hub for live location updates.
+
+Provides the class LocationHub, which fans location updates out to the
+subscriptions whose viewport contains them, and the class Subscription,
+which holds the updates waiting to be sent to one client.
+
+Publishing never waits on a client. A slow client's updates are coalesced
+per username, so it always gets each user's latest location, and at most
+max_pending users are held for it. Subscriptions are indexed by the grid
+cells their viewport covers, so an update is only checked against the
+subscriptions near it. The hub only sees updates made through this
+process, so with several workers each worker has its own hub.
+
+Out of order updates are recognized by the last timestamp published for
+each user, which is kept for the max_users most recently updated users.
+"""
+
+from geo import in_viewport
+from collections import OrderedDict
+import asyncio
+import math
+
+DEFAULT_MAX_PENDING: int = 1000
+DEFAULT_MAX_USERS: int = 100000
+# Size of the grid cells subscriptions are indexed by, in degrees
+CELL_SIZE: float = 1.0
+# Viewports covering more cells are checked against every update instead
+MAX_CELLS: int = 400
+
+
+class Subscription:
+    """Updates waiting to be sent to one client.
+
+    A subscription without a viewport receives every update.
+    """
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING) -> None:
+        """Creates a subscription to every update.
+
+        Args:
+            max_pending (int, optional): Largest number of users whose updates are held.
+        """
+        self.max_pending: int = max_pending
+        self.viewport: tuple[float, float, float, float] | None = None
+        self.delivered: int = 0
+        self.dropped: int = 0
+
+        self._pending: dict[str, dict] = {}
+        self._ready: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set_viewport(self, viewport: tuple[float, float, float, float] | None) -> None:
+        """Changes the viewport, as (south, west, north, east), or None for every update.
+
+        Held updates outside the new viewport are discarded. Subscriptions
+        of a hub must change their viewport with LocationHub.set_viewport.
+        """
+        self.viewport = viewport
+        for username, location in list(self._pending.items()):
+            if not self.wants(location):
+                del self._pending[username]
+
+    def wants(self, location: dict) -> bool:
+        """Returns whether a location is inside the viewport."""
+        return self.viewport is None or in_viewport(
+            location["latitude"], location["longitude"], *self.viewport
+        )
+
+    def offer(self, location: dict) -> None:
+        """Holds an update, replacing the held update of the same user.
+
+        If max_pending users are held already, the oldest one is dropped.
+        """
+        username: str = location["username"]
+        if self._pending.pop(username, None) is not None:
+            self.dropped += 1
+        elif len(self._pending) >= self.max_pending:
+            del self._pending[next(iter(self._pending))]
+            self.dropped += 1
+
+        self._pending[username] = location
+        self._ready.set()
+
+    async def next_batch(self) -> list[dict]:
+        """Waits for updates and returns all of those held, oldest first."""
+        while not self._pending:
+            self._ready.clear()
+            await self._ready.wait()
+
+        batch: list[dict] = list(self._pending.values())
+        self._pending.clear()
+        self.delivered += len(batch)
+        return batch
+
+
+class LocationHub:
+    """Fans location updates out to subscriptions."""
+
+    def __init__(
+        self,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_users: int = DEFAULT_MAX_USERS,
+    ) -> None:
+        """Creates a hub with no subscriptions.
+
+        Args:
+            max_pending (int, optional): Largest number of users held per subscription.
+            max_users (int, optional): Largest number of users whose last timestamp is kept to drop out of order updates.
+        """
+        self.max_pending: int = max_pending
+        self.max_users: int = max_users
+        self._subscriptions: set[Subscription] = set()
+        self._cells: dict[tuple[int, int], set[Subscription]] = {}
+        self._wide: set[Subscription] = set()
+        self._timestamps: OrderedDict[str, int] = OrderedDict()
+
+        self._published: int = 0
+        self._stale: int = 0
+        self._fanned_out: int = 0
+        self._delivered: int = 0
+        self._dropped: int = 0
+
+    def subscribe(self) -> Subscription:
+        """Returns a new subscription to every update."""
+        subscription: Subscription = Subscription(self.max_pending)
+        self._subscriptions.add(subscription)
+        self._wide.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Removes a subscription."""
+        if subscription in self._subscriptions:
+            self._unindex(subscription)
+            self._subscriptions.discard(subscription)
+            self._delivered += subscription.delivered
+            self._dropped += subscription.dropped
+
+    def set_viewport(
+        self,
+        subscription: Subscription,
+        viewport: tuple[float, float, float, float] | None,
+    ) -> None:
+        """Changes the viewport of a subscription.
+
+        Args:
+            subscription (Subscription): Subscription of this hub.
+            viewport (tuple, None): (south, west, north, east), or None for every update.
+        """
+        self._unindex(subscription)
+        subscription.set_viewport(viewport)
+
+        cells: list[tuple[int, int]] | None = (
+            viewport_cells(*viewport) if viewport is not None else None
+        )
+        if cells is None:
+            self._wide.add(subscription)
+        else:
+            for cell in cells:
+                self._cells.setdefault(cell, set()).add(subscription)
+
+    def _unindex(self, subscription: Subscription) -> None:
+        """Removes a subscription from the grid."""
+        self._wide.discard(subscription)
+        if subscription.viewport is None:
+            return
+        for cell in viewport_cells(*subscription.viewport) or []:
+            subscriptions: set[Subscription] = self._cells.get(cell, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._cells.pop(cell, None)
+
+    def publish(self, location: dict) -> int:
+        """Offers an update to every subscription whose viewport contains it.
+
+        Updates older than the last one published for the same user are
+        ignored, as long as that user is among the max_users most recently
+        updated.
+
+        Args:
+            location (dict): Location with username, latitude, longitude and timestamp.
+        Returns:
+            Number of subscriptions the update was offered to.
+        """
+        username: str = location["username"]
+        if self._timestamps.get(username, float("-inf")) > location["timestamp"]:
+            self._stale += 1
+            return 0
+        self._timestamps[username] = location["timestamp"]
+        self._timestamps.move_to_end(username)
+        if len(self._timestamps) > self.max_users:
+            self._timestamps.popitem(last=False)
+        self._published += 1
+
+        nearby: set[Subscription] = self._cells.get(
+            cell_of(location["latitude"], location["longitude"]), set()
+        )
+        offered: int = 0
+        for subscription in (*nearby, *self._wide):
+            if subscription.wants(location):
+                subscription.offer(location)
+                offered += 1
+        self._fanned_out += offered
+        return offered
+
+    def stats(self) -> dict:
+        """Returns the number of subscriptions and the update counters."""
+        return {
+            "subscriptions": len(self._subscriptions),
+            "users": len(self._timestamps),
+            "published": self._published,
+            "stale": self._stale,
+            "fanned_out": self._fanned_out,
+            "delivered": self._delivered
+            + sum(subscription.delivered for subscription in self._subscriptions),
+            "dropped": self._dropped
+            + sum(subscription.dropped for subscription in self._subscriptions),
+            "pending": sum(len(subscription) for subscription in self._subscriptions),
+        }
+
+
+def cell_of(latitude: float, longitude: float) -> tuple[int, int]:
+    """Returns the grid cell of a point."""
+    return math.floor(latitude / CELL_SIZE), math.floor(longitude / CELL_SIZE)
+
+
+def viewport_cells(
+    south: float, west: float, north: float, east: float
+) -> list[tuple[int, int]] | None:
+    """Returns the grid cells a viewport covers, None if there are more than MAX_CELLS."""
+    rows: range = range(
+        math.floor(south / CELL_SIZE), math.floor(north / CELL_SIZE) + 1
+    )
+    spans: list[tuple[float, float]] = (
+        [(west, 180.0), (-180.0, east)] if west > east else [(west, east)]
+    )
+    columns: list[int] = [
+        column
+        for start, end in spans
+        for column in range(
+            math.floor(start / CELL_SIZE), math.floor(end / CELL_SIZE) + 1
+        )
+    ]
+    if len(rows) * len(columns) > MAX_CELLS:
+        return None
+    return [(row, column) for row in rows for column in columns]
@@ -31,6 +31,7 @@ class User(BaseModel):
     email: str = Field(description="The email of a user.")
     password: str = Field(description="The password of a user.")
 
+
 class Location(BaseModel):
     """
     Provides JSON-schema for a "location" object / entry.
@@ -43,10 +44,27 @@ class Location(BaseModel):
         description="The UNIX timestamp in milliseconds when the location was received."
     )
 
+
+class Viewport(BaseModel):
+    """
+    Provides JSON-schema for a "viewport" object, the area shown by a map.
+    """
+
+    south: float = Field(description="Latitude of the bottom edge.", ge=-90, le=90)
+    west: float = Field(description="Longitude of the left edge.", ge=-180, le=180)
+    north: float = Field(description="Latitude of the top edge.", ge=-90, le=90)
+    east: float = Field(
+        description="Longitude of the right edge, less than west to cross the antimeridian.",
+        ge=-180,
+        le=180,
+    )
+
+
 class FileBody(BaseModel):
     """
     Provides a JSON-schema for a "file" object containing base64 data of a file.
     """
-    base64_content:str = Field(description="The base64 data of the file.")
-    file_type:str = Field(description="The file type of the file.")
-    file_name:str = Field(description="The name of the file.")
\ No newline at end of file
+
+    base64_content: str = Field(description="The base64 data of the file.")
+    file_type: str = Field(description="The file type of the file.")
+    file_name: str = Field(description="The name of the file.")
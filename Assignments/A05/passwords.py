@@ -0,0 +1,247 @@
+"""Provides salted, memory-hard password hashing.
+
+Passwords are hashed with scrypt and a random salt, and stored as
+scrypt$n$r$p$salt$hash so each record carries the parameters it was made
+with. Records from before scrypt are unsalted SHA-256 hex digests; they
+still verify, and are reported as needing a rehash so they are upgraded on
+the user's next login, as are records made with older parameters.
+
+Provides the class PasswordHasher, which runs hashing in its own bounded
+thread pool. hashlib.scrypt releases the GIL, so hashes run in parallel
+without blocking the event loop or the default executor, and once
+max_queue hashes are waiting new ones are refused with HasherBusy instead
+of queueing, so a burst of logins can't slow down the rest of the API.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import scrypt, sha256
+import asyncio
+import base64
+import hmac
+import os
+import re
+
+SCHEME: str = "scrypt"
+# Cost parameters, 2**14 x 8 takes 16 MiB and tens of milliseconds per hash
+DEFAULT_N: int = 2**14
+DEFAULT_R: int = 8
+DEFAULT_P: int = 1
+SALT_BYTES: int = 16
+HASH_BYTES: int = 32
+DEFAULT_WORKERS: int = 2
+DEFAULT_MAX_QUEUE: int = 32
+LEGACY_PATTERN: re.Pattern = re.compile(r"^[0-9a-f]{64}$")
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are waiting to run."""
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """Returns the scrypt hash of a password."""
+    return scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        # scrypt needs 128 * n * r * p bytes, leave room for the rest
+        maxmem=256 * n * r * p,
+        dklen=HASH_BYTES,
+    )
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def hash_password(
+    password: str, n: int = DEFAULT_N, r: int = DEFAULT_R, p: int = DEFAULT_P
+) -> str:
+    """Hashes a password with a new random salt.
+
+    Args:
+        password (str): The password.
+        n (int, optional): CPU and memory cost, a power of 2.
+        r (int, optional): Block size.
+        p (int, optional): Parallelization.
+    Returns:
+        The record to store, with the parameters and salt.
+    """
+    salt: bytes = os.urandom(SALT_BYTES)
+    hashed: bytes = _scrypt(password, salt, n, r, p)
+    return f"{SCHEME}${n}${r}${p}${_encode(salt)}${_encode(hashed)}"
+
+
+def is_legacy(stored: str) -> bool:
+    """Returns whether a record is an unsalted SHA-256 digest."""
+    return bool(LEGACY_PATTERN.match(stored))
+
+
+def verify_password(
+    password: str,
+    stored: str,
+    n: int = DEFAULT_N,
+    r: int = DEFAULT_R,
+    p: int = DEFAULT_P,
+) -> tuple[bool, bool]:
+    """Checks a password against a stored record.
+
+    Args:
+        password (str): The password to check.
+        stored (str): The stored record, scrypt or legacy SHA-256.
+        n (int, optional): Current cost, records made with another one need a rehash.
+        r (int, optional): Current block size.
+        p (int, optional): Current parallelization.
+    Returns:
+        Whether the password matches, and whether the record should be
+        replaced by a hash with the current parameters.
+    """
+    if not stored:
+        return False, False
+    if is_legacy(stored):
+        digest: str = sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+
+    try:
+        scheme, *parameters, salt, hashed = stored.split("$")
+        if scheme != SCHEME:
+            return False, False
+        stored_n, stored_r, stored_p = (int(value) for value in parameters)
+        expected: bytes = _decode(hashed)
+        candidate: bytes = _scrypt(
+            password, _decode(salt), stored_n, stored_r, stored_p
+        )
+    except ValueError:
+        # Malformed record, nothing can match it
+        return False, False
+
+    matches: bool = hmac.compare_digest(candidate, expected)
+    return matches, (stored_n, stored_r, stored_p) != (n, r, p)
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords in a bounded thread pool."""
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        n: int = DEFAULT_N,
+        r: int = DEFAULT_R,
+        p: int = DEFAULT_P,
+    ) -> None:
+        """Creates the thread pool.
+
+        Args:
+            workers (int, optional): Number of hashes run at the same time.
+            max_queue (int, optional): Largest number of hashes waiting for a worker.
+            n (int, optional): scrypt CPU and memory cost for new hashes, a power of 2.
+            r (int, optional): scrypt block size for new hashes.
+            p (int, optional): scrypt parallelization for new hashes.
+        """
+        self.workers: int = workers
+        self.max_queue: int = max_queue
+        self.n: int = n
+        self.r: int = r
+        self.p: int = p
+
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hasher"
+        )
+        self._in_flight: int = 0
+
+        self._hashes: int = 0
+        self._verifications: int = 0
+        self._rehashes: int = 0
+        self._rejected: int = 0
+
+    async def _run(self, function, *args):
+        """Runs a function in the pool, unless too many are waiting.
+
+        Raises:
+            HasherBusy: If max_queue calls are already waiting for a worker.
+        """
+        if self._in_flight >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise HasherBusy(f"{self._in_flight} password hashes are in progress")
+
+        self._in_flight += 1
+        try:
+            future: Future = self._executor.submit(function, *args)
+        except RuntimeError:
+            self._in_flight -= 1
+            raise
+        # Released when the job finishes, not when the caller stops waiting,
+        # since a cancelled request leaves its hash running in the pool
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wrap_future(future)
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Frees the slot of a finished job, from whichever thread finished it."""
+        try:
+            loop.call_soon_threadsafe(self._decrement)
+        except RuntimeError:
+            # The loop is closed, nothing counts the slots anymore
+            pass
+
+    def _decrement(self) -> None:
+        """Frees a slot, on the event loop."""
+        self._in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        """Hashes a password with the current parameters.
+
+        Raises:
+            HasherBusy: If too many hashes are waiting.
+        """
+        hashed: str = await self._run(hash_password, password, self.n, self.r, self.p)
+        self._hashes += 1
+        return hashed
+
+    async def verify(self, password: str, stored: str) -> tuple[bool, str | None]:
+        """Checks a password, rehashing the record if it is outdated.
+
+        Args:
+            password (str): The password to check.
+            stored (str): The stored record.
+        Returns:
+            Whether the password matches, and the new record to store if it
+            matches and the stored one is legacy or uses other parameters.
+        Raises:
+            HasherBusy: If too many hashes are waiting.
+        """
+        matches, rehashed = await self._run(self._verify, password, stored)
+        self._verifications += 1
+        if rehashed is not None:
+            self._rehashes += 1
+        return matches, rehashed
+
+    def _verify(self, password: str, stored: str) -> tuple[bool, str | None]:
+        """Verifies and rehashes in one pool task, so a rehash is never refused."""
+        matches, outdated = verify_password(password, stored, self.n, self.r, self.p)
+        if matches and outdated:
+            return True, hash_password(password, self.n, self.r, self.p)
+        return matches, None
+
+    def stats(self) -> dict:
+        """Returns the pool settings and the hashing counters."""
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "parameters": {"n": self.n, "r": self.r, "p": self.p},
+            "hashes": self._hashes,
+            "verifications": self._verifications,
+            "rehashes": self._rehashes,
+            "rejected": self._rejected,
+        }
+
+    def close(self) -> None:
+        """Stops the thread pool, waiting for the running hashes."""
+        self._executor.shutdown(cancel_futures=True)
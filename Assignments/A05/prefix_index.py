@@ -0,0 +1,126 @@
+"""Provides an in-memory prefix index for autocomplete.
+
+Provides the class PrefixIndex, which answers prefix lookups over item names
+and tags from sorted arrays with bisect, without touching the database.
+"""
+
+from bisect import bisect_left, insort
+import re
+
+WORD_PATTERN: re.Pattern = re.compile(r"[^\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Normalizes text for case-insensitive prefix matching."""
+    return " ".join(WORD_PATTERN.findall(text.casefold()))
+
+
+class PrefixIndex:
+    """Prefix index over item names and tags.
+
+    Keeps two sorted arrays of (key, id) pairs: one for whole names, and one
+    for the words of each name and its tags. Suggestions come from whole names
+    first, then from the other terms.
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty index."""
+        self._names: list[tuple[str, str]] = []
+        self._terms: list[tuple[str, str]] = []
+        self._items: dict[str, tuple[str, str, list[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def build(self, items: list[dict]) -> None:
+        """Replaces the contents of the index.
+
+        Args:
+            items (list[dict]): Items with _id, name and tags.
+        """
+        self._names = []
+        self._terms = []
+        self._items = {}
+
+        for item in items:
+            id, name_key, terms = self._store(item)
+            self._names.append((name_key, id))
+            self._terms.extend((term, id) for term in terms)
+
+        self._names.sort()
+        self._terms.sort()
+
+    def add(self, item: dict) -> None:
+        """Adds an item, or replaces it if already indexed.
+
+        Args:
+            item (dict): Item with _id, name and tags.
+        """
+        self.remove(str(item["_id"]))
+
+        id, name_key, terms = self._store(item)
+        insort(self._names, (name_key, id))
+        for term in terms:
+            insort(self._terms, (term, id))
+
+    def remove(self, id: str) -> None:
+        """Removes an item, if indexed.
+
+        Args:
+            id (str): ID of the item.
+        """
+        entry: tuple[str, str, list[str]] | None = self._items.pop(id, None)
+        if entry is None:
+            return
+
+        _, name_key, terms = entry
+        self._discard(self._names, (name_key, id))
+        for term in terms:
+            self._discard(self._terms, (term, id))
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        """Returns items whose name or tags start with a prefix.
+
+        Args:
+            prefix (str): Text typed so far.
+            limit (int, optional): Maximum number of suggestions.
+        Returns:
+            List of dicts with the _id and name of each match.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        found: dict[str, dict] = {}
+        for keys in (self._names, self._terms):
+            i: int = bisect_left(keys, (prefix,))
+            while i < len(keys) and len(found) < limit:
+                key, id = keys[i]
+                if not key.startswith(prefix):
+                    break
+                if id not in found:
+                    found[id] = {"_id": id, "name": self._items[id][0]}
+                i += 1
+
+        return list(found.values())
+
+    def _store(self, item: dict) -> tuple[str, str, list[str]]:
+        """Records an item and returns its id, name key and other terms."""
+        id: str = str(item["_id"])
+        name: str = item.get("name") or ""
+        name_key: str = normalize(name)
+
+        terms: set[str] = set(name_key.split()[1:])
+        for tag in item.get("tags") or []:
+            terms.add(normalize(tag))
+        terms.discard("")
+
+        self._items[id] = (name, name_key, sorted(terms))
+        return id, name_key, self._items[id][2]
+
+    @staticmethod
+    def _discard(keys: list[tuple[str, str]], key: tuple[str, str]) -> None:
+        """Removes a key from a sorted array."""
+        i: int = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
@@ -0,0 +1,260 @@
+"""Provides a cache for query results.
+
+Provides the class ResultCache, which caches the results of reads under a
+key built from the normalized query, and invalidates them by scope, such as
+a collection or one category of items. Results are kept in an in-process
+LRU with a TTL by default, or in a Redis-compatible server when one is
+configured, so every API worker shares them.
+
+Invalidation bumps a version counter per scope instead of deleting keys:
+the versions of a read's scopes are part of its key, so stale entries are
+simply never looked up again and age out through the TTL and LRU.
+"""
+
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Awaitable, Callable
+from bson import json_util
+import time
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+DEFAULT_TTL: float = 30.0
+DEFAULT_MAX_ENTRIES: int = 1024
+KEY_PREFIX: str = "result-cache:"
+
+
+class MemoryBackend:
+    """In-process LRU with a TTL.
+
+    Values are stored as is, so callers must not mutate what they get back.
+    Only shared by the tasks of one process.
+
+    Versions come from one clock. When far more scopes have a version than
+    the entries depend on, the versions of the others are dropped, and
+    those scopes read the clock as it was then, so no key built before can
+    be looked up again.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Creates an empty backend.
+
+        Args:
+            max_entries (int, optional): Largest number of results kept.
+        """
+        self.max_entries: int = max_entries
+        self._entries: OrderedDict[str, tuple[float, Any, list[str]]] = OrderedDict()
+        # Number of entries that depend on each scope
+        self._references: dict[str, int] = {}
+        self._versions: dict[str, int] = {}
+        self._clock: int = 0
+        self._floor: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Any | None:
+        entry: tuple[float, Any, list[str]] | None = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, value, _ = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float, scopes: list[str]) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value, scopes)
+        for scope in scopes:
+            self._references[scope] = self._references.get(scope, 0) + 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    async def versions(self, scopes: list[str]) -> list[int]:
+        return [self._versions.get(scope, self._floor) for scope in scopes]
+
+    async def bump(self, scopes: list[str]) -> None:
+        for scope in scopes:
+            self._clock += 1
+            self._versions[scope] = self._clock
+        if len(self._versions) > len(self._references) + self.max_entries:
+            self._prune()
+
+    async def close(self) -> None:
+        self._entries.clear()
+        self._references.clear()
+
+    def _remove(self, key: str) -> None:
+        """Removes an entry, and its references to its scopes."""
+        _, _, scopes = self._entries.pop(key)
+        for scope in scopes:
+            self._references[scope] -= 1
+            if not self._references[scope]:
+                del self._references[scope]
+
+    def _prune(self) -> None:
+        """Drops the versions of the scopes no entry depends on."""
+        # Scopes still read at the floor keep it, the floor is about to move
+        versions: dict[str, int] = {
+            scope: self._versions.get(scope, self._floor) for scope in self._references
+        }
+        self._versions = versions
+        self._floor = self._clock
+
+
+class RedisBackend:
+    """Backend on a Redis-compatible server, shared by every worker.
+
+    Values are stored as Extended JSON, so ObjectIds and dates survive.
+    Needs the redis package.
+    """
+
+    def __init__(self, url: str, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Connects to the server.
+
+        Args:
+            url (str): URL of the server, e.g. redis://localhost:6379/0.
+            max_entries (int, optional): Unused, the server's maxmemory policy evicts entries.
+        """
+        if redis is None:
+            raise RuntimeError("The redis package is needed for a Redis result cache")
+        self._client = redis.from_url(url)
+
+    def __len__(self) -> int:
+        return 0
+
+    async def get(self, key: str) -> Any | None:
+        value: bytes | None = await self._client.get(KEY_PREFIX + key)
+        return None if value is None else json_util.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float, scopes: list[str]) -> None:
+        await self._client.set(
+            KEY_PREFIX + key, json_util.dumps(value), px=int(ttl * 1000)
+        )
+
+    async def versions(self, scopes: list[str]) -> list[int]:
+        values: list = await self._client.mget(
+            [f"{KEY_PREFIX}version:{scope}" for scope in scopes]
+        )
+        return [int(value or 0) for value in values]
+
+    async def bump(self, scopes: list[str]) -> None:
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for scope in scopes:
+                pipeline.incr(f"{KEY_PREFIX}version:{scope}")
+            await pipeline.execute()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class ResultCache:
+    """Caches query results, with invalidation by scope.
+
+    A scope names the data a result depends on, e.g. "items" for a query
+    over every item, or "items:category:Movies" for a query pinned to one
+    category. Writes invalidate the scopes they touch.
+    """
+
+    def __init__(
+        self, backend: MemoryBackend | RedisBackend, ttl: float = DEFAULT_TTL
+    ) -> None:
+        """Creates the cache.
+
+        Args:
+            backend (MemoryBackend, RedisBackend): Where results are kept.
+            ttl (float, optional): Seconds a result is kept, bounds staleness from writes made outside the API.
+        """
+        self.backend: MemoryBackend | RedisBackend = backend
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+
+    @classmethod
+    def from_url(
+        cls,
+        url: str = None,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> "ResultCache":
+        """Creates a cache on Redis if url is given, in memory otherwise."""
+        if url:
+            return cls(RedisBackend(url), ttl)
+        return cls(MemoryBackend(max_entries), ttl)
+
+    async def key(self, scopes: list[str], query: dict) -> str:
+        """Returns the key of a read.
+
+        Args:
+            scopes (list[str]): Scopes the result depends on.
+            query (dict): Everything that determines the result, e.g. the filter, projection, sort and page.
+        Returns:
+            The key, which changes whenever one of the scopes is invalidated.
+        """
+        versions: list[int] = await self.backend.versions(scopes)
+        normalized: str = json_util.dumps(
+            {"scopes": dict(zip(scopes, versions)), "query": query}, sort_keys=True
+        )
+        return sha256(normalized.encode()).hexdigest()
+
+    async def get(self, key: str) -> Any | None:
+        """Returns a cached result, or None on a miss."""
+        value: Any | None = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, scopes: list[str]) -> None:
+        """Caches a result under the key built from its scopes."""
+        await self.backend.set(key, value, self.ttl, scopes)
+
+    async def get_or_load(
+        self, scopes: list[str], query: dict, load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Returns a cached result, loading and caching it on a miss.
+
+        Args:
+            scopes (list[str]): Scopes the result depends on.
+            query (dict): Everything that determines the result.
+            load (Callable): Coroutine function that runs the read.
+        Returns:
+            The result.
+        """
+        key: str = await self.key(scopes, query)
+        value: Any | None = await self.get(key)
+        if value is None:
+            value = await load()
+            await self.set(key, value, scopes)
+        return value
+
+    async def invalidate(self, scopes: list[str]) -> None:
+        """Invalidates every cached result that depends on one of the scopes."""
+        await self.backend.bump(scopes)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters."""
+        lookups: int = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+    async def close(self) -> None:
+        """Closes the backend."""
+        await self.backend.close()
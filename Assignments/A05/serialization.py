@@ -0,0 +1,94 @@
+"""Provides fast JSON encoding for API responses.
+
+Provides the function dumps, which encodes straight to UTF-8 bytes with
+orjson when it is installed, falling back to the json module otherwise,
+and handles BSON types such as ObjectId without a separate conversion pass.
+Provides encode_chunks for streaming list responses in large chunks, and
+the response class FastJSONResponse.
+"""
+
+from bson.objectid import ObjectId
+from bson.decimal128 import Decimal128
+from datetime import datetime
+from fastapi.responses import JSONResponse
+from typing import Any, AsyncIterator
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Size of the chunks sent while streaming, fewer sends cost less CPU
+CHUNK_SIZE: int = 64 * 1024
+
+
+def default(value: Any) -> Any:
+    """Encodes the BSON types JSON has no type for.
+
+    Only called for values the encoder can't handle itself.
+    """
+    if isinstance(value, (ObjectId, Decimal128)):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Encodes a value as JSON.
+
+    Args:
+        value (Any): Value to encode, may contain ObjectIds.
+    Returns:
+        The JSON, as UTF-8 bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=default)
+    return json.dumps(value, default=default, separators=(",", ":")).encode()
+
+
+async def encode_chunks(
+    documents: AsyncIterator[dict],
+    start: bytes = b"",
+    separator: bytes = b"",
+    terminator: bytes = b"",
+    end: bytes = b"",
+    chunk_size: int = CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    """Encodes documents as they arrive, in chunks of about chunk_size bytes.
+
+    Args:
+        documents (AsyncIterator[dict]): Documents to encode.
+        start (bytes, optional): Written before the first document.
+        separator (bytes, optional): Written between documents.
+        terminator (bytes, optional): Written after each document.
+        end (bytes, optional): Written after the last document.
+        chunk_size (int, optional): Size a chunk is sent at.
+    Yields:
+        Chunks of the encoded response.
+    """
+    buffer: bytearray = bytearray(start)
+    first: bool = True
+
+    async for doc in documents:
+        if not first:
+            buffer += separator
+        first = False
+        buffer += dumps(doc)
+        buffer += terminator
+
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+
+    buffer += end
+    if buffer:
+        yield bytes(buffer)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with dumps."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
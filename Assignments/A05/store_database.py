@@ -1,7 +1,8 @@
 """Provides easy-to-use class for database operations.
 
 Provides the class StoreDatabase to make it easier to perform database
-operations on the online store database.
+operations on the online store database, and the class StoreCollection for
+operations on one of its collections.
 """
 
 from pymongo import MongoClient, ASCENDING, DESCENDING
@@ -16,142 +17,261 @@ from pymongo.results import (
     UpdateResult,
     BulkWriteResult,
 )
-from pymongo.errors import PyMongoError, ConnectionFailure, InvalidOperation
+from pymongo.errors import (
+    PyMongoError,
+    ConnectionFailure,
+    InvalidOperation,
+    OperationFailure,
+)
 from rich import print
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 from bson.son import SON
+from bson import json_util
 from enum import Enum, StrEnum
+from typing import Iterator
+import json
+import os
 
+DEFAULT_BATCH_SIZE: int = 100
 
-class StoreDatabase:
-    """Performs operations on database.
+# Declarative spec of every index, applied by the loader and the API
+INDEXES_CONFIG: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "collection_indexes.json"
+)
 
-    Performs operations on MongoDB database.
+
+def load_index_specs(path: str = INDEXES_CONFIG) -> dict[str, list[dict]]:
+    """Reads the index spec of each collection.
+
+    Args:
+        path (str, optional): Path of the JSON spec.
+    Returns:
+        Dict of collection name to a list of create_index keyword arguments.
     """
+    with open(path, "r") as file:
+        specs: dict[str, list[dict]] = json.load(file)
 
-    class Categories(StrEnum):
-        """Enums for representing categories.
+    for indexes in specs.values():
+        for index in indexes:
+            index["keys"] = [tuple(key) for key in index["keys"]]
+    return specs
 
-        Represents categories.
-        """
 
-        Electronics: str = "Electronics"
-        ClothingNAccessories = "Clothing & Accessories"
-        HomeNKitchen = "Home & Kitchen"
-        BooksNAudible = "Books & Audible"
-        HealthNPersonalCare = "Health & Personal Care"
-        ToysNGames = "Toys & Games"
-        SportsNOutDoors = "Sports & Outdoors"
-        Automotive = "Automotive"
-        ToolsNHomeImprovement = "Tools & Home Improvement"
-        GroceryNGourmetFood = "Grocery & Gourmet Food"
-        PetSupplies = "Pet Supplies"
-        OfficeProducts = "Office Products"
-        Baby = "Baby"
-        MusicalInstruments = "Musical Instruments"
-        IndustrialNScientific = "Industrial & Scientific"
-        MoviesNTV = "Movies & TV"
-        PatioNLawnNGarden = "Patio, Lawn & Garden"
-        ArtsNCraftsNSewing = "Arts, Crafts & Sewing"
-        Miscellaneous = "Miscellaneous"
+def convert_object_ids(document: dict) -> dict:
+    """Converts top-level ObjectIds in a document to str.
 
-    class Collections(StrEnum):
-        """Enums for representing collections.
+    Args:
+        document (dict): Document returned by the database.
+    Returns:
+        The same document, with ObjectId values replaced by their str form.
+    """
+    for key, value in document.items():
+        if isinstance(value, ObjectId):
+            document[key] = str(value)
+    return document
 
-        Represents the types of collections in the database.
-        """
 
-        ItemsCollection: str = "items"
-        UsersCollection: str = "users"
-        LocationsCollection: str = "locations"
+def plain_raw_result(raw_result: dict) -> dict:
+    """Converts a write's raw server result to JSON types.
 
-    def __init__(
-        self,
-        username: str = None,
-        password: str = None,
-        host: str = "localhost",
-        port: int = 27017,
-        database: str = None,
-        collection: str = None,
-    ) -> None:
-        """ "Connects to the database.
-        Establishes a connection to the database.
-        """
-        self.host: str = host
-        self.port: int = port
-        self.database: Database = None
-        self.collection: Collection = None
-        self.client: MongoClient = None
-        connection_url: str = None
+    Upserted ids become str like other ids, and any other BSON values, such
+    as the opTime of a replica set, become relaxed Extended JSON.
 
-        if username is None or password is None:
-            connection_url: str = f"mongodb://{self.host}:{self.port}/"
-        else:
-            # Need to check that a db name was passed in
-            # Create the connection URL
-            connection_url: str = (
-                f"mongodb://{username}:{password}@{self.host}:{self.port}/{self.database}?authSource=admin"
-            )
-        try:
-            self.client = MongoClient(connection_url)
-            # The ismaster command is cheap and does not require auth.
-            self.client["admin"].command("ismaster")
-        except ConnectionFailure as e:
-            print(f"Error: {e}")
+    Args:
+        raw_result (dict): raw_result of a pymongo write result.
+    Returns:
+        A copy of the result that FastAPI can encode.
+    """
+    return json.loads(
+        json_util.dumps(
+            convert_object_ids(dict(raw_result)),
+            json_options=json_util.RELAXED_JSON_OPTIONS,
+        )
+    )
 
-        # if a db is specified then make connection
-        if database is not None:
-            self.set_database(database)
 
-            # if db is specified then check for collection as well
-            if collection is not None:
-                self.set_collection(collection)
+def keyset_filter(filter: dict, sort: list[tuple], after: list | None) -> dict:
+    """Restricts a filter to the documents that sort after a key.
 
-    def set_database(self, database: str) -> None:
-        """Sets the current database."""
-        self.database = self.client[database]
+    Used for keyset pagination: the key is the values of the sort fields in
+    the last document of the previous page, so each page is found through
+    the index no matter how deep it is.
 
-    def create_collection(self, collection: str | Collections, validator: dict = None):
-        """Creates a new collection.
+    Args:
+        filter (dict): Filter for the query.
+        sort (list[tuple]): Fields and directions the query is sorted by. Together they must be unique, e.g. end with _id.
+        after (list | None): Values of the sort fields to continue after, None for the first page.
+    Returns:
+        The filter for the next page.
+    """
+    if after is None:
+        return filter
 
-        Creates a new collection
+    clauses: list[dict] = []
+    for i, (field, direction) in enumerate(sort):
+        clause: dict = {
+            previous: value for (previous, _), value in zip(sort[:i], after[:i])
+        }
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": after[i]}
+        clauses.append(clause)
 
-        Args:
-            collection (str, StoreDatabase.Collections): Name of the collection.
-            validator (dict, optional): Validator for jsonSchema of the documents in the collection.
-        """
-        self.database.create_collection(str(collection), validator=validator)
+    keyset: dict = {"$or": clauses} if len(clauses) > 1 else clauses[0]
+    return {"$and": [filter, keyset]} if filter else keyset
 
-    def set_collection(self, collection: str | Collections):
-        """Sets the collection.
 
-        Sets the collection.
+def keyset_after(document: dict, sort: list[tuple]) -> list:
+    """Returns the values of the sort fields in a document.
+
+    Args:
+        document (dict): Last document of a page.
+        sort (list[tuple]): Fields and directions the query is sorted by.
+    Returns:
+        The key to pass to keyset_filter for the next page.
+    """
+    after: list = []
+    for field, _ in sort:
+        value = document[field]
+        # Undo convert_object_ids so the key compares like the stored value
+        if field == "_id" and isinstance(value, str) and ObjectId.is_valid(value):
+            value = ObjectId(value)
+        after.append(value)
+    return after
+
+
+def keyset_projection(projection: dict, sort: list[tuple]) -> dict:
+    """Makes sure a projection returns the sort fields."""
+    inclusion: bool = any(
+        value in (1, True)
+        for field, value in projection.items()
+        if field != "_id" and not isinstance(value, dict)
+    )
+    if not inclusion:
+        # Exclusion projection, only drop exclusions of the sort fields
+        return {
+            field: value
+            for field, value in projection.items()
+            if field not in dict(sort)
+        }
+    return {**projection, **{field: 1 for field, _ in sort}}
+
+
+def keyset_hidden(projection: dict, sort: list[tuple]) -> list[str]:
+    """Returns the sort fields keyset_projection adds that the projection leaves out."""
+    inclusion: bool = any(
+        value in (1, True)
+        for field, value in projection.items()
+        if field != "_id" and not isinstance(value, dict)
+    )
+    hidden: list[str] = []
+    for field, _ in sort:
+        if field == "_id" or not inclusion:
+            if projection.get(field, 1) in (0, False):
+                hidden.append(field)
+        elif field not in projection:
+            hidden.append(field)
+    return hidden
+
+
+class StoreCollection:
+    """Performs operations on a collection.
+
+    Handle for one collection of the database. Handles hold no mutable state,
+    so one handle can be shared by every thread.
+    """
+
+    __slots__ = ("_collection",)
+
+    def __init__(self, collection: Collection) -> None:
+        """Wraps a collection.
 
         Args:
-            collection (str, StoreDatabase.Collections): Name of collection.
+            collection (Collection): The pymongo collection to operate on.
         """
-        self.collection = self.database[str(collection)]
+        object.__setattr__(self, "_collection", collection)
 
-    def drop_collection(self, collection: str | Collections):
-        """Drops a collection.
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
-        Drops a collection from the database.
+    @property
+    def name(self) -> str:
+        """Name of the collection."""
+        return self._collection.name
+
+    @property
+    def collection(self) -> Collection:
+        """The underlying pymongo collection."""
+        return self._collection
+
+    def create_index(self, keys: list[tuple] | dict, **kwargs) -> str:
+        """Creates an index.
+
+        Creates an index on the collection, does nothing if it already exists.
 
         Args:
-            collection (str, StoreDatabase.Collections): Name of the collection.
+            keys (list[tuple], dict): Fields of the index and their direction or type.
+            **kwargs: Index options, such as unique, name or weights.
+        Returns:
+            Name of the index.
         """
-        self.database.drop_collection(str(collection))
+        return self._collection.create_index(keys, **kwargs)
 
-    def drop_database(self, database: str):
-        """Drops a database.
+    def ensure_indexes(self, indexes: list[dict]) -> list[str]:
+        """Creates the indexes of a spec that are missing.
 
-        Drops the specified database.
+        Safe to run on every startup: indexes that already exist under the
+        same name are left alone, and a conflicting index is reported rather
+        than replaced.
 
         Args:
-            datbase (str): Name of the database.
+            indexes (list[dict]): create_index keyword arguments, each with a name.
+        Returns:
+            Names of the indexes that were created.
         """
-        self.client.drop_database(database)
+        existing: dict = self._collection.index_information()
+        created: list[str] = []
+
+        for index in indexes:
+            if index["name"] in existing:
+                continue
+            try:
+                created.append(self._collection.create_index(**index))
+            except OperationFailure as e:
+                print(
+                    f"[red]Could not create index {index['name']} on {self.name}: {e}"
+                )
+
+        return created
+
+    def explain(
+        self,
+        filter: dict = {},
+        projection: dict = {},
+        sort: list[tuple] = [("_id", 1)],
+        limit: int = 0,
+    ) -> dict:
+        """Explains how the server runs a find.
+
+        Args:
+            filter (dict, optional): Filter for the query.
+            projection (dict, optional): Project for the results.
+            sort (list[tuple], optional): Criteria for sorting documents.
+            limit (int, optional): Number of documents to return.
+        Returns:
+            The explain output, with execution stats.
+        """
+        find: SON = SON(
+            [
+                ("find", self.name),
+                ("filter", filter),
+                ("projection", projection),
+                ("sort", SON(sort)),
+                ("limit", limit),
+            ]
+        )
+        return self._collection.database.command(
+            "explain", find, verbosity="executionStats"
+        )
 
     def distinct(self, key: str, filter: dict = {}) -> list[str]:
         """Returns distinct values in a collection.
@@ -164,7 +284,7 @@ class StoreDatabase:
         Returns:
             A list of distinct values for a given key.
         """
-        distinct_vals: list[str] = self.collection.distinct(key, filter)
+        distinct_vals: list[str] = self._collection.distinct(key, filter)
 
         return distinct_vals
 
@@ -180,12 +300,10 @@ class StoreDatabase:
             A dict for the matching document.
         """
         result: dict = None
-        result = self.collection.find_one(filter, projection)
+        result = self._collection.find_one(filter, projection)
 
         if result:
-            for key, value in result.items():
-                if isinstance(value, ObjectId):
-                    result.update({key: str(value)})
+            result = convert_object_ids(result)
         return result
 
     def find(
@@ -209,22 +327,88 @@ class StoreDatabase:
         Returns:
             List of matching documents.
         """
+        return list(self.find_iter(filter, projection, skip, limit, sort))
+
+    def find_iter(
+        self,
+        filter: dict = {},
+        projection: dict = {},
+        skip: int = 0,
+        limit: int = 0,
+        sort: list[tuple] = [("_id", 1)],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> Iterator[dict]:
+        """Yields matching documents.
+
+        Streams documents from the collection batch by batch instead of
+        loading every match into memory at once.
 
+        Args:
+            filter (dict, optional): Filter for the query.
+            projection (dict, optional): Project for the results.
+            skip (int, optional): Number of documents to skip.
+            limit (int, optional): Number of documents to return. Limit of 0 returns all matches.
+            sort (list[tuple], optional): Criteria for sorting documents.
+            batch_size (int, optional): Number of documents fetched per round trip.
+        Yields:
+            Matching documents, with ObjectIds converted to str.
+        """
         results: Cursor = (
-            self.collection.find(filter, projection).sort(sort).skip(skip).limit(limit)
+            self._collection.find(filter, projection)
+            .sort(sort)
+            .skip(skip)
+            .limit(limit)
+            .batch_size(batch_size)
         )
 
-        result_list: list[dict] = []
-        for doc in results:
-            fdoc: dict = dict(doc)
-            for key, value in fdoc.items():
-                if isinstance(value, ObjectId):
-                    fdoc.update({key: str(value)})
-            result_list.append(fdoc)
-        return result_list
+        with results:
+            for doc in results:
+                yield convert_object_ids(doc)
+
+    def find_page(
+        self,
+        filter: dict = {},
+        projection: dict = {},
+        sort: list[tuple] = [("_id", 1)],
+        page_size: int = DEFAULT_BATCH_SIZE,
+        after: list = None,
+    ) -> tuple[list[dict], list | None]:
+        """Returns one page of matching documents, using keyset pagination.
+
+        Unlike skip, the cost of a page does not grow with its depth, and
+        documents inserted mid-scroll do not shift later pages.
+
+        Args:
+            filter (dict, optional): Filter for the query.
+            projection (dict, optional): Project for the results.
+            sort (list[tuple], optional): Criteria for sorting documents. Together the fields must be unique.
+            page_size (int, optional): Number of documents per page.
+            after (list, optional): Key returned with the previous page, None for the first page.
+        Returns:
+            The page, and the key of the next page, or None if this is the last page.
+        """
+        documents: list[dict] = list(
+            self.find_iter(
+                keyset_filter(filter, sort, after),
+                keyset_projection(projection, sort),
+                limit=page_size + 1,
+                sort=sort,
+                batch_size=page_size + 1,
+            )
+        )
+
+        next_after: list | None = None
+        if len(documents) > page_size:
+            documents.pop()
+            next_after = keyset_after(documents[-1], sort)
+
+        for field in keyset_hidden(projection, sort):
+            for doc in documents:
+                doc.pop(field, None)
+        return documents, next_after
 
     def aggregate(self, pipeline: list[dict]) -> list[dict]:
-        """Perform an aggregation on the currently set collection.
+        """Perform an aggregation on the collection.
 
         Args:
             pipeline (list[dict]): The pipeline for the aggregation query.
@@ -232,16 +416,27 @@ class StoreDatabase:
         Returns:
             list[dict]: A list of dictionaries resulting from the aggregation.
         """
-        results: CommandCursor = self.collection.aggregate(pipeline)
+        return list(self.aggregate_iter(pipeline))
 
-        result_list: list[dict] = []
-        for doc in results:
-            fdoc: dict = dict(doc)
-            for key, value in fdoc.items():
-                if isinstance(value, ObjectId):
-                    fdoc.update({key: str(value)})
-            result_list.append(fdoc)
-        return result_list
+    def aggregate_iter(
+        self, pipeline: list[dict], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> Iterator[dict]:
+        """Perform an aggregation on the collection, streaming the results.
+
+        Args:
+            pipeline (list[dict]): The pipeline for the aggregation query.
+            batch_size (int, optional): Number of documents fetched per round trip.
+
+        Yields:
+            dict: Documents resulting from the aggregation, with ObjectIds converted to str.
+        """
+        results: CommandCursor = self._collection.aggregate(
+            pipeline, batchSize=batch_size
+        )
+
+        with results:
+            for doc in results:
+                yield convert_object_ids(doc)
 
     def insert_one(self, document: dict) -> dict:
         """Inserts a document.
@@ -253,7 +448,7 @@ class StoreDatabase:
         Returns:
             Dict describing the result of the operation.
         """
-        result: InsertOneResult = self.collection.insert_one(document)
+        result: InsertOneResult = self._collection.insert_one(document)
         return {
             "acknowledged": result.acknowledged,
             "inserted_id": str(result.inserted_id),
@@ -269,7 +464,7 @@ class StoreDatabase:
         Returns:
             Dict describing the result of the operation.
         """
-        result: InsertManyResult = self.collection.insert_many(
+        result: InsertManyResult = self._collection.insert_many(
             documents=documents, ordered=False
         )
         return {
@@ -277,6 +472,28 @@ class StoreDatabase:
             "inserted_ids": [str(objId) for objId in result.inserted_ids],
         }
 
+    def bulk_write(self, requests: list, ordered: bool = False) -> dict:
+        """Performs multiple write operations.
+
+        Sends a batch of write operations (InsertOne, UpdateOne, ReplaceOne,
+        DeleteOne, etc.) to the server in as few round trips as possible.
+
+        Args:
+            requests (list): The write operations to perform.
+            ordered (bool, optional): If False, operations may run in any order and one failure does not stop the rest.
+        Returns:
+            Dict describing the result of the operation.
+        """
+        result: BulkWriteResult = self._collection.bulk_write(requests, ordered=ordered)
+        return {
+            "acknowledged": result.acknowledged,
+            "inserted_count": result.inserted_count,
+            "matched_count": result.matched_count,
+            "modified_count": result.modified_count,
+            "upserted_count": result.upserted_count,
+            "deleted_count": result.deleted_count,
+        }
+
     def update_one(self, filter: dict, update: dict, upsert: bool = False) -> dict:
         """Updates one matching documents.
 
@@ -290,32 +507,37 @@ class StoreDatabase:
             Dict describing the result of the operation.
         """
         # Perform the update
-        result: UpdateResult = self.collection.update_one(
+        result: UpdateResult = self._collection.update_one(
             filter,  # Query to match the document
             update,  # Update operation
+            upsert=upsert,
         )
 
         return {
             "acknowledged": result.acknowledged,
             "matched_count": result.matched_count,
             "modified_count": result.modified_count,
-            "raw_result": result.raw_result,
-            "upserted_id": str(result.upserted_id),
+            "raw_result": plain_raw_result(result.raw_result),
+            "upserted_id": (
+                str(result.upserted_id) if result.upserted_id is not None else None
+            ),
         }
 
-    def update_many(self, filter: dict, update: dict, upsert: bool = False) -> dict:
+    def update_many(
+        self, filter: dict, update: dict | list[dict], upsert: bool = False
+    ) -> dict:
         """Updates all matching documents.
 
         Updates all matching document based of filter and update dict.
 
         Args:
             filter (dict): Filter for the query.
-            update (dict): New values for the document.
+            update (dict | list[dict]): New values for the document, or an update pipeline.
             upsert (bool, optional): If True, inserts new document, if not existing. Default is False.
         Returns:
             Dict describing the result of the operation.
         """
-        result: UpdateResult = self.collection.update_many(
+        result: UpdateResult = self._collection.update_many(
             filter,
             update,
             upsert,
@@ -325,8 +547,10 @@ class StoreDatabase:
             "acknowledged": result.acknowledged,
             "matched_count": result.matched_count,
             "modified_count": result.modified_count,
-            "raw_result": result.raw_result,
-            "upserted_id": str(result.upserted_id),
+            "raw_result": plain_raw_result(result.raw_result),
+            "upserted_id": (
+                str(result.upserted_id) if result.upserted_id is not None else None
+            ),
         }
 
     def delete_one(self, filter: dict) -> dict:
@@ -339,11 +563,11 @@ class StoreDatabase:
         Returns:
             Dict describing the result of the operation.
         """
-        result: DeleteResult = self.collection.delete_one(filter)
+        result: DeleteResult = self._collection.delete_one(filter)
         return {
             "acknowledged": result.acknowledged,
             "deleted_count": result.deleted_count,
-            "raw_result": result.raw_result,
+            "raw_result": plain_raw_result(result.raw_result),
         }
 
     def delete_many(self, filter: dict) -> dict:
@@ -356,13 +580,174 @@ class StoreDatabase:
         Returns:
             Dict describing the result of the operation.
         """
-        result: DeleteResult = self.collection.delete_many(filter)
+        result: DeleteResult = self._collection.delete_many(filter)
         return {
             "acknowledged": result.acknowledged,
             "deleted_count": result.deleted_count,
-            "raw_result": result.raw_result,
+            "raw_result": plain_raw_result(result.raw_result),
         }
 
+
+class StoreDatabase:
+    """Performs operations on database.
+
+    Performs operations on MongoDB database.
+    """
+
+    class Categories(StrEnum):
+        """Enums for representing categories.
+
+        Represents categories.
+        """
+
+        Electronics: str = "Electronics"
+        ClothingNAccessories = "Clothing & Accessories"
+        HomeNKitchen = "Home & Kitchen"
+        BooksNAudible = "Books & Audible"
+        HealthNPersonalCare = "Health & Personal Care"
+        ToysNGames = "Toys & Games"
+        SportsNOutDoors = "Sports & Outdoors"
+        Automotive = "Automotive"
+        ToolsNHomeImprovement = "Tools & Home Improvement"
+        GroceryNGourmetFood = "Grocery & Gourmet Food"
+        PetSupplies = "Pet Supplies"
+        OfficeProducts = "Office Products"
+        Baby = "Baby"
+        MusicalInstruments = "Musical Instruments"
+        IndustrialNScientific = "Industrial & Scientific"
+        MoviesNTV = "Movies & TV"
+        PatioNLawnNGarden = "Patio, Lawn & Garden"
+        ArtsNCraftsNSewing = "Arts, Crafts & Sewing"
+        Miscellaneous = "Miscellaneous"
+
+    class Collections(StrEnum):
+        """Enums for representing collections.
+
+        Represents the types of collections in the database.
+        """
+
+        ItemsCollection: str = "items"
+        UsersCollection: str = "users"
+        LocationsCollection: str = "locations"
+        UserDataCollection: str = "user_data"
+
+    def __init__(
+        self,
+        username: str = None,
+        password: str = None,
+        host: str = "localhost",
+        port: int = 27017,
+        database: str = None,
+    ) -> None:
+        """ "Connects to the database.
+        Establishes a connection to the database.
+        """
+        self.host: str = host
+        self.port: int = port
+        self.database: Database = None
+        self.client: MongoClient = None
+        self._collections: dict[str, StoreCollection] = {}
+        connection_url: str = None
+
+        if username is None or password is None:
+            connection_url: str = f"mongodb://{self.host}:{self.port}/"
+        else:
+            # Need to check that a db name was passed in
+            # Create the connection URL
+            connection_url: str = (
+                f"mongodb://{username}:{password}@{self.host}:{self.port}/{self.database}?authSource=admin"
+            )
+        try:
+            self.client = MongoClient(connection_url)
+            # The ismaster command is cheap and does not require auth.
+            self.client["admin"].command("ismaster")
+        except ConnectionFailure as e:
+            print(f"Error: {e}")
+
+        # if a db is specified then make connection
+        if database is not None:
+            self.set_database(database)
+
+    def set_database(self, database: str) -> None:
+        """Sets the current database."""
+        self.database = self.client[database]
+        self._collections = {}
+
+    def get_collection(self, collection: str | Collections) -> StoreCollection:
+        """Returns a handle for a collection.
+
+        Handles are created once per collection and are safe to share.
+
+        Args:
+            collection (str, StoreDatabase.Collections): Name of the collection.
+        Returns:
+            StoreCollection for the collection.
+        """
+        name: str = str(collection)
+        handle: StoreCollection | None = self._collections.get(name)
+        if handle is None:
+            handle = self._collections.setdefault(
+                name, StoreCollection(self.database[name])
+            )
+        return handle
+
+    @property
+    def items(self) -> StoreCollection:
+        """Handle for the items collection."""
+        return self.get_collection(StoreDatabase.Collections.ItemsCollection)
+
+    @property
+    def users(self) -> StoreCollection:
+        """Handle for the users collection."""
+        return self.get_collection(StoreDatabase.Collections.UsersCollection)
+
+    @property
+    def locations(self) -> StoreCollection:
+        """Handle for the locations collection."""
+        return self.get_collection(StoreDatabase.Collections.LocationsCollection)
+
+    @property
+    def user_data(self) -> StoreCollection:
+        """Handle for the materialized user_data collection."""
+        return self.get_collection(StoreDatabase.Collections.UserDataCollection)
+
+    def create_collection(
+        self, collection: str | Collections, validator: dict = None, **options
+    ):
+        """Creates a new collection.
+
+        Creates a new collection
+
+        Args:
+            collection (str, StoreDatabase.Collections): Name of the collection.
+            validator (dict, optional): Validator for jsonSchema of the documents in the collection.
+            options: Other create options, e.g. timeseries and expireAfterSeconds.
+        """
+        # The server wants a document if validator is sent at all
+        if validator is not None:
+            options["validator"] = validator
+        self.database.create_collection(str(collection), **options)
+
+    def drop_collection(self, collection: str | Collections):
+        """Drops a collection.
+
+        Drops a collection from the database.
+
+        Args:
+            collection (str, StoreDatabase.Collections): Name of the collection.
+        """
+        self.database.drop_collection(str(collection))
+
+    def drop_database(self, database: str):
+        """Drops a database.
+
+        Drops the specified database.
+
+        Args:
+            datbase (str): Name of the database.
+        """
+        self.client.drop_database(database)
+
     def close(self) -> None:
         """Close connection to database.
 
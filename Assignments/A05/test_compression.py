@@ -0,0 +1,82 @@
+import gzip
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+from compression import CompressionMiddleware, accepted_encodings
+
+BODY: str = "compress me " * 1000
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+
+@app.get("/text")
+async def text():
+    return PlainTextResponse(BODY)
+
+
+@app.get("/small")
+async def small():
+    return PlainTextResponse("tiny")
+
+
+@app.get("/image")
+async def image():
+    return Response(b"\x89PNG" + b"\0" * 1000, media_type="image/png")
+
+
+@app.get("/stream")
+async def stream():
+    async def chunks():
+        for _ in range(10):
+            yield BODY.encode()
+
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+client = TestClient(app)
+
+
+def get(path: str, accept_encoding: str):
+    # Read the raw body, so the client doesn't decode it
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as r:
+        return r, b"".join(r.iter_raw())
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, br;q=0.9") == {"gzip", "br"}
+    assert accepted_encodings("GZIP, br;q=0") == {"gzip"}
+    assert accepted_encodings("br;q=oops, identity") == {"identity"}
+    assert accepted_encodings("") == set()
+
+
+def test_gzip():
+    response, body = get("/text", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert gzip.decompress(body) == BODY.encode()
+
+
+def test_streaming_gzip():
+    response, body = get("/stream", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == BODY.encode() * 10
+
+
+def test_brotli():
+    brotli = pytest.importorskip("brotli")
+    response, body = get("/text", "gzip, br")
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(body) == BODY.encode()
+
+
+def test_left_uncompressed():
+    for path, accept_encoding in [
+        ("/text", "identity"),
+        ("/text", "gzip;q=0"),
+        ("/small", "gzip"),
+        ("/image", "gzip"),
+    ]:
+        response, _ = get(path, accept_encoding)
+        assert "content-encoding" not in response.headers, path
@@ -0,0 +1,74 @@
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from conditional import ConditionalGetMiddleware, weak_etag, etag_matches
+
+BODY: str = "hello " * 100
+
+app = FastAPI()
+app.add_middleware(ConditionalGetMiddleware)
+
+
+@app.get("/text")
+async def text():
+    return PlainTextResponse(BODY, headers={"Cache-Control": "max-age=60"})
+
+
+@app.get("/tagged")
+async def tagged():
+    return PlainTextResponse(BODY, headers={"ETag": '"route"'})
+
+
+@app.get("/stream")
+async def stream():
+    async def chunks():
+        yield b"a"
+        yield b"b"
+
+    return StreamingResponse(chunks())
+
+
+client = TestClient(app)
+
+
+def test_weak_etag():
+    assert weak_etag("a", "b") == weak_etag("a", b"b")
+    # Parts are separated, so shifting a boundary changes the tag
+    assert weak_etag("ab", "c") != weak_etag("a", "bc")
+    assert weak_etag("a").startswith('W/"')
+
+
+def test_etag_matches():
+    assert etag_matches('"x"', '"x"')
+    assert etag_matches('"y", W/"x"', '"x"')
+    assert etag_matches('"x"', 'W/"x"')
+    assert etag_matches("*", '"x"')
+    assert not etag_matches(None, '"x"')
+    assert not etag_matches("", '"x"')
+    # A tag only matches as a whole, not as part of another one
+    assert not etag_matches('"xy"', '"x"')
+    assert not etag_matches('"x"', '"xy"')
+
+
+def test_adds_etag_and_answers_not_modified():
+    response = client.get("/text")
+    etag: str = response.headers["etag"]
+    assert response.status_code == 200
+    assert etag == weak_etag(BODY.encode())
+
+    response = client.get("/text", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert response.headers["cache-control"] == "max-age=60"
+    assert "content-type" not in response.headers
+
+
+def test_leaves_route_etags_and_streams_alone():
+    response = client.get("/tagged", headers={"If-None-Match": weak_etag(BODY)})
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"route"'
+
+    response = client.get("/stream")
+    assert response.content == b"ab"
+    assert "etag" not in response.headers
@@ -0,0 +1,95 @@
+import pytest
+from geo import (
+    EDGE_STEP,
+    MAX_LATITUDE,
+    MAX_POLYGON_WIDTH,
+    POSITION_FIELD,
+    geo_point,
+    in_viewport,
+    near_pipeline,
+    viewport_filter,
+    viewport_polygons,
+)
+
+
+def ring(polygon: dict) -> list[list[float]]:
+    return polygon["coordinates"][0]
+
+
+def longitudes(polygon: dict) -> tuple[float, float]:
+    lons: list[float] = [lon for lon, _ in ring(polygon)]
+    return min(lons), max(lons)
+
+
+def test_geo_point_is_longitude_first():
+    assert geo_point(33.9, -98.5) == {"type": "Point", "coordinates": [-98.5, 33.9]}
+
+
+def test_in_viewport():
+    assert in_viewport(33.9, -98.5, 33, -99, 34, -98)
+    assert not in_viewport(35, -98.5, 33, -99, 34, -98)
+    assert not in_viewport(33.9, -97, 33, -99, 34, -98)
+    # Crossing the antimeridian
+    assert in_viewport(0, 179, -10, 170, 10, -170)
+    assert in_viewport(0, -175, -10, 170, 10, -170)
+    assert not in_viewport(0, 0, -10, 170, 10, -170)
+
+
+def test_small_viewport_is_one_closed_polygon():
+    polygons: list[dict] = viewport_polygons(33, -99, 34, -98)
+    assert len(polygons) == 1
+    coordinates: list[list[float]] = ring(polygons[0])
+    assert coordinates[0] == coordinates[-1]
+    assert coordinates[0] == [-99, 33]
+    assert {lat for _, lat in coordinates} == {33, 34}
+    assert longitudes(polygons[0]) == (-99, -98)
+
+
+def test_edges_follow_parallels():
+    polygon: dict = viewport_polygons(30, -104, 37, -94)[0]
+    # Leaving out the vertex that closes the ring
+    south_edge: list[float] = [lon for lon, lat in ring(polygon)[:-1] if lat == 30]
+    # A vertex at least every EDGE_STEP degrees
+    steps: list[float] = [b - a for a, b in zip(south_edge, south_edge[1:])]
+    assert max(steps) <= EDGE_STEP + 1e-9
+    assert south_edge[0] == -104 and south_edge[-1] == -94
+
+
+def test_antimeridian_viewport_is_split():
+    polygons: list[dict] = viewport_polygons(-10, 170, 10, -170)
+    assert [longitudes(polygon) for polygon in polygons] == [
+        (170, 180),
+        (-180, -170),
+    ]
+
+
+def test_wide_viewport_is_split():
+    polygons: list[dict] = viewport_polygons(-90, -180, 90, 180)
+    assert len(polygons) == 4
+    for polygon in polygons:
+        low, high = longitudes(polygon)
+        assert high - low <= MAX_POLYGON_WIDTH
+        # No vertex on a pole
+        assert all(abs(lat) <= MAX_LATITUDE for _, lat in ring(polygon))
+
+
+def test_viewport_filter():
+    single: dict = viewport_filter(33, -99, 34, -98)
+    assert list(single) == [POSITION_FIELD]
+    assert single[POSITION_FIELD]["$geoWithin"]["$geometry"]["type"] == "Polygon"
+
+    split: dict = viewport_filter(-10, 170, 10, -170)
+    assert len(split["$or"]) == 2
+
+    with pytest.raises(ValueError):
+        viewport_filter(33, -98, 34, -98)
+
+
+def test_near_pipeline():
+    pipeline: list[dict] = near_pipeline(33.9, -98.5, 1000, 5, {"_id": 0})
+    near: dict = pipeline[0]["$geoNear"]
+    assert near["near"] == geo_point(33.9, -98.5)
+    assert near["key"] == POSITION_FIELD
+    assert near["maxDistance"] == 1000
+    assert pipeline[1:] == [{"$limit": 5}, {"$project": {"_id": 0}}]
+    assert len(near_pipeline(33.9, -98.5, 1000, 5)) == 2
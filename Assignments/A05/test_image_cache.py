@@ -0,0 +1,129 @@
+import asyncio
+import io
+import os
+import pytest
+import image_cache
+from PIL import Image
+from image_cache import ImageCache, CachedImage
+
+URL: str = "https://example.com/candy.png"
+
+
+class FakeResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.headers = {"Content-Type": "image/png"}
+
+    def raise_for_status(self):
+        pass
+
+
+def png(width: int = 64, height: int = 32) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    urls: list[str] = []
+
+    def get(url, timeout):
+        urls.append(url)
+        return FakeResponse(png())
+
+    monkeypatch.setattr(image_cache.requests, "get", get)
+    return urls
+
+
+def test_downloads_once(tmp_path, downloads):
+    cache = ImageCache(str(tmp_path))
+
+    async def scenario():
+        first, second = await asyncio.gather(cache.get(URL), cache.get(URL))
+        assert first.etag == second.etag
+        return await cache.get(URL)
+
+    image: CachedImage = asyncio.run(scenario())
+    assert downloads == [URL]
+    assert image.content == png()
+    assert os.path.exists(image.path)
+
+
+def test_re_adding_a_key_replaces_its_size(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    path: str = str(tmp_path / "key.etag.png")
+    for size in (10, 10, 25):
+        cache._add_to_disk("key", CachedImage(path, "image/png", "etag", size))
+    assert cache._disk_bytes == 25
+    assert len(cache._disk) == 1
+
+
+def test_variant_of_an_original_evicted_from_disk(tmp_path, downloads):
+    # Small enough for memory, the disk tier only fits one file
+    cache = ImageCache(str(tmp_path), max_disk_bytes=1)
+
+    async def scenario():
+        original: CachedImage = await cache.get(URL)
+        os.unlink(original.path)
+        return await cache.get_variant(URL, 16, 16, "webp")
+
+    variant: CachedImage = asyncio.run(scenario())
+    assert downloads == [URL]
+    with Image.open(variant.path) as image:
+        assert image.format == "WEBP"
+        assert image.size == (16, 8)
+    # Only counts the files it still has
+    assert cache._disk_bytes == sum(image.size for image in cache._disk.values())
+
+
+def test_open_file_survives_eviction(tmp_path, downloads):
+    cache = ImageCache(str(tmp_path), max_memory_item_bytes=0)
+
+    async def scenario():
+        image: CachedImage = await cache.get(URL)
+        with await cache.open_file(image) as file:
+            # Evicted after the response opened it
+            cache.max_disk_bytes = 0
+            cache._add_to_disk("other", CachedImage(image.path + "x", "", "", 1))
+            assert not os.path.exists(image.path)
+            assert file.read() == png()
+
+    asyncio.run(scenario())
+
+
+def test_open_file_forgets_missing_files(tmp_path, downloads):
+    cache = ImageCache(str(tmp_path), max_memory_item_bytes=0)
+
+    async def scenario():
+        image: CachedImage = await cache.get(URL)
+        os.unlink(image.path)
+        with pytest.raises(FileNotFoundError):
+            await cache.open_file(image)
+        assert cache._disk_bytes == 0
+
+        # The next lookup downloads it again
+        image = await cache.get(URL)
+        with await cache.open_file(image) as file:
+            assert file.read() == png()
+
+    asyncio.run(scenario())
+    assert downloads == [URL, URL]
+
+
+def test_workers_start_on_the_first_variant(tmp_path, downloads):
+    cache = ImageCache(str(tmp_path), workers=1)
+    assert cache._executor is None
+
+    async def scenario():
+        await cache.get(URL)
+        assert cache._executor is None
+        return await cache.get_variant(URL, 16, 16, "jpeg")
+
+    try:
+        variant: CachedImage = asyncio.run(scenario())
+        assert cache._executor is not None
+        assert os.path.exists(variant.path)
+    finally:
+        cache.close()
+    assert cache._executor is None
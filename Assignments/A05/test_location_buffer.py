@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+from location_buffer import LocationBuffer, BufferFull, DUPLICATE_KEY
+
+
+class FakeCollection:
+    """Stands in for a collection, recording bulk writes or failing them."""
+
+    def __init__(self):
+        self.writes: list[list] = []
+        self.error: Exception | None = None
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.error is not None:
+            raise self.error
+        self.writes.append(requests)
+
+
+def location(username: str, timestamp: int, latitude: float = 33.9) -> dict:
+    return {
+        "username": username,
+        "latitude": latitude,
+        "longitude": -98.5,
+        "timestamp": timestamp,
+    }
+
+
+def written(request) -> dict:
+    """Returns the filter and $set of an UpdateOne."""
+    return {"filter": request._filter, **request._doc["$set"]}
+
+
+def test_coalesces_updates_per_username():
+    collection = FakeCollection()
+    buffer = LocationBuffer(collection)
+
+    async def scenario():
+        await buffer.add(location("ana", 1, latitude=1.0))
+        await buffer.add(location("ana", 3, latitude=3.0))
+        # Arrives late, older than the update already waiting
+        await buffer.add(location("ana", 2, latitude=2.0))
+        await buffer.add(location("bob", 1))
+        assert buffer.get("ana")["timestamp"] == 3
+        return await buffer.flush()
+
+    assert asyncio.run(scenario()) == 2
+    assert len(collection.writes) == 1
+    ana = written(collection.writes[0][0])
+    assert ana["filter"] == {"username": "ana", "timestamp": {"$lt": 3}}
+    assert ana["latitude"] == 3.0
+    assert ana["position"] == {"type": "Point", "coordinates": [-98.5, 3.0]}
+    assert buffer.stats()["coalesced"] == 2
+    assert len(buffer) == 0
+
+
+def test_stale_updates_are_dropped():
+    collection = FakeCollection()
+    collection.error = BulkWriteError(
+        {
+            "writeErrors": [{"index": 0, "code": DUPLICATE_KEY, "errmsg": "dup"}],
+            "nUpserted": 0,
+            "nModified": 1,
+        }
+    )
+    buffer = LocationBuffer(collection)
+
+    async def scenario():
+        await buffer.add(location("ana", 1))
+        await buffer.add(location("bob", 1))
+        return await buffer.flush()
+
+    assert asyncio.run(scenario()) == 2
+    # An older update than the stored one is neither retried nor an error
+    assert len(buffer) == 0
+    assert buffer.stats()["stale"] == 1
+    assert buffer.stats()["write_errors"] == 0
+
+
+def test_failed_flush_keeps_updates():
+    collection = FakeCollection()
+    collection.error = AutoReconnect("connection lost")
+    buffer = LocationBuffer(collection)
+
+    async def scenario():
+        await buffer.add(location("ana", 1))
+        await buffer.add(location("bob", 5))
+        assert await buffer.flush() == 0
+        assert len(buffer) == 2
+
+        # A newer update that arrived meanwhile wins over the one put back
+        await buffer.add(location("bob", 6))
+        collection.error = None
+        assert await buffer.flush() == 2
+
+    asyncio.run(scenario())
+    assert {written(r)["timestamp"] for r in collection.writes[0]} == {1, 6}
+    assert buffer.stats()["failed_flushes"] == 1
+
+
+def test_full_buffer_flushes_first():
+    collection = FakeCollection()
+    buffer = LocationBuffer(collection, max_pending=2)
+
+    async def scenario():
+        await buffer.add(location("ana", 1))
+        await buffer.add(location("bob", 1))
+        # Updating a waiting username never needs room
+        await buffer.add(location("bob", 2))
+        assert collection.writes == []
+        await buffer.add(location("cid", 1))
+
+    asyncio.run(scenario())
+    assert len(collection.writes) == 1
+    assert buffer.get("cid") is not None
+
+
+def test_full_buffer_raises_when_flushes_fail():
+    collection = FakeCollection()
+    collection.error = AutoReconnect("connection lost")
+    buffer = LocationBuffer(collection, max_pending=1)
+
+    async def scenario():
+        await buffer.add(location("ana", 1))
+        with pytest.raises(BufferFull):
+            await buffer.add(location("bob", 1))
+
+    asyncio.run(scenario())
+    assert buffer.get("ana") is not None
+    assert buffer.get("bob") is None
@@ -0,0 +1,79 @@
+import asyncio
+from location_hub import LocationHub, viewport_cells
+
+
+def location(username: str, timestamp: int, latitude=33.9, longitude=-98.5) -> dict:
+    return {
+        "username": username,
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": timestamp,
+    }
+
+
+def test_publish_reaches_subscriptions_in_their_viewport():
+    hub = LocationHub()
+    everything = hub.subscribe()
+    wichita_falls = hub.subscribe()
+    hub.set_viewport(wichita_falls, (33, -99, 34, -98))
+    elsewhere = hub.subscribe()
+    hub.set_viewport(elsewhere, (40, -75, 41, -73))
+
+    assert hub.publish(location("ana", 1)) == 2
+    assert len(everything) == len(wichita_falls) == 1
+    assert len(elsewhere) == 0
+
+
+def test_subscriptions_coalesce_per_user():
+    hub = LocationHub()
+    subscription = hub.subscribe()
+    hub.publish(location("ana", 1))
+    hub.publish(location("ana", 2))
+    hub.publish(location("bob", 1))
+
+    batch: list[dict] = asyncio.run(subscription.next_batch())
+    assert [(loc["username"], loc["timestamp"]) for loc in batch] == [
+        ("ana", 2),
+        ("bob", 1),
+    ]
+
+
+def test_out_of_order_updates_are_dropped():
+    hub = LocationHub()
+    subscription = hub.subscribe()
+    hub.publish(location("ana", 2))
+    assert hub.publish(location("ana", 1)) == 0
+    assert hub.stats()["stale"] == 1
+    assert asyncio.run(subscription.next_batch())[0]["timestamp"] == 2
+
+
+def test_timestamps_are_bounded():
+    hub = LocationHub(max_users=2)
+    hub.subscribe()
+    hub.publish(location("ana", 5))
+    hub.publish(location("bob", 5))
+    # Updating ana makes bob the least recently updated
+    hub.publish(location("ana", 6))
+    hub.publish(location("cid", 5))
+
+    assert hub.stats()["users"] == 2
+    assert hub.publish(location("ana", 1)) == 0
+    # bob was forgotten, so his late update can't be recognized any more
+    assert hub.publish(location("bob", 1)) == 1
+    assert hub.stats()["stale"] == 1
+
+
+def test_viewport_cells():
+    assert viewport_cells(33.5, -98.5, 34.5, -97.5) == [
+        (33, -99),
+        (33, -98),
+        (34, -99),
+        (34, -98),
+    ]
+    # Crossing the antimeridian
+    assert {column for _, column in viewport_cells(0, 179.5, 0.5, -179.5)} == {
+        179,
+        180,
+        -180,
+    }
+    assert viewport_cells(-90, -180, 90, 180) is None
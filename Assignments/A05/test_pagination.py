@@ -0,0 +1,139 @@
+import base64
+import importlib
+import pytest
+from bson import json_util
+from bson.objectid import ObjectId
+from fastapi.exceptions import HTTPException
+from store_database import (
+    StoreCollection,
+    keyset_filter,
+    keyset_after,
+    keyset_projection,
+    keyset_hidden,
+)
+
+ID: ObjectId = ObjectId()
+# Newest price first, ties broken by name and then _id
+SORT: list[tuple] = [("price", -1), ("name", 1), ("_id", 1)]
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    # api.py mounts ./static when it is imported
+    directory = tmp_path_factory.mktemp("api")
+    (directory / "static").mkdir()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(directory)
+        yield importlib.import_module("api")
+
+
+def encode(token) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(token).encode()).decode()
+
+
+def test_keyset_filter_first_page():
+    assert keyset_filter({"category": "Movies"}, SORT, None) == {"category": "Movies"}
+
+
+def test_keyset_filter_single_field():
+    assert keyset_filter({}, [("_id", 1)], [ID]) == {"_id": {"$gt": ID}}
+    assert keyset_filter({"category": "Movies"}, [("_id", -1)], [ID]) == {
+        "$and": [{"category": "Movies"}, {"_id": {"$lt": ID}}]
+    }
+
+
+def test_keyset_filter_mixed_directions():
+    assert keyset_filter({}, SORT, [5.0, "Alien", ID]) == {
+        "$or": [
+            {"price": {"$lt": 5.0}},
+            {"price": 5.0, "name": {"$gt": "Alien"}},
+            {"price": 5.0, "name": "Alien", "_id": {"$gt": ID}},
+        ]
+    }
+
+
+def test_keyset_after_restores_object_ids():
+    after: list = keyset_after({"price": 5.0, "name": "Alien", "_id": str(ID)}, SORT)
+    assert after == [5.0, "Alien", ID]
+    # Only _id is converted, other fields stay as they are
+    assert keyset_after({"name": str(ID), "_id": 1}, [("name", 1), ("_id", 1)]) == [
+        str(ID),
+        1,
+    ]
+
+
+def test_keyset_projection_and_hidden():
+    # Inclusion projections get the sort fields added, and hidden afterwards
+    projection: dict = {"name": 1, "_id": 0}
+    assert keyset_projection(projection, SORT) == {"name": 1, "_id": 1, "price": 1}
+    assert keyset_hidden(projection, SORT) == ["price", "_id"]
+
+    # Exclusion projections only lose their exclusions of the sort fields
+    projection = {"price": 0, "desc": 0}
+    assert keyset_projection(projection, SORT) == {"desc": 0}
+    assert keyset_hidden(projection, SORT) == ["price"]
+
+    assert keyset_projection({}, SORT) == {}
+    assert keyset_hidden({}, SORT) == []
+
+
+def test_find_page_walks_every_document_once():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.items
+    # Few distinct prices and names, so every sort field breaks ties
+    collection.insert_many(
+        [{"price": float(i % 3), "name": f"item {i % 4}", "i": i} for i in range(25)]
+    )
+    items = StoreCollection(collection)
+    expected: list[int] = [
+        doc["i"] for doc in collection.find({}, sort=[(field, d) for field, d in SORT])
+    ]
+
+    seen: list[int] = []
+    after: list | None = None
+    while True:
+        page, after = items.find_page({}, {"i": 1, "_id": 0}, SORT, 4, after)
+        assert all(set(doc) == {"i"} for doc in page)
+        seen += [doc["i"] for doc in page]
+        if after is None:
+            break
+    assert seen == expected
+
+
+def test_cursor_round_trip(api):
+    after: list = [5.0, "Alien", ID]
+    assert api.decode_cursor(api.encode_cursor(SORT, after), SORT) == after
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor!",
+        base64.urlsafe_b64encode(b"not json").decode(),
+        encode(["price", "name", "_id"]),
+        encode({"sort": ["price", "name", "_id"]}),
+        encode({"sort": ["price", "name", "_id"], "after": 5}),
+    ],
+)
+def test_tampered_cursor(api, cursor):
+    with pytest.raises(HTTPException) as e:
+        api.decode_cursor(cursor, SORT)
+    assert e.value.status_code == 400
+    assert e.value.detail == "Invalid cursor."
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        # Issued for another sort
+        {"sort": ["_id"], "after": [ID]},
+        {"sort": ["name", "price", "_id"], "after": ["Alien", 5.0, ID]},
+        # Right fields, wrong number of values
+        {"sort": ["price", "name", "_id"], "after": [5.0, ID]},
+    ],
+)
+def test_mismatched_cursor(api, token):
+    with pytest.raises(HTTPException) as e:
+        api.decode_cursor(encode(token), SORT)
+    assert e.value.status_code == 400
+    assert e.value.detail == "Cursor does not match this query."
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import pytest
+from hashlib import sha256
+from passwords import (
+    PasswordHasher,
+    HasherBusy,
+    hash_password,
+    verify_password,
+    is_legacy,
+)
+
+# Cheap parameters, the tests check behavior rather than cost
+N: int = 2**4
+R: int = 1
+P: int = 1
+
+
+def test_hash_and_verify():
+    stored: str = hash_password("hunter2", N, R, P)
+    assert stored.startswith(f"scrypt${N}${R}${P}$")
+    assert verify_password("hunter2", stored, N, R, P) == (True, False)
+    assert verify_password("hunter3", stored, N, R, P) == (False, False)
+
+
+def test_hashes_are_salted():
+    assert hash_password("hunter2", N, R, P) != hash_password("hunter2", N, R, P)
+
+
+def test_other_parameters_need_a_rehash():
+    stored: str = hash_password("hunter2", N, R, P)
+    assert verify_password("hunter2", stored, N * 2, R, P) == (True, True)
+
+
+def test_legacy_sha256():
+    stored: str = sha256(b"hunter2").hexdigest()
+    assert is_legacy(stored)
+    assert verify_password("hunter2", stored, N, R, P) == (True, True)
+    assert verify_password("hunter3", stored, N, R, P) == (False, True)
+
+
+@pytest.mark.parametrize(
+    "stored", ["", "scrypt$x$1$1$salt$hash", "bcrypt$4$1$1$c2FsdA$aGFzaA", "plain"]
+)
+def test_malformed_records_never_match(stored):
+    assert verify_password("", stored, N, R, P) == (False, False)
+
+
+def test_hasher_rehashes_legacy_records():
+    hasher = PasswordHasher(workers=1, n=N, r=R, p=P)
+
+    async def scenario():
+        matches, rehashed = await hasher.verify(
+            "hunter2", sha256(b"hunter2").hexdigest()
+        )
+        assert matches
+        assert verify_password("hunter2", rehashed, N, R, P) == (True, False)
+
+        # Current records and wrong passwords are never rehashed
+        assert await hasher.verify("hunter2", rehashed) == (True, None)
+        assert await hasher.verify("hunter3", sha256(b"hunter2").hexdigest()) == (
+            False,
+            None,
+        )
+
+    try:
+        asyncio.run(scenario())
+        assert hasher.stats()["rehashes"] == 1
+        assert hasher.stats()["in_flight"] == 0
+    finally:
+        hasher.close()
+
+
+def test_hasher_sheds_load_when_the_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_queue=1, n=N, r=R, p=P)
+    release = threading.Event()
+
+    async def scenario():
+        # Two blocked jobs fill the worker and the queue
+        blocked = [asyncio.ensure_future(hasher._run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HasherBusy):
+            await hasher.hash("hunter2")
+        assert hasher.stats()["rejected"] == 1
+
+        # Cancelled callers keep their slots until their jobs are done
+        blocked[1].cancel()
+        await asyncio.sleep(0)
+        with pytest.raises(HasherBusy):
+            await hasher.hash("hunter2")
+
+        release.set()
+        await blocked[0]
+        for _ in range(100):
+            if hasher.stats()["in_flight"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert hasher.stats()["in_flight"] == 0
+        assert (await hasher.hash("hunter2")).startswith("scrypt$")
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+        hasher.close()
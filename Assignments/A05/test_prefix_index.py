@@ -0,0 +1,68 @@
+from prefix_index import PrefixIndex, normalize
+
+ITEMS: list[dict] = [
+    {"_id": "1", "name": "Sour Patch Kids", "tags": ["Gummy", "sour"]},
+    {"_id": "2", "name": "Snickers", "tags": ["chocolate"]},
+    {"_id": "3", "name": "Sour-Watermelon Slices", "tags": []},
+    {"_id": "4", "name": "Kit Kat", "tags": ["Chocolate", "wafer"]},
+]
+
+
+def index() -> PrefixIndex:
+    prefix_index = PrefixIndex()
+    prefix_index.build(ITEMS)
+    return prefix_index
+
+
+def ids(suggestions: list[dict]) -> list[str]:
+    return [suggestion["_id"] for suggestion in suggestions]
+
+
+def test_normalize():
+    assert normalize("  Sour-Watermelon_Slices! ") == "sour watermelon slices"
+    assert normalize("ÉCLAIR") == "éclair"
+    assert normalize("--") == ""
+
+
+def test_names_come_before_other_terms():
+    # Names starting with the prefix first, then words and tags
+    assert ids(index().suggest("s")) == ["2", "1", "3"]
+    assert ids(index().suggest("kit")) == ["4"]
+    # Ties between terms are broken by id
+    assert ids(index().suggest("choc")) == ["2", "4"]
+    assert ids(index().suggest("water")) == ["3"]
+
+
+def test_suggestions_are_case_and_punctuation_insensitive():
+    assert ids(index().suggest("SOUR-wat")) == ["3"]
+    assert index().suggest("kit kat") == [{"_id": "4", "name": "Kit Kat"}]
+
+
+def test_limit_and_empty_prefix():
+    assert len(index().suggest("s", limit=2)) == 2
+    assert index().suggest("") == []
+    assert index().suggest("!!") == []
+    assert index().suggest("zzz") == []
+
+
+def test_add_replaces_and_remove_forgets():
+    prefix_index = index()
+    prefix_index.add({"_id": "2", "name": "Mars Bar", "tags": []})
+    assert ids(prefix_index.suggest("snick")) == []
+    assert ids(prefix_index.suggest("mars")) == ["2"]
+    assert ids(prefix_index.suggest("choc")) == ["4"]
+    assert len(prefix_index) == 4
+
+    prefix_index.remove("4")
+    prefix_index.remove("missing")
+    assert ids(prefix_index.suggest("k")) == ["1"]
+    assert len(prefix_index) == 3
+
+
+def test_add_matches_build():
+    built = index()
+    added = PrefixIndex()
+    for item in reversed(ITEMS):
+        added.add(item)
+    for prefix in ("s", "k", "choc", "sour w", "g"):
+        assert built.suggest(prefix) == added.suggest(prefix)
@@ -0,0 +1,159 @@
+import asyncio
+import result_cache
+from result_cache import ResultCache, MemoryBackend
+
+QUERY: dict = {"filter": {"category": "Movies"}}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def cache_result(cache: ResultCache, scopes: list[str], value) -> str:
+    key: str = await cache.key(scopes, QUERY)
+    await cache.set(key, value, scopes)
+    return key
+
+
+def test_get_or_load_caches_until_invalidated():
+    cache = ResultCache(MemoryBackend(), ttl=60)
+    loads: list[int] = []
+
+    async def load():
+        loads.append(1)
+        return len(loads)
+
+    async def scenario():
+        assert await cache.get_or_load(["items"], QUERY, load) == 1
+        assert await cache.get_or_load(["items"], QUERY, load) == 1
+        await cache.invalidate(["items"])
+        assert await cache.get_or_load(["items"], QUERY, load) == 2
+
+    run(scenario())
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_invalidation_only_touches_its_scopes():
+    cache = ResultCache(MemoryBackend(), ttl=60)
+
+    async def scenario():
+        await cache_result(cache, ["items", "items:category:Movies"], "movies")
+        await cache_result(cache, ["items", "items:category:Candy"], "candy")
+        await cache.invalidate(["items:category:Candy"])
+        movies = await cache.get(
+            await cache.key(["items", "items:category:Movies"], QUERY)
+        )
+        candy = await cache.get(
+            await cache.key(["items", "items:category:Candy"], QUERY)
+        )
+        return movies, candy
+
+    assert run(scenario()) == ("movies", None)
+
+
+def test_pruning_keeps_versions_of_live_entries():
+    backend = MemoryBackend(max_entries=4)
+    cache = ResultCache(backend, ttl=60)
+
+    async def scenario():
+        await cache_result(cache, ["items"], "all")
+        # Invalidating many scopes nothing depends on prunes their versions
+        for id in range(100):
+            await cache.invalidate([f"items:id:{id}"])
+        assert len(backend._versions) <= len(backend._references) + 4
+        assert await cache.get(await cache.key(["items"], QUERY)) == "all"
+
+    run(scenario())
+
+
+def test_invalidated_scope_never_returns_a_stale_key():
+    backend = MemoryBackend(max_entries=4)
+    cache = ResultCache(backend, ttl=60)
+
+    async def scenario():
+        # A read starts, a write invalidates its scope before it is cached
+        stale: str = await cache.key(["items:id:1"], QUERY)
+        await cache.invalidate(["items:id:1"])
+        fresh: str = await cache.key(["items:id:1"], QUERY)
+        assert fresh != stale
+
+        # Pruning drops the scope's version and moves the floor
+        floor: int = backend._floor
+        for id in range(100, 200):
+            await cache.invalidate([f"items:id:{id}"])
+        assert "items:id:1" not in backend._versions
+        assert backend._floor > floor
+
+        # The read finishes late, its result must not be found again
+        await cache.set(stale, "stale", ["items:id:1"])
+        assert await cache.get(await cache.key(["items:id:1"], QUERY)) is None
+
+        # Nor a key built from the version before the prune
+        assert await cache.key(["items:id:1"], QUERY) != fresh
+
+    run(scenario())
+
+
+def test_never_invalidated_scope_is_not_stale_after_prune():
+    backend = MemoryBackend(max_entries=4)
+    cache = ResultCache(backend, ttl=60)
+
+    async def scenario():
+        # Built at the floor, before any prune
+        stale: str = await cache.key(["items:id:1"], QUERY)
+        for id in range(100, 200):
+            await cache.invalidate([f"items:id:{id}"])
+        await cache.invalidate(["items:id:1"])
+        for id in range(200, 300):
+            await cache.invalidate([f"items:id:{id}"])
+        await cache.set(stale, "stale", ["items:id:1"])
+        assert await cache.get(await cache.key(["items:id:1"], QUERY)) is None
+
+    run(scenario())
+
+
+def test_lru_eviction_releases_references():
+    backend = MemoryBackend(max_entries=2)
+    cache = ResultCache(backend, ttl=60)
+
+    async def scenario():
+        first: str = await cache_result(cache, ["items", "a"], 1)
+        await cache_result(cache, ["items", "b"], 2)
+        # Reading the first one makes the second the least recently used
+        assert await cache.get(first) == 1
+        await cache_result(cache, ["items", "c"], 3)
+
+    run(scenario())
+    assert len(backend) == 2
+    assert backend._references == {"items": 2, "a": 1, "c": 1}
+
+
+def test_overwriting_a_key_does_not_double_count():
+    backend = MemoryBackend()
+    cache = ResultCache(backend, ttl=60)
+
+    async def scenario():
+        await cache_result(cache, ["items"], 1)
+        await cache_result(cache, ["items"], 2)
+
+    run(scenario())
+    assert backend._references == {"items": 1}
+
+
+def test_ttl_expiry(monkeypatch):
+    now: list[float] = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    backend = MemoryBackend()
+    cache = ResultCache(backend, ttl=30)
+
+    async def scenario():
+        key: str = await cache_result(cache, ["items"], "value")
+        now[0] += 29
+        assert await cache.get(key) == "value"
+        now[0] += 2
+        assert await cache.get(key) is None
+
+    run(scenario())
+    assert len(backend) == 0
+    assert backend._references == {}
@@ -0,0 +1,66 @@
+import asyncio
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo.results import UpdateResult
+from async_store_database import AsyncStoreCollection
+from store_database import StoreCollection
+
+# raw_result of an update_one that upserted, as the server returns it
+UPSERTED_ID = ObjectId()
+UPSERTED = {"n": 1, "nModified": 0, "upserted": UPSERTED_ID, "ok": 1.0}
+# raw_result of an update_one that matched an existing document
+UPDATED = {"n": 1, "nModified": 1, "updatedExisting": True, "ok": 1.0}
+
+
+class FakeCollection:
+    """Stands in for a pymongo collection, returning a fixed update result."""
+
+    name = "items"
+
+    def __init__(self, raw_result):
+        self.raw_result = raw_result
+
+    def update_one(self, filter, update, upsert=False):
+        return UpdateResult(self.raw_result, True)
+
+
+class FakeAsyncCollection(FakeCollection):
+    async def update_one(self, filter, update, upsert=False):
+        return UpdateResult(self.raw_result, True)
+
+
+def test_update_one_upsert():
+    result = StoreCollection(FakeCollection(UPSERTED)).update_one(
+        {"_id": UPSERTED_ID}, {"$set": {"name": "x"}}, upsert=True
+    )
+    assert result["upserted_id"] == str(UPSERTED_ID)
+    assert result["raw_result"]["upserted"] == str(UPSERTED_ID)
+    # FastAPI must be able to encode what the routes return
+    assert jsonable_encoder(result)["upserted_id"] == str(UPSERTED_ID)
+
+
+def test_update_one_without_upsert():
+    result = StoreCollection(FakeCollection(UPDATED)).update_one(
+        {"_id": UPSERTED_ID}, {"$set": {"name": "x"}}, upsert=True
+    )
+    assert result["upserted_id"] is None
+    assert jsonable_encoder(result)["raw_result"] == UPDATED
+
+
+def test_async_update_one_upsert():
+    result = asyncio.run(
+        AsyncStoreCollection(FakeAsyncCollection(UPSERTED)).update_one(
+            {"_id": UPSERTED_ID}, {"$set": {"name": "x"}}, upsert=True
+        )
+    )
+    assert result["upserted_id"] == str(UPSERTED_ID)
+    assert jsonable_encoder(result)["raw_result"]["upserted"] == str(UPSERTED_ID)
+
+
+def test_async_update_one_without_upsert():
+    result = asyncio.run(
+        AsyncStoreCollection(FakeAsyncCollection(UPDATED)).update_one(
+            {"_id": UPSERTED_ID}, {"$set": {"name": "x"}}
+        )
+    )
+    assert result["upserted_id"] is None
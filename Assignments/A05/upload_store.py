@@ -0,0 +1,439 @@
+"""Provides content-addressed storage for images uploaded by users.
+
+Provides the class UploadStore, which streams uploads to disk, hashing them
+on the way, and stores each distinct content once as a blob named after its
+SHA-256. A SQLite index maps the names uploads were given to their blobs, so
+re-uploading the same image under another name costs no disk space.
+The content type of an upload is sniffed from its bytes, and only PNG,
+JPEG, GIF and WebP images are stored as images, anything else is stored
+as application/octet-stream whatever the client claimed.
+
+The index and blobs are kept in a private directory, which must not be
+served statically. Files uploaded before the store existed sit directly in
+the legacy upload directory. They are still served, and can be moved into
+the store with python upload_store.py --migrate.
+"""
+
+from functools import lru_cache
+from PIL import Image, UnidentifiedImageError
+from hashlib import sha256, file_digest
+from typing import AsyncIterable, NamedTuple
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_BYTES: int = 20 * 1024**2
+DEFAULT_CONTENT_TYPE: str = "application/octet-stream"
+BLOBS_DIR: str = "blobs"
+INDEX_FILE: str = "uploads.sqlite3"
+# Pillow formats of the images uploads may be stored as, and their MIME types
+RASTER_FORMATS: dict[str, str] = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+RASTER_CONTENT_TYPES: frozenset[str] = frozenset(RASTER_FORMATS.values())
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload is larger than allowed."""
+
+
+class StoredUpload(NamedTuple):
+    """An upload and the file holding its content."""
+
+    file_name: str
+    path: str
+    sha256: str
+    size: int
+    content_type: str
+    deduplicated: bool = False
+
+
+def safe_file_name(file_name: str) -> str:
+    """Checks that a file name is a plain name inside its directory.
+
+    Args:
+        file_name (str): Name given by the client.
+    Returns:
+        The file name.
+    Raises:
+        ValueError: If the name is empty or contains a path.
+    """
+    if (
+        not file_name
+        or file_name in (".", "..")
+        or os.path.basename(file_name) != file_name
+        or "\\" in file_name
+        or "\0" in file_name
+    ):
+        raise ValueError(f"Invalid file name: {file_name!r}")
+    return file_name
+
+
+def resolve_upload(directory: str, file_path: str) -> str:
+    """Resolves a requested path to a file inside the upload directory.
+
+    Symlinks and .. segments are resolved before checking, so a request can
+    never reach outside of directory.
+
+    Args:
+        directory (str): Directory the uploads are stored in.
+        file_path (str): Path requested by the client.
+    Returns:
+        Absolute path of the file.
+    Raises:
+        ValueError: If the path points outside of directory.
+        FileNotFoundError: If there is no such file.
+    """
+    root: str = os.path.realpath(directory)
+    path: str = os.path.realpath(os.path.join(root, file_path))
+
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"Invalid file path: {file_path!r}")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    return path
+
+
+@lru_cache(maxsize=4096)
+def file_sha256(path: str, mtime_ns: int, size: int) -> str:
+    """Returns the SHA-256 of a file.
+
+    Cached on the file's modification time and size, so each version of a
+    file is only read once. Blocking, call it from a thread.
+
+    Args:
+        path (str): Path of the file.
+        mtime_ns (int): Modification time, in nanoseconds.
+        size (int): Size, in bytes.
+    Returns:
+        Hex digest of the file's content.
+    """
+    with open(path, "rb") as file:
+        return file_digest(file, "sha256").hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def sniff_content_type(path: str, mtime_ns: int, size: int) -> str:
+    """Returns the content type of a file, from its bytes rather than its name.
+
+    Only the header is read. Cached like file_sha256. Blocking, call it
+    from a thread.
+
+    Args:
+        path (str): Path of the file.
+        mtime_ns (int): Modification time, in nanoseconds.
+        size (int): Size, in bytes.
+    Returns:
+        The MIME type if the file is a PNG, JPEG, GIF or WebP image,
+        otherwise application/octet-stream.
+    """
+    try:
+        with Image.open(path, formats=list(RASTER_FORMATS)) as image:
+            return RASTER_FORMATS[image.format]
+    except (UnidentifiedImageError, OSError, KeyError):
+        return DEFAULT_CONTENT_TYPE
+
+
+def _sniff(path: str) -> str:
+    """Sniffs the content type of a file that may change."""
+    stat_result: os.stat_result = os.stat(path)
+    return sniff_content_type(path, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+class UploadStore:
+    """Deduplicating store for uploaded images.
+
+    Blobs live under <directory>/blobs/<aa>/<bb>/<sha256>, sharded on the
+    first bytes of the hash to keep directories small. Names are unique and
+    never overwritten, while any number of names may share a blob.
+    """
+
+    def __init__(self, directory: str, legacy_directory: str = None) -> None:
+        """Opens the store, creating its directories and index if missing.
+
+        An index and blobs left in the legacy directory by older versions
+        are moved into the store's directory.
+
+        Args:
+            directory (str): Private directory the index and blobs are stored in.
+            legacy_directory (str, optional): Directory of the files uploaded before the store existed. Defaults to directory.
+        """
+        self.directory: str = directory
+        self.legacy_directory: str = legacy_directory or directory
+        self.blobs_directory: str = os.path.join(directory, BLOBS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        if self.legacy_directory != directory:
+            self._move_out_of_legacy()
+        os.makedirs(self.blobs_directory, exist_ok=True)
+
+        # One connection shared by the worker threads, serialized by the lock
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(
+            os.path.join(directory, INDEX_FILE), check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    file_name TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+                """)
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS uploads_sha256 ON uploads (sha256)"
+            )
+
+    def _move_out_of_legacy(self) -> None:
+        """Moves an index and blobs from the legacy directory into the store's."""
+        for name in (INDEX_FILE, f"{INDEX_FILE}-wal", f"{INDEX_FILE}-shm", BLOBS_DIR):
+            source: str = os.path.join(self.legacy_directory, name)
+            destination: str = os.path.join(self.directory, name)
+            if os.path.exists(source) and not os.path.exists(destination):
+                shutil.move(source, destination)
+
+    def blob_path(self, digest: str) -> str:
+        """Returns the path of the blob for a SHA-256."""
+        return os.path.join(self.blobs_directory, digest[:2], digest[2:4], digest)
+
+    async def save(
+        self,
+        chunks: AsyncIterable[bytes],
+        file_name: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> StoredUpload:
+        """Streams an upload into the store.
+
+        Chunks are written to a temp file as they arrive, so memory use does
+        not depend on the size of the upload. Once complete, the temp file
+        becomes the blob for its hash, unless that blob already exists, in
+        which case the temp file is dropped.
+
+        Args:
+            chunks (AsyncIterable[bytes]): Body of the upload.
+            file_name (str): Name of the upload.
+            max_bytes (int, optional): Largest upload accepted.
+        Returns:
+            The stored upload.
+        Raises:
+            ValueError: If the file name is invalid.
+            FileExistsError: If an upload with that name already exists.
+            UploadTooLarge: If the upload is larger than max_bytes.
+        """
+        safe_file_name(file_name)
+        if await self.lookup(file_name) is not None:
+            raise FileExistsError(file_name)
+
+        digest = sha256()
+        size: int = 0
+
+        fd, temp_path = tempfile.mkstemp(dir=self.blobs_directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+                    digest.update(chunk)
+                    await asyncio.to_thread(file.write, chunk)
+                await asyncio.to_thread(os.fsync, file.fileno())
+
+            content_type: str = await asyncio.to_thread(_sniff, temp_path)
+            upload: StoredUpload = StoredUpload(
+                file_name,
+                self.blob_path(digest.hexdigest()),
+                digest.hexdigest(),
+                size,
+                content_type,
+            )
+            deduplicated: bool = await asyncio.to_thread(
+                self._store_blob, temp_path, upload.path
+            )
+        finally:
+            os.unlink(temp_path)
+
+        await asyncio.to_thread(self._record, upload)
+        return upload._replace(deduplicated=deduplicated)
+
+    async def lookup(self, file_name: str) -> StoredUpload | None:
+        """Finds an upload by name.
+
+        Falls back to files uploaded before the store existed, which are
+        hashed on first use.
+
+        Args:
+            file_name (str): Name of the upload.
+        Returns:
+            The upload, or None if there is none with that name.
+        """
+        upload: StoredUpload | None = await asyncio.to_thread(self._find, file_name)
+        if upload is not None:
+            return upload
+
+        # Older stores kept the index next to the uploads, never serve it
+        if file_name.startswith(INDEX_FILE):
+            return None
+        try:
+            path: str = await asyncio.to_thread(
+                resolve_upload, self.legacy_directory, safe_file_name(file_name)
+            )
+        except (ValueError, FileNotFoundError):
+            return None
+
+        stat_result: os.stat_result = await asyncio.to_thread(os.stat, path)
+        digest: str = await asyncio.to_thread(
+            file_sha256, path, stat_result.st_mtime_ns, stat_result.st_size
+        )
+        content_type: str = await asyncio.to_thread(
+            sniff_content_type, path, stat_result.st_mtime_ns, stat_result.st_size
+        )
+        return StoredUpload(file_name, path, digest, stat_result.st_size, content_type)
+
+    def usage(self) -> dict:
+        """Returns how much space the uploads take, with and without dedup.
+
+        Returns:
+            Dict with the number of uploads and blobs, and their total bytes.
+        """
+        with self._lock:
+            uploads, upload_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads"
+            ).fetchone()
+            blobs, blob_bytes = self._connection.execute("""
+                SELECT COUNT(*), COALESCE(SUM(size), 0)
+                FROM (SELECT size FROM uploads GROUP BY sha256)
+                """).fetchone()
+
+        return {
+            "uploads": uploads,
+            "upload_bytes": upload_bytes,
+            "blobs": blobs,
+            "blob_bytes": blob_bytes,
+        }
+
+    def migrate(self) -> int:
+        """Moves files uploaded before the store existed into the store.
+
+        Each file is hashed, linked into its blob and recorded under its
+        name, and only then removed. Blocking.
+
+        Returns:
+            Number of files migrated.
+        """
+        migrated: int = 0
+        if not os.path.isdir(self.legacy_directory):
+            return migrated
+        for entry in os.scandir(self.legacy_directory):
+            # Skip the index and its journal files
+            if not entry.is_file() or entry.name.startswith(INDEX_FILE):
+                continue
+            if self._find(entry.name) is not None:
+                continue
+
+            with open(entry.path, "rb") as file:
+                digest: str = file_digest(file, "sha256").hexdigest()
+            upload: StoredUpload = StoredUpload(
+                entry.name,
+                self.blob_path(digest),
+                digest,
+                entry.stat().st_size,
+                _sniff(entry.path),
+            )
+
+            self._store_blob(entry.path, upload.path)
+            self._record(upload)
+            os.unlink(entry.path)
+            migrated += 1
+
+        return migrated
+
+    def close(self) -> None:
+        """Closes the index."""
+        with self._lock:
+            self._connection.close()
+
+    def _store_blob(self, source: str, path: str) -> bool:
+        """Links a file to its blob path.
+
+        Returns:
+            True if the blob already existed.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source, path)
+        except FileExistsError:
+            return True
+        return False
+
+    def _record(self, upload: StoredUpload) -> None:
+        """Adds an upload to the index."""
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT INTO uploads VALUES (?, ?, ?, ?, ?)",
+                    (
+                        upload.file_name,
+                        upload.sha256,
+                        upload.size,
+                        upload.content_type,
+                        time.time(),
+                    ),
+                )
+        except sqlite3.IntegrityError:
+            # Lost a race with another upload of the same name
+            raise FileExistsError(upload.file_name)
+
+    def _find(self, file_name: str) -> StoredUpload | None:
+        """Looks up an upload in the index."""
+        with self._lock:
+            row: tuple | None = self._connection.execute(
+                "SELECT sha256, size, content_type FROM uploads WHERE file_name = ?",
+                (file_name,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        digest, size, content_type = row
+        return StoredUpload(
+            file_name, self.blob_path(digest), digest, size, content_type
+        )
+
+
+if __name__ == "__main__":
+
+    BASE_DIR: str = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Manage the uploaded images.")
+    parser.add_argument(
+        "--directory",
+        default=os.path.join(BASE_DIR, "uploads"),
+        help="Private directory the index and blobs are stored in.",
+    )
+    parser.add_argument(
+        "--legacy-directory",
+        default=os.path.join(BASE_DIR, "static", "uploaded-images"),
+        help="Directory of the files uploaded before the store existed.",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Move files uploaded before the store existed into the store.",
+    )
+    args = parser.parse_args()
+
+    store = UploadStore(args.directory, args.legacy_directory)
+    if args.migrate:
+        print(f"Migrated {store.migrate()} files.")
+    print(store.usage())
+    store.close()
@@ -0,0 +1,186 @@
+"""Provides the materialized user_data collection.
+
+GET /user-data used to join users to locations with $lookup on every
+request. The user_data collection holds the result of that join instead:
+one document per username with the profile fields and the latest
+location, kept current by the routes that write users and locations, so
+reads are plain indexed queries that can be paginated and filtered by
+viewport.
+
+Profile and location writes each update their own fields, so either can
+arrive first. Like the inner join it replaces, a user is only listed once
+both are known, which is what COMPLETE_FILTER selects. Location writes
+only apply if they are newer than the stored one. The collection can be
+rebuilt from users and locations at any time with the rebuild pipelines.
+"""
+
+from async_store_database import AsyncStoreCollection
+from geo import POSITION_FIELD, POSITION_EXPRESSION, geo_point
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+USER_DATA_COLLECTION: str = "user_data"
+DUPLICATE_KEY: int = 11000
+PROFILE_FIELDS: tuple[str, ...] = ("first_name", "last_name", "email")
+LOCATION_FIELDS: tuple[str, ...] = ("latitude", "longitude", "timestamp")
+# Users whose profile and location are both known
+COMPLETE_FILTER: dict = {
+    "first_name": {"$exists": True},
+    "timestamp": {"$exists": True},
+}
+
+
+def join_pipeline(locations: str = "locations") -> list[dict]:
+    """Returns the $lookup pipeline over users that user_data materializes.
+
+    Args:
+        locations (str, optional): Name of the locations collection.
+    Returns:
+        The pipeline, whose results have the profile fields and the location of each user.
+    """
+    return [
+        {
+            "$lookup": {
+                "from": locations,
+                "localField": "username",
+                "foreignField": "username",
+                "as": "user_data",
+            }
+        },
+        {"$unwind": "$user_data"},
+        {
+            "$project": {
+                "_id": 0,
+                "username": 1,
+                **{field: 1 for field in PROFILE_FIELDS},
+                **{field: f"$user_data.{field}" for field in LOCATION_FIELDS},
+            }
+        },
+    ]
+
+
+def profile_rebuild_pipeline() -> list[dict]:
+    """Returns a pipeline over users that merges their profiles into user_data."""
+    return [
+        {
+            "$project": {
+                "_id": 0,
+                "username": 1,
+                **{field: 1 for field in PROFILE_FIELDS},
+            }
+        },
+        {
+            "$merge": {
+                "into": USER_DATA_COLLECTION,
+                "on": "username",
+                "whenMatched": "merge",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+def location_rebuild_pipeline() -> list[dict]:
+    """Returns a pipeline over locations that merges them into user_data.
+
+    A stored location is only replaced by a newer one, so the rebuild can
+    run while locations are being written.
+    """
+    return [
+        {
+            "$project": {
+                "_id": 0,
+                "username": 1,
+                **{field: 1 for field in LOCATION_FIELDS},
+                POSITION_FIELD: POSITION_EXPRESSION,
+            }
+        },
+        {
+            "$merge": {
+                "into": USER_DATA_COLLECTION,
+                "on": "username",
+                "whenMatched": [
+                    {
+                        "$replaceWith": {
+                            "$cond": [
+                                # A missing timestamp sorts before any number
+                                {"$gt": ["$$new.timestamp", "$timestamp"]},
+                                {"$mergeObjects": ["$$ROOT", "$$new"]},
+                                "$$ROOT",
+                            ]
+                        }
+                    }
+                ],
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+def profile_update(username: str, profile: dict) -> UpdateOne:
+    """Returns the write that stores the profile fields of a user.
+
+    Args:
+        username (str): The username of the user.
+        profile (dict): User fields, only the PROFILE_FIELDS in it are stored.
+    Returns:
+        The write, which creates the user's document if needed.
+    """
+    return UpdateOne(
+        {"username": username},
+        {
+            "$set": {
+                field: profile[field] for field in PROFILE_FIELDS if field in profile
+            }
+        },
+        upsert=True,
+    )
+
+
+def location_update(location: dict) -> UpdateOne:
+    """Returns the write that stores the location of a user.
+
+    Args:
+        location (dict): Location with username, latitude, longitude and timestamp.
+    Returns:
+        The write, which creates the user's document if needed. If the
+        stored location is not older, it fails with a duplicate key error
+        instead of overwriting it.
+    """
+    return UpdateOne(
+        # Matches documents without a location yet, as well as older ones
+        {
+            "username": location["username"],
+            "timestamp": {"$not": {"$gte": location["timestamp"]}},
+        },
+        {
+            "$set": {
+                **{field: location[field] for field in LOCATION_FIELDS},
+                POSITION_FIELD: geo_point(location["latitude"], location["longitude"]),
+            }
+        },
+        upsert=True,
+    )
+
+
+async def apply_writes(
+    collection: AsyncStoreCollection, requests: list[UpdateOne]
+) -> int:
+    """Applies profile and location writes to the user_data collection.
+
+    Args:
+        collection (AsyncStoreCollection): The user_data collection.
+        requests (list[UpdateOne]): Writes from profile_update and location_update.
+    Returns:
+        Number of location writes skipped because the stored one was newer.
+    Raises:
+        BulkWriteError: If a write failed for another reason.
+    """
+    try:
+        await collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        errors: list[dict] = e.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        return len(errors)
+    return 0